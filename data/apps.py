@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+class DataConfig(AppConfig):
+    name = 'data'
+
+    def ready(self):
+        # Register signal handlers
+        import data.signals
@@ -1,5 +1,364 @@
-from django.db import connection
-from data.models import Person, Company
+import datetime
+import heapq
+import re
+import time
+import unicodedata
+from django.db import connection, transaction
+from django.utils import timezone
+from metaphone import doublemetaphone
+from data.models import Person, Company, PersonMatchKey, PersonMatchCandidate
+from data.sql import stream_query
+from shared.coalesce import Superseded
+
+# Webmail domains are shared by too many unrelated people to narrow down the
+# candidate set, so they are not used as blocking keys.
+FREE_EMAIL_DOMAINS = set([
+    'aol.com', 'gmail.com', 'googlemail.com', 'hotmail.com', 'icloud.com',
+    'live.com', 'me.com', 'msn.com', 'outlook.com', 'yahoo.com',
+])
+
+def normalize(s):
+    return s.strip().lower() if s else ''
+
+def get_email_domain(email):
+    email = normalize(email)
+    return email.rsplit('@', 1)[1] if '@' in email else ''
+
+def get_linkedin_slug(linkedin_url):
+    """
+    https://www.linkedin.com/in/jane-doe/?trk=... => jane-doe
+    """
+    url = normalize(linkedin_url).split('?')[0].rstrip('/')
+    return url.rsplit('/', 1)[-1] if url else ''
+
+#############
+# Name keys #
+#############
+
+# Common English nicknames => formal first name, so that e.g. "Bob" and
+# "Robert" get the same first name key
+NICKNAMES = {
+    'abby': 'abigail', 'al': 'albert', 'alex': 'alexander',
+    'andy': 'andrew', 'ben': 'benjamin', 'bill': 'william',
+    'billy': 'william', 'bob': 'robert', 'bobby': 'robert',
+    'charlie': 'charles', 'chris': 'christopher', 'chuck': 'charles',
+    'dan': 'daniel', 'danny': 'daniel', 'dave': 'david', 'dick': 'richard',
+    'ed': 'edward', 'eddie': 'edward', 'fred': 'frederick',
+    'greg': 'gregory', 'jim': 'james', 'jimmy': 'james', 'joe': 'joseph',
+    'jon': 'jonathan', 'kate': 'katherine', 'katie': 'katherine',
+    'ken': 'kenneth', 'larry': 'lawrence', 'liz': 'elizabeth',
+    'matt': 'matthew', 'meg': 'margaret', 'mike': 'michael',
+    'nate': 'nathan', 'nick': 'nicholas', 'pat': 'patrick',
+    'peggy': 'margaret', 'pete': 'peter', 'rich': 'richard',
+    'rick': 'richard', 'rob': 'robert', 'ron': 'ronald', 'sam': 'samuel',
+    'steve': 'steven', 'sue': 'susan', 'ted': 'theodore', 'tom': 'thomas',
+    'tommy': 'thomas', 'tony': 'anthony', 'will': 'william',
+}
+
+# Trailing words that don't distinguish companies ("Acme, Inc." == "Acme")
+LEGAL_SUFFIXES = set([
+    'ag', 'bv', 'co', 'company', 'corp', 'corporation', 'gmbh', 'inc',
+    'incorporated', 'limited', 'llc', 'llp', 'lp', 'ltd', 'nv', 'plc', 'pte',
+    'pty', 'sa', 'sarl', 'srl',
+])
+
+def get_name_key(name):
+    """
+    Casefolded, accent-stripped name with punctuation and extra whitespace
+    removed: u' Jos\xe9  O'Brien ' => u'jose o brien'. Byte strings (e.g.
+    from the Crunchbase CSV) are decoded as UTF-8.
+    """
+    if isinstance(name, str):
+        name = name.decode('utf-8', 'replace')
+    name = unicodedata.normalize('NFKD', unicode(name or u''))
+    name = u''.join(c for c in name if not unicodedata.combining(c))
+    return u' '.join(re.findall(r'\w+', name.lower(), re.UNICODE))
+
+def get_first_name_key(first_name):
+    key = get_name_key(first_name)
+    return NICKNAMES.get(key, key)
+
+def get_company_name_key(name):
+    words = get_name_key(name).split()
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    return u' '.join(words)
+
+def get_phonetic_codes(key):
+    """
+    Returns:
+        [str]: Space separated Double Metaphone codes (primary, then
+               alternate if any) of the name key @key, e.g. 'SM0 XMT' for
+               'smith'.
+    """
+    return u' '.join(code for code in doublemetaphone(key) if code) if key \
+        else u''
+
+def get_person_keys(first_name, last_name):
+    """
+    Returns:
+        [dict]: Person name key fields for @first_name and @last_name.
+    """
+    first_name_key = get_first_name_key(first_name)
+    last_name_key = get_name_key(last_name)
+    return {
+        'first_name_key': first_name_key,
+        'last_name_key': last_name_key,
+        'first_name_phonetic': get_phonetic_codes(first_name_key),
+        'last_name_phonetic': get_phonetic_codes(last_name_key),
+    }
+
+def get_company_keys(name):
+    """
+    Returns:
+        [dict]: Company name key fields for @name.
+    """
+    name_key = get_company_name_key(name)
+    return {
+        'name_key': name_key,
+        'name_phonetic': get_phonetic_codes(name_key),
+    }
+
+def set_person_keys(person):
+    for field, value in get_person_keys(person.first_name,
+                                        person.last_name).iteritems():
+        setattr(person, field, value)
+
+def set_company_keys(company):
+    for field, value in get_company_keys(company.name).iteritems():
+        setattr(company, field, value)
+
+def is_phonetic_match(codes1, codes2):
+    """
+    Whether two get_phonetic_codes values share a code, i.e. the names sound
+    alike.
+    """
+    return bool(codes1 and codes2 and
+                set(codes1.split()).intersection(codes2.split()))
+
+###################
+# Person blocking #
+###################
+
+def get_match_keys(first_name_key, last_name_key, last_name_phonetic, email,
+                   linkedin_url, company_keys):
+    """
+    Args:
+        first_name_key, last_name_key, last_name_phonetic [str]: See
+            get_person_keys.
+        company_keys [list]: Company name keys (see get_company_keys).
+
+    Returns:
+        [set]: Blocking keys for a person: set([(<PersonMatchKey type>, key),
+               ...]). Empty values don't produce keys.
+    """
+    TYPES = PersonMatchKey.TYPES
+    email_domain = get_email_domain(email)
+    if email_domain in FREE_EMAIL_DOMAINS:
+        email_domain = ''
+    keys = set([
+        (TYPES['First Name'], first_name_key),
+        (TYPES['Last Name'], last_name_key),
+        (TYPES['Email Domain'], email_domain),
+        (TYPES['LinkedIn'], get_linkedin_slug(linkedin_url)),
+    ] + [(TYPES['Last Name Phonetic'], code)
+         for code in (last_name_phonetic or '').split()]
+      + [(TYPES['Company'], company) for company in company_keys])
+    return set([(key_type, key) for key_type, key in keys if key])
+
+def index_person(person):
+    """
+    Rebuilds the PersonMatchKey and PersonMatchCandidate rows for @person.
+    Called whenever a Person, one of its Employment rows or an employer
+    Company is written (see data.signals).
+    """
+    CANDIDATE_FIELDS = ['account_id', 'employment_id', 'first_name',
+                        'last_name', 'first_name_phonetic',
+                        'last_name_phonetic', 'email', 'location', 'company',
+                        'linkedin_url']
+
+    if person.first_name_key is None:
+        # Not backfilled yet (see the rebuild_match_index command)
+        set_person_keys(person)
+    employment = [
+        (employment_id,
+         company_key if company_key is not None
+         else get_company_name_key(company))
+        for employment_id, company, company_key
+        in person.employment.values_list('id', 'company__name',
+                                         'company__name_key')
+    ]
+    keys = get_match_keys(person.first_name_key, person.last_name_key,
+                          person.last_name_phonetic, person.email,
+                          person.linkedin_url,
+                          [company_key for _, company_key in employment])
+    candidates = set([
+        (person.account_id, employment_id, person.first_name_key,
+         person.last_name_key, person.first_name_phonetic or None,
+         person.last_name_phonetic or None, normalize(person.email) or None,
+         normalize(person.location) or None, company_key or None,
+         normalize(person.linkedin_url) or None)
+        for employment_id, company_key in employment
+    ])
+
+    existing_keys = set(person.match_keys.filter(account=person.account_id)
+                                         .values_list('type', 'key'))
+    existing_candidates = set(person.match_candidates.values_list(
+        *CANDIDATE_FIELDS
+    ))
+    if keys == existing_keys and candidates == existing_candidates:
+        return
+
+    with transaction.atomic():
+        person.match_keys.all().delete()
+        PersonMatchKey.objects.bulk_create([
+            PersonMatchKey(account_id=person.account_id, person=person,
+                           type=key_type, key=key)
+            for key_type, key in keys
+        ])
+        person.match_candidates.all().delete()
+        PersonMatchCandidate.objects.bulk_create([
+            PersonMatchCandidate(person=person,
+                                 **dict(zip(CANDIDATE_FIELDS, candidate)))
+            for candidate in candidates
+        ])
+
+# Minimum trigram similarity for a company name to be considered a match
+# candidate. On PostgreSQL this must not be lower than
+# pg_trgm.similarity_threshold (0.3 by default), which the indexed % operator
+# uses.
+TRIGRAM_THRESHOLD = 0.3
+
+def get_ngrams(s, n=3):
+    """
+    Padded character n-grams, similar to pg_trgm:
+    'abc' => set(['  a', ' ab', 'abc', 'bc '])
+    """
+    s = normalize(s)
+    if not s:
+        return set([])
+    s = ' ' * (n - 1) + s + ' '
+    return set(s[i:i + n] for i in range(len(s) - n + 1))
+
+class NGramIndex(object):
+    """
+    In-process inverted n-gram index (n-gram => ids) used to shortlist
+    similar strings without scanning all of them. Fallback for databases
+    without the pg_trgm extension.
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self.index = {} # n-gram => set of ids
+        self.grams = {} # id => set of n-grams
+
+    def add(self, obj_id, s):
+        self.remove(obj_id)
+        grams = get_ngrams(s, self.n)
+        self.grams[obj_id] = grams
+        for gram in grams:
+            self.index.setdefault(gram, set([])).add(obj_id)
+
+    def remove(self, obj_id):
+        for gram in self.grams.pop(obj_id, []):
+            self.index[gram].discard(obj_id)
+
+    def search(self, s, threshold):
+        """
+        Returns:
+            [list]: Ids whose n-gram similarity (shared / total n-grams) with
+                    @s is at least @threshold.
+        """
+        grams = get_ngrams(s, self.n)
+        shared = {}
+        for gram in grams:
+            for obj_id in self.index.get(gram, []):
+                shared[obj_id] = shared.get(obj_id, 0) + 1
+        return [
+            obj_id for obj_id, ct in shared.iteritems()
+            if float(ct) / (len(grams) + len(self.grams[obj_id]) - ct)
+            >= threshold
+        ]
+
+_has_pg_trgm = None
+
+def has_pg_trgm():
+    global _has_pg_trgm
+    if connection.vendor != 'postgresql':
+        return False
+    if _has_pg_trgm is None:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname='pg_trgm'")
+        _has_pg_trgm = cursor.fetchone() is not None
+    return _has_pg_trgm
+
+# Seconds between refreshes of a company name index. Writes made by this
+# process are indexed immediately (see index_company_name); a refresh only
+# reads the companies updated since the previous one (overlapping by as much,
+# for transactions that were still open), so this bounds how long companies
+# written by other processes (web workers, run_jobs) can't be matched.
+# Companies deleted by other processes stay in the index, which is harmless:
+# their ids no longer match a row.
+COMPANY_NAME_INDEX_TTL = 60
+
+# Per-process company name key indexes for the pg_trgm fallback:
+# { [account_id]: [NGramIndex] }. Built lazily and kept up to date by the
+# Company signals in data.signals. Keys (see get_company_name_key) are
+# indexed, as in the bulk matching paths and the pg_trgm index, so that e.g.
+# 'Acme, Inc.' and 'Acme' shortlist the same companies.
+_company_name_indexes = {}
+
+def get_company_name_index(account_id):
+    index = _company_name_indexes.get(account_id)
+    now = time.time()
+    companies = Company.objects.filter(account=account_id)
+    if index is None:
+        index = NGramIndex()
+    elif now - index.refreshed_at > COMPANY_NAME_INDEX_TTL:
+        since = datetime.datetime.fromtimestamp(
+            index.refreshed_at - COMPANY_NAME_INDEX_TTL, timezone.utc
+        )
+        companies = companies.filter(updated_at__gte=since)
+    else:
+        return index
+    for company_id, name, name_key in (companies.values_list('id', 'name',
+                                                             'name_key')
+                                                .iterator()):
+        index.add(company_id, name_key if name_key is not None
+                              else get_company_name_key(name))
+    index.refreshed_at = now
+    _company_name_indexes[account_id] = index
+    return index
+
+def index_company_name(company, deleted=False):
+    index = _company_name_indexes.get(company.account_id)
+    if index is None:
+        return
+    if deleted:
+        index.remove(company.id)
+    else:
+        index.add(company.id, get_company_name_key(company.name))
+
+def get_company_name_filter(account, name, threshold=TRIGRAM_THRESHOLD):
+    """
+    Returns:
+        [tuple]: (SQL clause on data_company c, params) restricting companies
+                 to those whose name key is trigram-similar to @name's, or
+                 None if there can't be any.
+    """
+    name_key = get_company_name_key(name)
+    if not name_key:
+        return None
+    if has_pg_trgm():
+        # Uses the data_company_name_key_trgm GIN index
+        return ('c.name_key %% %s AND similarity(c.name_key, %s) >= %s',
+                [name_key, name_key, threshold])
+    company_ids = get_company_name_index(account.id).search(name_key,
+                                                            threshold)
+    if not company_ids:
+        return None
+    return ('c.id IN (%s)' % ','.join(['%s'] * len(company_ids)),
+            company_ids)
 
 def jaccard(s1, s2):
     set_s1 = set(s1)
@@ -27,7 +386,200 @@ def levenshtein(s1, s2, limit=100):
         previous_row = current_row
     return previous_row[-1]
 
-def match_person(data, account, count=1):
+class LevenshteinScorer(object):
+    """
+    Bit-parallel (Myers/Hyyro) edit distance of one target against many
+    candidate strings. Drop-in replacement for levenshtein(target, candidate,
+    limit): the target's character bitmasks are built once, after which each
+    candidate costs O(len(candidate)) integer operations, and scoring stops as
+    soon as the distance is guaranteed to exceed @limit (returns @limit).
+    """
+
+    def __init__(self, target, limit=100):
+        self.target = target.lower() if target else ''
+        self.limit = limit
+        self.peq = {}
+        for i, c in enumerate(self.target):
+            self.peq[c] = self.peq.get(c, 0) | (1 << i)
+        self.mask = (1 << len(self.target)) - 1
+        self.high = 1 << (len(self.target) - 1) if self.target else 0
+
+    def __call__(self, candidate):
+        # Same conventions as levenshtein(): skip if the target is empty,
+        # compare against '' if the candidate is empty.
+        if not self.target:
+            return 0
+        candidate = candidate.lower() if candidate else ''
+        (m, n, limit) = (len(self.target), len(candidate), self.limit)
+        if abs(m - n) > limit:
+            return limit
+
+        (peq, mask, high) = (self.peq, self.mask, self.high)
+        (pv, mv, score) = (mask, 0, m)
+        for j, c in enumerate(candidate):
+            eq = peq.get(c, 0)
+            xv = eq | mv
+            xh = ((((eq & pv) + pv) ^ pv) | eq) & mask
+            ph = mv | (~(xh | pv) & mask)
+            mh = pv & xh
+            if ph & high:
+                score += 1
+            elif mh & high:
+                score -= 1
+            # Distance can drop by at most one per remaining character
+            if score - (n - j - 1) > limit:
+                return limit
+            ph = ((ph << 1) | 1) & mask
+            mh = (mh << 1) & mask
+            pv = mh | (~(xv | ph) & mask)
+            mv = ph & xv
+        return min(score, limit)
+
+    def batch(self, candidates):
+        return [self(candidate) for candidate in candidates]
+
+def select_top(scored, count):
+    """
+    Bounded top-k selection over a stream of (score, id) pairs that keeps the
+    best score per id. Ties go to the earliest pair, like a stable sort.
+    Memory is O(@count) regardless of the length of the stream.
+
+    Returns:
+        [list]: Up to @count distinct ids in ascending score order (best
+                matches have smaller scores).
+    """
+    if count <= 0:
+        return []
+    heap = [] # Max-heap of (-score, -seq, id) of the current best @count
+    best = {} # id => (score, seq) for ids in the heap
+    for seq, (score, obj_id) in enumerate(scored):
+        if obj_id in best:
+            if score >= best[obj_id][0]:
+                continue
+            heap.remove((-best[obj_id][0], -best[obj_id][1], obj_id))
+            heapq.heapify(heap)
+        elif len(heap) >= count:
+            if score >= -heap[0][0]:
+                continue
+            _, _, evicted_id = heapq.heappop(heap)
+            del best[evicted_id]
+        heapq.heappush(heap, (-score, -seq, obj_id))
+        best[obj_id] = (score, seq)
+    return [obj_id for _, _, obj_id in sorted(heap, reverse=True)]
+
+def get_in_order(model, ids):
+    """
+    Fetches @ids with a single query, preserving the order of @ids.
+    """
+    objs = model.objects.in_bulk(ids)
+    return [objs[obj_id] for obj_id in ids if obj_id in objs]
+
+def check_cancelled(rows, is_cancelled, every=500):
+    """
+    Passes @rows through, raising Superseded if is_cancelled() becomes True
+    (checked every @every rows).
+    """
+    for i, row in enumerate(rows):
+        if is_cancelled and i % every == 0 and is_cancelled():
+            raise Superseded('Match cancelled')
+        yield row
+
+class NameScorer(LevenshteinScorer):
+    """
+    LevenshteinScorer over name keys with cheap first-pass comparisons: equal
+    keys score 0 without computing the distance, and names that sound alike
+    (see is_phonetic_match) score at most 1.
+    """
+
+    def __init__(self, key, phonetic, limit=100):
+        super(NameScorer, self).__init__(key, limit)
+        self.phonetic = phonetic
+
+    def __call__(self, key, phonetic=None):
+        if key == self.target:
+            return 0
+        score = super(NameScorer, self).__call__(key)
+        if score > 1 and is_phonetic_match(self.phonetic, phonetic):
+            return 1
+        return score
+
+def score_people(data, rows):
+    """
+    Scores PersonMatchCandidate rows against the match_person input @data.
+
+    Args:
+        rows [iterable]: (person_id, first_name, last_name,
+                         first_name_phonetic, last_name_phonetic, email,
+                         location, company, linkedin_url) tuples.
+    Yields:
+        [tuple]: (score, person_id). Smaller scores are better matches.
+    """
+    keys = get_person_keys(data['first_name'], data['last_name'])
+    first_name_scorer = NameScorer(keys['first_name_key'],
+                                   keys['first_name_phonetic'])
+    last_name_scorer = NameScorer(keys['last_name_key'],
+                                  keys['last_name_phonetic'])
+    company_scorer = LevenshteinScorer(get_company_name_key(data['company']))
+    email_scorer = LevenshteinScorer(data['email'])
+
+    for row in rows:
+        person_id, first_name, last_name, first_name_phonetic, \
+            last_name_phonetic, email, location, company, linkedin_url = row
+        score = (first_name_scorer(first_name, first_name_phonetic) +
+                 last_name_scorer(last_name, last_name_phonetic) +
+                 company_scorer(company) + email_scorer(email))
+        yield (score, person_id)
+
+def score_companies(data, rows):
+    """
+    Scores company rows against the match_company input @data.
+
+    Args:
+        rows [iterable]: (company_id, name_key, name_phonetic, segment,
+                         sector, location) tuples.
+    Yields:
+        [tuple]: (score, company_id). Smaller scores are better matches.
+    """
+    keys = get_company_keys(data['name'])
+    if not keys['name_key']:
+        return
+    name_scorer = NameScorer(keys['name_key'], keys['name_phonetic'])
+    scorers = {
+        field: LevenshteinScorer(data[field])
+        for field in ['segment', 'sector', 'location']
+    }
+
+    def threshold(name_key):
+        """
+        Filters the trigram shortlist to only attempt to match most relevant
+        ones
+        """
+        return jaccard(keys['name_key'], name_key) > 0.9
+
+    def calculate_similarity(scorers, comp_data):
+        return sum(scorer(comp_data[field])
+                   for field, scorer in scorers.iteritems())
+
+    for row in rows:
+        company_id, name_key, name_phonetic, segment, sector, location = row
+        comp_data = {
+            'id': company_id,
+            'segment': segment,
+            'sector': sector,
+            'location': location,
+        }
+        if threshold(name_key):
+            yield (name_scorer(name_key, name_phonetic) +
+                   calculate_similarity(scorers, comp_data), company_id)
+
+def get_person_query_keys(data):
+    keys = get_person_keys(data['first_name'], data['last_name'])
+    return get_match_keys(keys['first_name_key'], keys['last_name_key'],
+                          keys['last_name_phonetic'], data['email'],
+                          data['linkedin_url'],
+                          [get_company_name_key(data['company'])])
+
+def match_person(data, account, count=1, is_cancelled=None):
     """
     Args:
         data [dict]: {
@@ -39,80 +591,41 @@ def match_person(data, account, count=1):
             'linkedin_url': [str],
         }
         count [int]: Number of results to return.
+        is_cancelled [function]: Optional. Matching stops with Superseded
+                                 once is_cancelled() returns True.
 
     Returns:
         [list]: Up to @count person objects that are the closest matches to
                 the input @data: [<Person>, <Person>, ...].
     """
+    # Only people sharing at least one blocking key with the input are
+    # candidates (see PersonMatchKey)
+    keys = get_person_query_keys(data)
+    if not keys:
+        return []
 
-    def threshold(target_data, comp_data):
-        """Filters dataset to only attempt to match most relevant ones"""
-        return (target_data['first_name'] == comp_data['first_name']
-                or target_data['last_name'] == comp_data['last_name']
-                or target_data['company'] == comp_data['company']
-                or target_data['linkedin_url'] == comp_data['linkedin_url'])
-
-    def calculate_similarity(target_data, comp_data):
-        return (
-            levenshtein(target_data['first_name'], comp_data['first_name'])
-            + levenshtein(target_data['last_name'], comp_data['last_name'])
-            + levenshtein(target_data['company'], comp_data['company'])
-            + levenshtein(target_data['email'], comp_data['email'])
-        )
-
-    def get_records(score_tuples, count):
-        results = []
-        person_ids = set([])
-        for score, score_tuple in score_tuples:
-            if len(results) >= count:
-                break
-            if score_tuple['id'] not in person_ids:
-                results.append(Person.objects.get(id=score_tuple['id']))
-                person_ids.add(score_tuple['id'])
-        return results
-
-    matches = []
-    # Raw SQL for performance
-    # TODO: Cache this query in a materialized view
+    # Raw SQL for performance. Candidates are read from the denormalized
+    # PersonMatchCandidate table rather than joining Person, Employment and
+    # Company.
+    KEY_CLAUSE = ' OR '.join(['(k.type=%s AND k.key=%s)'] * len(keys))
     RAW_SQL = '''
-SELECT p.id, p.first_name, p.last_name, p.email, p.location, c.name, p.linkedin_url
-FROM data_person p
-JOIN data_employment e ON p.id=e.person_id
-JOIN data_company c on c.id=e.company_id
-WHERE p.account_id=%s
-'''
-    cursor = connection.cursor()
-    cursor.execute(RAW_SQL, str(account.id))
-
-    target_data = {
-        'first_name': data['first_name'],
-        'last_name': data['last_name'],
-        'email': data['email'],
-        'location': data['location'],        
-        'company': data['company'],
-        'linkedin_url': data['linkedin_url'],
-    }
+SELECT mc.person_id, mc.first_name, mc.last_name, mc.first_name_phonetic,
+       mc.last_name_phonetic, mc.email, mc.location, mc.company,
+       mc.linkedin_url
+FROM data_personmatchcandidate mc
+WHERE mc.account_id=%%s AND mc.person_id IN (
+    SELECT k.person_id FROM data_personmatchkey k
+    WHERE k.account_id=%%s AND (%s)
+)
+''' % KEY_CLAUSE
+    params = [account.id, account.id] + [v for key in keys for v in key]
 
-    for row in cursor.fetchall():
-        person_id, first_name, last_name, email, location, company, \
-            linkedin_url = row
-        comp_data = {
-            'id': person_id,
-            'first_name': first_name,
-            'last_name': last_name,
-            'location': location,
-            'email': email,
-            'company': company,
-            'linkedin_url': linkedin_url,
-        }
-        if threshold(target_data, comp_data):
-            matches.append((calculate_similarity(target_data, comp_data),
-                            comp_data))
+    return get_in_order(Person, select_top(
+        score_people(data, check_cancelled(stream_query(RAW_SQL, params),
+                                           is_cancelled)), count
+    ))
 
-    # Sort matches in ascending order (best matches have smaller scores)
-    return get_records(sorted(matches, key=lambda x: x[0]), count)
-
-def match_company(data, account, count=1):
+def match_company(data, account, count=1, is_cancelled=None):
     """
     Args:
         data [dict]: {
@@ -122,64 +635,265 @@ def match_company(data, account, count=1):
             'location': [str],
         }
         count [int]: Number of results to return.
+        is_cancelled [function]: Optional. Matching stops with Superseded
+                                 once is_cancelled() returns True.
 
     Returns:
         [list]: Up to @count company objects that are the closest matches to
                 the input @data: [<Company>, <Company>, ...].
     """
+    # Only companies with a trigram-similar name are candidates
+    name_filter = get_company_name_filter(account, data['name'])
+    if name_filter is None:
+        return []
+    NAME_CLAUSE, name_params = name_filter
+
+    # Raw SQL for performance
+    RAW_SQL = '''
+SELECT c.id, COALESCE(c.name_key, LOWER(c.name)), c.name_phonetic, c.segment,
+       c.sector, c.location
+FROM data_company c
+WHERE c.account_id=%%s AND %s
+''' % NAME_CLAUSE
+    params = [account.id] + name_params
+
+    return get_in_order(Company, select_top(
+        score_companies(data, check_cancelled(stream_query(RAW_SQL, params),
+                                              is_cancelled)), count
+    ))
+
+#################
+# Bulk matching #
+#################
+
+# Candidate set of a bulk matching worker process (see _match_bulk)
+_bulk_candidates = None
 
-    def threshold(target_data, comp_data):
-        """Filters dataset to only attempt to match most relevant ones"""
-        return jaccard(target_data['name'], comp_data['name']) > 0.9
+def _init_bulk_worker(candidates):
+    # Pool workers are forked, so @candidates is inherited, not pickled
+    global _bulk_candidates
+    _bulk_candidates = candidates
 
-    def calculate_similarity(target_data, comp_data):
-        return (
-            levenshtein(target_data['name'], comp_data['name'])
-            + levenshtein(target_data['segment'], comp_data['segment'])
-            + levenshtein(target_data['sector'], comp_data['sector'])
-            + levenshtein(target_data['location'], comp_data['location'])
+def _match_person_ids(args, candidates=None):
+    data, count = args
+    (rows, blocks) = candidates or _bulk_candidates
+    person_ids = set([])
+    for key in get_person_query_keys(data):
+        person_ids.update(blocks.get(key, []))
+    return select_top(score_people(data, (row for person_id in person_ids
+                                          for row in rows[person_id])),
+                      count)
+
+def _match_company_ids(args, candidates=None):
+    data, count = args
+    (rows, index) = candidates or _bulk_candidates
+    name_key = get_company_name_key(data['name'])
+    if not name_key:
+        return []
+    company_ids = index.search(name_key, TRIGRAM_THRESHOLD)
+    return select_top(score_companies(data, (rows[company_id]
+                                             for company_id in company_ids)),
+                      count)
+
+def _match_bulk(model, match_ids, candidates, queries, count, processes,
+                chunk_size):
+    """
+    Scores @queries with @match_ids against @candidates, optionally across a
+    pool of @processes worker processes, and yields the matched @model
+    objects for each query in input order. Objects are fetched with one query
+    per @chunk_size queries.
+    """
+    args = ((data, count) for data in queries)
+    pool = None
+    if processes and processes > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes, initializer=_init_bulk_worker,
+                                    initargs=(candidates,))
+        results = pool.imap(match_ids, args, chunksize=100)
+    else:
+        results = (match_ids(arg, candidates) for arg in args)
+
+    def fetch(chunk):
+        objs = model.objects.in_bulk(
+            [obj_id for obj_ids in chunk for obj_id in obj_ids]
         )
+        return [[objs[obj_id] for obj_id in obj_ids if obj_id in objs]
+                for obj_ids in chunk]
 
-    def get_records(score_tuples, count):
-        results = []
-        company_ids = set([])
-        for score, score_tuple in score_tuples:
-            if len(results) >= count:
-                break
-            if score_tuple['id'] not in company_ids:
-                results.append(Company.objects.get(id=score_tuple['id']))
-                company_ids.add(score_tuple['id'])
-        return results
-
-    matches = []
-    # Raw SQL for performance
-    # TODO: Cache this query in a materialized view
-    RAW_SQL = '''
-SELECT c.id, c.name, c.segment, c.sector, c.location FROM data_company c
+    try:
+        chunk = []
+        for obj_ids in results:
+            chunk.append(obj_ids)
+            if len(chunk) >= chunk_size:
+                for objs in fetch(chunk):
+                    yield objs
+                chunk = []
+        for objs in fetch(chunk):
+            yield objs
+    finally:
+        if pool:
+            pool.terminate()
+
+def match_people_bulk(queries, account, count=1, processes=None,
+                      chunk_size=500):
+    """
+    Batch version of match_person for imports: loads @account's candidate set
+    and blocking keys once, then scores every query against the candidates
+    sharing one of its blocking keys.
+
+    Args:
+        queries [iterable]: match_person @data dicts.
+        processes [int]: Optional. Number of worker processes to score with.
+
+    Yields:
+        [list]: Up to @count person objects per query, in input order.
+    """
+    rows = {}
+    for row in stream_query('''
+SELECT mc.person_id, mc.first_name, mc.last_name, mc.first_name_phonetic,
+       mc.last_name_phonetic, mc.email, mc.location, mc.company,
+       mc.linkedin_url
+FROM data_personmatchcandidate mc WHERE mc.account_id=%s
+''', [account.id]):
+        rows.setdefault(row[0], []).append(row)
+
+    blocks = {}
+    for person_id, key_type, key in stream_query('''
+SELECT k.person_id, k.type, k.key
+FROM data_personmatchkey k WHERE k.account_id=%s
+''', [account.id]):
+        if person_id in rows:
+            blocks.setdefault((key_type, key), []).append(person_id)
+
+    return _match_bulk(Person, _match_person_ids, (rows, blocks), queries,
+                       count, processes, chunk_size)
+
+def match_companies_bulk(queries, account, count=1, processes=None,
+                         chunk_size=500):
+    """
+    Batch version of match_company for imports: loads @account's companies
+    and builds an in-memory NGramIndex of their name keys once, then scores every
+    query against its trigram shortlist.
+
+    Args:
+        queries [iterable]: match_company @data dicts.
+        processes [int]: Optional. Number of worker processes to score with.
+
+    Yields:
+        [list]: Up to @count company objects per query, in input order.
+    """
+    rows = {}
+    index = NGramIndex()
+    for row in stream_query('''
+SELECT c.id, COALESCE(c.name_key, LOWER(c.name)), c.name_phonetic, c.segment,
+       c.sector, c.location
+FROM data_company c
 WHERE c.account_id=%s
-'''
-    cursor = connection.cursor()
-    cursor.execute(RAW_SQL, str(account.id))
-
-    target_data = {
-        'name': data['name'],
-        'segment': data['segment'],
-        'sector': data['sector'],
-        'location': data['location'],
-    }
+''', [account.id]):
+        rows[row[0]] = row
+        index.add(row[0], row[1])
 
-    for row in cursor.fetchall():
-        company_id, name, segment, sector, location = row
-        comp_data = {
-            'id': company_id,
-            'name': name,
-            'segment': segment,
-            'sector': sector,
-            'location': location,
-        }
-        if threshold(target_data, comp_data):
-            matches.append((calculate_similarity(target_data, comp_data),
-                            comp_data))
+    return _match_bulk(Company, _match_company_ids, (rows, index), queries,
+                       count, processes, chunk_size)
+
+###################
+# Record matching #
+###################
+
+def get_website_domain(website):
+    """
+    'https://www.Example.com:443/about' => 'example.com'
+    """
+    url = normalize(website)
+    if '://' in url:
+        url = url.split('://', 1)[1]
+    domain = re.split(r'[/?#:]', url, 1)[0]
+    return domain[4:] if domain.startswith('www.') else domain
+
+# Social networks and hosting services are the website of many unrelated
+# records (e.g. a Facebook page or a *.wordpress.com blog), so their domains
+# and subdomains are not used to match records.
+SHARED_WEBSITE_DOMAINS = set([
+    'angel.co', 'blogspot.com', 'crunchbase.com', 'facebook.com',
+    'github.com', 'github.io', 'herokuapp.com', 'instagram.com',
+    'linkedin.com', 'medium.com', 'sites.google.com', 'squarespace.com',
+    'tumblr.com', 'twitter.com', 'weebly.com', 'wix.com', 'wixsite.com',
+    'wordpress.com', 'youtube.com',
+])
+
+def get_matching_domain(website):
+    """
+    get_website_domain, or '' if the domain is shared (see
+    SHARED_WEBSITE_DOMAINS).
+
+    'https://acme.wordpress.com/about' => ''
+    """
+    domain = get_website_domain(website)
+    parts = domain.split('.')
+    if any('.'.join(parts[i:]) in SHARED_WEBSITE_DOMAINS
+           for i in range(len(parts))):
+        return ''
+    return domain
+
+class RecordMatcher(object):
+    """
+    Inverted indexes over the values of a custom table's records (in the
+    data.sql.get_custom_data format, values of every source), built once so
+    that rows from a source can be resolved to records without scanning all
+    of them:
+
+        * Company name key (see get_company_name_key) => record ids
+        * Website domain (see get_matching_domain) => record ids
+        * Optionally, an NGramIndex of the name keys for fuzzy matches
+    """
+
+    def __init__(self, data_map, name_field, website_field=None, fuzzy=False,
+                 max_distance=2):
+        self.names = {}
+        self.domains = {}
+        self.name_keys = {} # record id => set of name keys
+        self.ngrams = NGramIndex() if fuzzy else None
+        self.max_distance = max_distance
+        # Ascending ids, so that the oldest record wins ties
+        for record_id in sorted(data_map):
+            values = data_map[record_id]
+            for value in values.get(name_field, []):
+                key = get_company_name_key(value['value'])
+                if key:
+                    self.names.setdefault(key, []).append(record_id)
+                    self.name_keys.setdefault(record_id, set([])).add(key)
+            for value in values.get(website_field, []):
+                domain = get_matching_domain(value['value'])
+                if domain:
+                    self.domains.setdefault(domain, []).append(record_id)
+            if self.ngrams:
+                self.ngrams.add(record_id,
+                                ' '.join(self.name_keys.get(record_id, [])))
+
+    def match(self, name, website=None):
+        """
+        Returns:
+            [list]: Ids of the records matching @name exactly (after
+                    normalization), or else @website's domain (unless it is
+                    shared, see get_matching_domain), or else (if fuzzy)
+                    the records whose name key is closest to @name's within
+                    max_distance edits. Oldest records first.
+        """
+        key = get_company_name_key(name)
+        if key and key in self.names:
+            return list(self.names[key])
+        domain = get_matching_domain(website)
+        if domain and domain in self.domains:
+            return list(self.domains[domain])
+        if not key or self.ngrams is None:
+            return []
 
-    # Sort matches in ascending order (best matches have smaller scores)
-    return get_records(sorted(matches, key=lambda x: x[0]), count)
+        scorer = NameScorer(key, get_phonetic_codes(key),
+                            limit=self.max_distance + 1)
+        scored = []
+        for record_id in self.ngrams.search(key, TRIGRAM_THRESHOLD):
+            score = min(scorer(record_key, get_phonetic_codes(record_key))
+                        for record_key in self.name_keys[record_id])
+            if score <= self.max_distance:
+                scored.append((score, record_id))
+        return [record_id for _, record_id in sorted(scored)]
@@ -1,12 +1,29 @@
-import os
+import collections
 import csv
+import multiprocessing
+import os
+import threading
 import time
 import requests
+from cStringIO import StringIO
+from requests.adapters import HTTPAdapter
+from multiprocessing.pool import ThreadPool
+from django.db import connection, models, transaction
+from django.utils import timezone
+from data.entity import index_company_name, set_company_keys
+from data.integrations.snapshot import ColumnarSnapshot, write_snapshot
 from data.models import create_defaults_hash
-from data.models import Company, Investor, DEFAULT_ACCOUNT_ID
+from data.models import Company, Employment, Investor, DEFAULT_ACCOUNT_ID
+from data.signals import reindex_person
 
 ORGANIZATION_API_URL = 'https://api.crunchbase.com/v/3/odm-organizations'
+API_RATE_LIMIT = 200 / 60.0 # Calls per second
+API_WORKERS = 4 # Concurrent page fetches
+API_TIMEOUT = 60 # Seconds
+API_MAX_WAIT = 1024 # Seconds, longest backoff before a page is given up
 ORGANIZATION_CSV_PATH = 'files/crunchbase/organizations.csv'
+# Columnar copy of the CSV, see build_organizations_snapshot
+ORGANIZATION_SNAPSHOT_PATH = 'files/crunchbase/organizations.snapshot'
 
 # Map of models to the available fields in the model's response.
 API_MAP = {
@@ -14,6 +31,16 @@ API_MAP = {
                      'profile_image_url', 'location_city', 'short_description']
 }
 
+# Company field => organization property
+COMPANY_FIELD_MAP = {
+    'name': 'name',
+    'crunchbase_permalink': 'permalink',
+    'logo_url': 'profile_image_url',
+    'location': 'city_name',
+    'website': 'homepage_url',
+    'description': 'short_description',
+}
+
 def create_organization(crunchbase_id, data):
     """
     Args:
@@ -21,16 +48,9 @@ def create_organization(crunchbase_id, data):
         data [dict]: The 'properties' hash in a JSON response
     """
     # TODO: Entity resolution
-    company_defaults = create_defaults_hash(data, {
-        'name': 'name',
-        'permalink': 'crunchbase_permalink',
-        'logo_url': 'profile_image_url',
-        'location': 'city_name',
-        'website': 'homepage_url',
-        'description': 'short_description',
-    })
+    company_defaults = create_defaults_hash(data, COMPANY_FIELD_MAP)
     company, _ = Company.objects.update_or_create(
-        account=DEFAULT_ACCOUNT_ID,
+        account_id=DEFAULT_ACCOUNT_ID,
         crunchbase_id=crunchbase_id,
         defaults=company_defaults
     )
@@ -40,13 +60,249 @@ def create_organization(crunchbase_id, data):
         })
         investor_defaults.update({ 'type': 'COMPANY' })
         Investor.objects.update_or_create(
-            account=DEFAULT_ACCOUNT_ID,
+            account_id=DEFAULT_ACCOUNT_ID,
             company=company,
             defaults=investor_defaults
         )
 
-def get_organizations(poll=True, wait=1, **params):
+class OrganizationWriter(object):
+    """
+    Batch version of create_organization. The crunchbase_id => Company id
+    and Company id => Investor id maps of DEFAULT_ACCOUNT_ID are loaded once,
+    then organizations are split into inserts (bulk_create) and updates (one
+    INSERT ... ON CONFLICT statement per UPSERT_BATCH_SIZE rows, PostgreSQL
+    9.5+ or SQLite 3.24+), @chunk_size per transaction. Investors are written
+    after the companies of each chunk.
+
+    As with create_organization, null properties don't overwrite existing
+    values. Bulk writes skip the Company signals, so their work (name keys,
+    name index, reindexing the employees of renamed companies) is done here.
+    """
+
+    UPSERT_BATCH_SIZE = 500
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.company_ids = dict(
+            Company.objects.filter(account_id=DEFAULT_ACCOUNT_ID,
+                                   crunchbase_id__isnull=False)
+                           .values_list('crunchbase_id', 'id')
+        )
+        self.investor_ids = dict(
+            Investor.objects.filter(account_id=DEFAULT_ACCOUNT_ID,
+                                    company__isnull=False)
+                            .values_list('company_id', 'id')
+        )
+
+    def write(self, organizations):
+        """
+        Args:
+            organizations [iterable]: (crunchbase_id, data) pairs, as passed
+                                      to create_organization. Later pairs
+                                      win if an id is repeated.
+
+        Returns:
+            [int]: Number of organizations written.
+        """
+        ct = 0
+        chunk = collections.OrderedDict()
+        for crunchbase_id, data in organizations:
+            chunk[crunchbase_id] = data
+            if len(chunk) >= self.chunk_size:
+                ct += self.__write_chunk(chunk)
+                chunk = collections.OrderedDict()
+        if chunk:
+            ct += self.__write_chunk(chunk)
+        return ct
+
+    def __write_chunk(self, chunk):
+        companies = []
+        for crunchbase_id, data in chunk.iteritems():
+            company = Company(account_id=DEFAULT_ACCOUNT_ID,
+                              crunchbase_id=crunchbase_id,
+                              id=self.company_ids.get(crunchbase_id),
+                              **create_defaults_hash(data, COMPANY_FIELD_MAP))
+            # Existing companies without a name keep their name (and keys)
+            if company.id is None or company.name:
+                set_company_keys(company)
+            companies.append(company)
+        inserts = [c for c in companies if c.id is None]
+        updates = [c for c in companies if c.id is not None]
+        investors = [company for company, data
+                     in zip(companies, chunk.itervalues())
+                     if data['primary_role'] == 'investor']
+
+        with transaction.atomic():
+            previous_keys = dict(
+                Company.objects.filter(id__in=[c.id for c in updates])
+                               .values_list('id', 'name_key')
+            )
+            self.__insert_companies(inserts)
+            self.__update_companies(updates)
+            self.__write_investors(investors)
+
+            # Company signals (see data.signals.company_saved), only for the
+            # companies whose name key changed
+            renamed = [c for c in updates
+                       if c.name and c.name_key != previous_keys.get(c.id)]
+            for company in inserts + renamed:
+                if company.name:
+                    index_company_name(company)
+            person_ids = (Employment.objects.filter(company__in=renamed)
+                                            .values_list('person_id',
+                                                         flat=True)
+                                            .distinct()
+                          if renamed else [])
+            for person_id in person_ids:
+                reindex_person(person_id)
+        return len(companies)
+
+    def __insert_companies(self, companies):
+        Company.objects.bulk_create(companies)
+        if not connection.features.can_return_ids_from_bulk_insert:
+            ids = dict(Company.objects.filter(
+                crunchbase_id__in=[c.crunchbase_id for c in companies]
+            ).values_list('crunchbase_id', 'id'))
+            for company in companies:
+                company.id = ids[company.crunchbase_id]
+        for company in companies:
+            self.company_ids[company.crunchbase_id] = company.id
+
+    def __update_companies(self, companies):
+        FIELDS = sorted(COMPANY_FIELD_MAP.keys()) + ['name_key',
+                                                     'name_phonetic']
+        now = timezone.now()
+        cursor = connection.cursor()
+        for i in range(0, len(companies), self.UPSERT_BATCH_SIZE):
+            batch = companies[i:i + self.UPSERT_BATCH_SIZE]
+            # name is NOT NULL: the existing name is kept if it's missing
+            values = [
+                [DEFAULT_ACCOUNT_ID, company.crunchbase_id, now, now]
+                + [getattr(company, field) if field != 'name'
+                   else company.name or '' for field in FIELDS]
+                for company in batch
+            ]
+            RAW_SQL = '''
+INSERT INTO data_company (account_id, crunchbase_id, created_at, updated_at,
+                          %s)
+    VALUES %s
+    ON CONFLICT (crunchbase_id) DO UPDATE
+        SET updated_at=excluded.updated_at, %s;''' % (
+                ', '.join(FIELDS),
+                ','.join(['(%s)' % ','.join(['%s'] * len(values[0]))]
+                         * len(values)),
+                ', '.join(
+                    "%s=COALESCE(NULLIF(excluded.%s, ''), data_company.%s)"
+                    % (field, field, field) for field in FIELDS
+                )
+            )
+            cursor.execute(RAW_SQL, [v for row in values for v in row])
+
+    def __write_investors(self, companies):
+        inserts = [
+            Investor(account_id=DEFAULT_ACCOUNT_ID, company_id=company.id,
+                     type='COMPANY', name=company.name or '')
+            for company in companies if company.id not in self.investor_ids
+        ]
+        updates = {
+            self.investor_ids[company.id]: company.name
+            for company in companies
+            if company.id in self.investor_ids and company.name
+        }
+
+        Investor.objects.bulk_create(inserts)
+        if not connection.features.can_return_ids_from_bulk_insert:
+            inserts = Investor.objects.filter(
+                account_id=DEFAULT_ACCOUNT_ID,
+                company_id__in=[investor.company_id for investor in inserts]
+            )
+        for investor in inserts:
+            self.investor_ids[investor.company_id] = investor.id
+
+        if updates:
+            Investor.objects.filter(id__in=updates.keys()).update(
+                type='COMPANY',
+                name=models.Case(*[
+                    models.When(id=investor_id, then=models.Value(name))
+                    for investor_id, name in updates.iteritems()
+                ], output_field=models.TextField())
+            )
+
+def get_organization_api_url():
+    return os.environ.get('CRUNCHBASE_API_URL', ORGANIZATION_API_URL)
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket rate limiter: allows bursts of up to @capacity
+    calls, refilled at @rate calls per second.
     """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a call is allowed.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens
+                                  + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def get_organizations_page(session, bucket, wait=1, **params):
+    """
+    Fetches one page of organizations, retrying with exponential backoff
+    (starting at @wait seconds) on errors and rate limiting.
+
+    Returns:
+        [dict]: The 'data' hash of the response (see get_organizations), or
+                None if the retries are exhausted.
+    """
+    print 'Calling API with params:', params
+
+    api_params = {
+        'user_key': os.environ['CRUNCHBASE_API_TOKEN']
+    }
+    api_params.update(params)
+    while True:
+        bucket.acquire()
+        try:
+            response = session.get(get_organization_api_url(),
+                                   params=api_params,
+                                   timeout=API_TIMEOUT).json()
+        except (requests.RequestException, ValueError) as e:
+            response = { 'error': str(e) }
+        if 'data' in response:
+            return response['data']
+
+        if wait <= API_MAX_WAIT:
+            print 'API error, retrying in %s. %s' % (wait, response)
+            time.sleep(wait)
+            wait *= 2
+        else:
+            print 'Maximum retries exceeded, aborting...', params
+            return None
+
+def get_organizations(poll=True, wait=1, workers=API_WORKERS,
+                      rate=API_RATE_LIMIT, **params):
+    """
+    Fetches the organizations from the API and creates or updates a Company
+    (and Investor) for each. After the first page, up to @workers pages are
+    fetched concurrently, within the API quota (see TokenBucket). Each page
+    is written in one transaction as it arrives. Only the first page is
+    fetched if not @poll.
+
     organization_types: Filter by one or more types. Multiple types are
                         separated by commas. Available types are 'company',
                         'investor', 'school', and 'group'. Multiple
@@ -97,33 +353,56 @@ def get_organizations(poll=True, wait=1, **params):
     }
     API docs: https://data.crunchbase.com/docs/odm-organizations
     """
-    print 'Calling API with params:', params
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    bucket = TokenBucket(rate, capacity=workers)
+    writer = OrganizationWriter()
 
-    api_params = {
-        'user_key': os.environ['CRUNCHBASE_API_TOKEN']
-    }
-    api_params.update(params)
-    response = requests.get(ORGANIZATION_API_URL, params=api_params).json()
-    if 'data' in response:
-        data = response['data']
+    def write_organizations(items):
+        writer.write((organization['uuid'], organization['properties'])
+                     for organization in items)
 
-        for organization in data['items']:
-            create_organization(organization['uuid'],
-                                organization['properties'])
+    data = get_organizations_page(session, bucket, wait, **params)
+    if data is None:
+        return
+    write_organizations(data['items'])
+    if not poll or not data['paging']['next_page_url']:
+        return
 
-        if poll and data['paging']['next_page_url']:
-            get_organizations(poll=True, page=data['paging']['current_page']+1)
+    # The remaining pages are fetched by the pool, at most 2 per worker ahead
+    # of the writer (this thread)
+    pages = range(data['paging']['current_page'] + 1,
+                  data['paging']['number_of_pages'] + 1)
+    failed = []
 
-    else:
-        if wait <= 1024:
-            print 'API error, retrying in %s. %s' % (wait, response)
-            time.sleep(wait)
-            get_organizations(poll=True, wait=wait*2, **params)
+    def write_page(page, result):
+        data = result.get()
+        if data is None:
+            failed.append(page)
         else:
-            print 'Maximum retries exceeded, aborting...'
-            return
+            write_organizations(data['items'])
 
-def get_organizations_csv():
+    pool = ThreadPool(workers)
+    try:
+        pending = collections.deque()
+        for page in pages:
+            pending.append((page, pool.apply_async(
+                get_organizations_page, (session, bucket, wait),
+                dict(params, page=page)
+            )))
+            if len(pending) >= 2 * workers:
+                write_page(*pending.popleft())
+        while pending:
+            write_page(*pending.popleft())
+        if failed:
+            print 'Pages not fetched:', failed
+    finally:
+        pool.terminate()
+        pool.join()
+
+def get_organization_from_csv_row(line):
     """
     CSV format:
         crunchbase_uuid, type, primary_role, name, crunchbase_url,
@@ -131,30 +410,240 @@ def get_organizations_csv():
         twitter_url, linkedin_url, stock_symbol, location_city,
         location_region, location_country_code, short_description
     """
-    with open(ORGANIZATION_CSV_PATH, 'r') as f:
-        csvreader = csv.reader(f)
-        next(csvreader) # Skip the header row
+    crunchbase_uuid, _, primary_role, name, crunchbase_url, _, \
+        homepage_url, profile_image_url, _, _, _, _, \
+        location_city, _, _, short_description = line
+
+    return {
+        'uuid': crunchbase_uuid,
+        'primary_role': primary_role,
+        'name': name,
+        'crunchbase_url': crunchbase_url,
+        'homepage_url': homepage_url,
+        'profile_image_url': profile_image_url,
+        'location_city': location_city,
+        'short_description': short_description,
+    }
+
+def get_organizations_csv():
+    """
+    Reads the organizations from the snapshot if it is up to date with the
+    CSV (see build_organizations_snapshot), otherwise from the CSV.
+    """
+    snapshot = get_organizations_snapshot()
+    if snapshot:
+        # Closed when the generator is exhausted or closed
+        with snapshot:
+            for _, organization in snapshot.iter_rows():
+                yield organization
+        return
+    for _, organization in get_organizations_csv_from(0):
+        yield organization
+        #create_organization(organization['uuid'], organization)
+
+def get_organizations_csv_from(offset):
+    """
+    Resumable version of get_organizations_csv.
+
+    Args:
+        offset [int]: Byte offset to start reading from: 0, or an offset
+                      yielded by a previous call on the same file.
+
+    Yields:
+        [tuple]: ([int: byte offset of the end of the row], [dict])
+    """
+    with open(ORGANIZATION_CSV_PATH, 'rb') as f:
+        f.seek(offset)
+        # Read with readline rather than iterating over the file, whose
+        # read-ahead buffer makes f.tell() unusable. The reader pulls exactly
+        # the lines of each row (more than one for quoted newlines).
+        csvreader = csv.reader(iter(f.readline, ''))
+        if offset == 0:
+            next(csvreader) # Skip the header row
 
         ct = 0
         for line in csvreader:
             ct += 1
             if ct % 1000 == 0:
                 print '%d organizations parsed' % ct
+            yield f.tell(), get_organization_from_csv_row(line)
 
-            crunchbase_uuid, _, primary_role, name, crunchbase_url, _, \
-                homepage_url, profile_image_url, _, _, _, _, \
-                location_city, _, _, short_description = line
-
-            organization = {
-                'uuid': crunchbase_uuid,
-                'primary_role': primary_role,
-                'name': name,
-                'crunchbase_url': crunchbase_url,
-                'homepage_url': homepage_url,
-                'profile_image_url': profile_image_url,
-                'location_city': location_city,
-                'short_description': short_description,
-            }
-            yield organization
-            #create_organization(crunchbase_uuid, organization)
+############
+# Snapshot #
+############
 
+def build_organizations_snapshot():
+    """
+    Converts the organizations CSV to a columnar snapshot with only the
+    columns in get_organization_from_csv_row, indexed by uuid.
+
+    Returns:
+        [int]: Number of organizations.
+    """
+    return write_snapshot(
+        ORGANIZATION_SNAPSHOT_PATH, ['uuid'] + API_MAP['organization'],
+        (organization for _, organization
+         in get_organizations_csv_from(0)),
+        'uuid', source_path=ORGANIZATION_CSV_PATH
+    )
+
+def get_organizations_snapshot():
+    """
+    Returns:
+        [ColumnarSnapshot]: The organizations snapshot, or None if it hasn't
+                            been built or the CSV has changed since. To be
+                            closed by the caller.
+    """
+    if not os.path.exists(ORGANIZATION_SNAPSHOT_PATH):
+        return None
+    snapshot = ColumnarSnapshot(ORGANIZATION_SNAPSHOT_PATH)
+    if not snapshot.is_current(ORGANIZATION_CSV_PATH):
+        snapshot.close()
+        return None
+    return snapshot
+
+def get_organization_csv(crunchbase_uuid):
+    """
+    Returns:
+        [dict]: The organization with @crunchbase_uuid in the format of
+                get_organizations_csv, or None. Uses the snapshot's index if
+                it is up to date, otherwise scans the CSV.
+    """
+    snapshot = get_organizations_snapshot()
+    if snapshot:
+        with snapshot:
+            return snapshot.get(crunchbase_uuid)
+    for _, organization in get_organizations_csv_from(0):
+        if organization['uuid'] == crunchbase_uuid:
+            return organization
+    return None
+
+##################
+# Parallel parse #
+##################
+
+CSV_CHUNK_BYTES = 4 * 1024 * 1024
+
+def get_csv_chunks(path, offset=0, chunk_bytes=CSV_CHUNK_BYTES,
+                   block_bytes=1024 * 1024):
+    """
+    Splits the CSV file at @path into byte ranges of about @chunk_bytes that
+    start and end on row boundaries, so that they can be parsed
+    independently. A newline is a row boundary if it is preceded by an even
+    number of quotes: quotes inside quoted fields are doubled, so newlines
+    inside them always follow an odd number.
+
+    Args:
+        offset [int]: Byte offset of a row boundary to start from. The header
+                      row is skipped if 0.
+
+    Yields:
+        [tuple]: ([int: start offset], [int: end offset])
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        if offset == 0:
+            f.readline() # Skip the header row
+        start = pos = f.tell() # pos: offset of the current block
+        target = start + chunk_bytes
+        quotes = 0 # Parity of the quotes before pos (since the first row)
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                break
+            i = max(target - pos, 0)
+            while i < len(block):
+                j = block.find('\n', i)
+                if j == -1:
+                    break
+                if (quotes + block.count('"', 0, j)) % 2 == 0:
+                    yield start, pos + j + 1
+                    start = pos + j + 1
+                    target = start + chunk_bytes
+                    i = max(target - pos, j + 1)
+                else:
+                    i = j + 1
+            quotes = (quotes + block.count('"')) % 2
+            pos += len(block)
+        if start < pos:
+            yield start, pos
+
+def parse_organizations_csv_chunk(args):
+    """
+    Process pool task: parses the rows of one chunk (see get_csv_chunks).
+
+    Args:
+        args [tuple]: (path, start, end)
+
+    Returns:
+        [tuple]: ([int: end offset], [list: organizations])
+    """
+    path, start, end = args
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return end, [get_organization_from_csv_row(line)
+                 for line in csv.reader(StringIO(data))]
+
+def get_organizations_csv_parallel(offset=0, workers=None,
+                                   chunk_bytes=CSV_CHUNK_BYTES,
+                                   max_pending=None):
+    """
+    Parallel, batched version of get_organizations_csv_from: chunks of the
+    file are parsed in a pool of @workers processes (one per CPU by default)
+    and yielded in file order. At most @max_pending chunks (2 per worker by
+    default) are parsed ahead of the consumer, which bounds memory use when
+    the consumer (usually the database) is the bottleneck. With a single
+    worker, chunks are parsed in this process.
+
+    Yields:
+        [tuple]: ([int: byte offset of the end of the chunk],
+                  [list: organizations])
+    """
+    workers = workers or multiprocessing.cpu_count()
+    max_pending = max_pending or 2 * workers
+    if workers == 1:
+        ct = 0
+        for start, end in get_csv_chunks(ORGANIZATION_CSV_PATH, offset,
+                                         chunk_bytes):
+            chunk_end, organizations = parse_organizations_csv_chunk(
+                (ORGANIZATION_CSV_PATH, start, end)
+            )
+            ct += len(organizations)
+            print '%d organizations parsed' % ct
+            yield chunk_end, organizations
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        ct = 0
+        for start, end in get_csv_chunks(ORGANIZATION_CSV_PATH, offset,
+                                         chunk_bytes):
+            if len(pending) >= max_pending:
+                chunk_end, organizations = pending.popleft().get()
+                ct += len(organizations)
+                print '%d organizations parsed' % ct
+                yield chunk_end, organizations
+            pending.append(pool.apply_async(
+                parse_organizations_csv_chunk,
+                ((ORGANIZATION_CSV_PATH, start, end),)
+            ))
+        while pending:
+            chunk_end, organizations = pending.popleft().get()
+            ct += len(organizations)
+            print '%d organizations parsed' % ct
+            yield chunk_end, organizations
+    finally:
+        pool.terminate()
+        pool.join()
+
+def load_organizations_csv(workers=None):
+    """
+    Creates or updates a Company (and Investor) for every organization in
+    the CSV, parsing it with @workers processes.
+    """
+    writer = OrganizationWriter()
+    for _, organizations in get_organizations_csv_parallel(workers=workers):
+        writer.write((organization['uuid'], organization)
+                     for organization in organizations)
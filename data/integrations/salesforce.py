@@ -1,5 +1,10 @@
 import os
+import threading
+import urlparse
+from Queue import Queue, Full
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 class APIError(Exception):
     pass
@@ -11,17 +16,51 @@ def format_sfdc_id(sfdc_id):
     return sfdc_id[:-3] if sfdc_id and len(sfdc_id) == 18 else sfdc_id
 
 ACCOUNT_SOQL = 'SELECT Id, Name, Description, Website FROM Account';
+LOGIN_URL = 'https://a16z.my.salesforce.com'
+POOL_SIZE = 4
+TIMEOUT = 60 # Seconds
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Returns:
+        [requests.Session]: Session shared by all Salesforce calls, so that
+                            connections are pooled and kept alive across
+                            pages. Idempotent requests are retried with
+                            exponential backoff on connection errors and 5xx
+                            responses.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=5, backoff_factor=1,
+                          status_forcelist=[500, 502, 503, 504])
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE,
+                                  pool_maxsize=POOL_SIZE, max_retries=retry)
+            _session = requests.Session()
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+def get_login_url():
+    return os.environ.get('SALESFORCE_API_LOGIN_URL', LOGIN_URL)
+
+def get_instance_url():
+    instance = os.environ['SALESFORCE_API_INSTANCE']
+    return instance if '://' in instance else 'https://%s' % instance
 
 def get_api_token():
-    r = requests.post(
-        'https://a16z.my.salesforce.com/services/oauth2/token',
+    r = get_session().post(
+        '%s/services/oauth2/token' % get_login_url(),
         data={
             'grant_type': 'password',
             'client_id': os.environ['SALESFORCE_API_CLIENT_ID'],
             'client_secret': os.environ['SALESFORCE_API_CLIENT_SECRET'],
             'username': os.environ['SALESFORCE_API_USERNAME'],
             'password': os.environ['SALESFORCE_API_PASSWORD']
-        })
+        }, timeout=TIMEOUT)
     try:
         data = r.json()
         return data['access_token']
@@ -30,8 +69,92 @@ def get_api_token():
         print msg
         raise APIError(msg)
 
-def get_accounts(token, poll=True, wait=1, **params):
+def get_query_pages(soql, token, poll=True, get_token=None):
     """
+    Runs the SOQL query @soql, following nextRecordsUrl if @poll.
+
+    Args:
+        get_token [function]: Optional; called for a new token when the
+                              current one is rejected (expired session).
+
+    Yields:
+        [dict]: Each page of the response (see get_accounts).
+    """
+    session = get_session()
+    url = '%s/services/data/v20.0/query/' % get_instance_url()
+    params = {'q': soql}
+    refreshed = False
+    while url:
+        print 'Fetching Salesforce data', url
+        response = session.get(url, params=params, timeout=TIMEOUT,
+                               headers={'Authorization': 'Bearer %s' % token})
+        if response.status_code == 401 and get_token and not refreshed:
+            token = get_token()
+            refreshed = True
+            continue
+        refreshed = False
+        if response.status_code != 200:
+            # Error bodies aren't always JSON, e.g. from a proxy
+            raise APIError('[ERROR]: Salesforce query failed: %s'
+                           % response.text)
+        page = response.json()
+        yield page
+
+        url = None
+        if poll and not page.get('done', True) and page.get('nextRecordsUrl'):
+            url = urlparse.urljoin(get_instance_url(), page['nextRecordsUrl'])
+            params = None # Included in nextRecordsUrl
+
+def prefetch(iterable, size=1):
+    """
+    Iterates over @iterable in a background thread, at most @size items
+    ahead of the caller, so that e.g. the next page of a response is fetched
+    while the current one is processed. Exceptions are raised in the caller.
+    """
+    DONE = object()
+    queue = Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((DONE, None))
+        except Exception as e:
+            put((DONE, e))
+
+    thread = threading.Thread(target=produce, name='prefetch')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error:
+                raise error
+            if item is DONE:
+                return
+            yield item
+    finally:
+        # Lets the producer exit if the caller stops iterating early
+        stopped.set()
+
+def get_accounts(token, poll=True, wait=1, get_token=None, **params):
+    """
+    Streams the Salesforce accounts, one page (usually 2000 records) in
+    memory at a time, while the next page is fetched in the background.
+    @wait is kept for compatibility: retries and backoff are handled by the
+    session (see get_session).
+
     API response format: {
         'totalSize': 20000,
         'done': false,
@@ -51,31 +174,21 @@ def get_accounts(token, poll=True, wait=1, **params):
             ...
         ]
     }
+
+    Yields:
+        [dict]: { 'Id': [str], 'Name': [str], 'Website': [str],
+                  'Description': [str] }
     """
-    results = params['results'] if 'results' in params else []
-    URL = (params['url'] if 'url' in params
-           else ('https://%s/services/data/v20.0/query/'
-                 % os.environ['SALESFORCE_API_INSTANCE']))
-    PARAMS = {'q': ACCOUNT_SOQL}
-    HEADERS = {'Authorization': 'Bearer %s' % token}
-    print 'Fetching Salesforce data', URL
-    response = requests.get(URL, params=PARAMS, headers=HEADERS)
-    response = response.json()
-    if 'records' in response:
-        results += [{
-            'Id': record['Id'],
-            'Name': record['Name'],
-            'Website': record['Website'],
-            'Description': record['Description']
-        } for record in response['records']]
-    if (poll and 'done' in response and not response['done']
-        and 'nextRecordsUrl' in response):
-        next_url = ('https://%s/%s' % (os.environ['SALESFORCE_API_INSTANCE'],
-                                       response['nextRecordsUrl']))
-        return get_accounts(token, poll, wait, url=next_url, results=results)
-    else:
-        return results
+    for page in prefetch(get_query_pages(ACCOUNT_SOQL, token, poll=poll,
+                                         get_token=get_token)):
+        for record in page.get('records', []):
+            yield {
+                'Id': record['Id'],
+                'Name': record['Name'],
+                'Website': record['Website'],
+                'Description': record['Description']
+            }
 
 def get_accounts_with_auth(**params):
     token = get_api_token()
-    return get_accounts(token, **params)
+    return get_accounts(token, get_token=get_api_token, **params)
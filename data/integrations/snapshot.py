@@ -0,0 +1,237 @@
+"""
+Read-only columnar snapshots of source files (e.g. the Crunchbase
+organizations CSV), memory-mapped so that rows can be iterated or looked up
+by key without parsing text or loading the file into memory.
+
+File format (integers are little-endian):
+
+    'OVCSNAP1'                  magic
+    uint32                      length of the header
+    header                      JSON: {
+                                    'rows': [int],
+                                    'columns': [[str], ...],
+                                    'key': [str: key column],
+                                    'source': { 'size': [int],
+                                                'mtime': [float] },
+                                    'sections': {
+                                        [column]: [offsets pos, heap pos],
+                                        ...
+                                    },
+                                    'index': [int: index pos]
+                                }, positions relative to the end of
+                                the header
+    per column:
+        uint32 x (rows + 1)     offsets of each value in the heap
+        bytes                   heap: the values, concatenated (< 4GB)
+    uint32 x rows               row numbers sorted by key value
+"""
+
+import itertools
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = 'OVCSNAP1'
+OFFSET = struct.Struct('<I')
+ROW = struct.Struct('<I')
+MAX_HEAP_SIZE = 2 ** 32 - 1
+BLOCK_ROWS = 4096 # Rows decoded at once by ColumnarSnapshot.iter_rows
+
+def write_snapshot(path, columns, rows, key, source_path=None):
+    """
+    Args:
+        path [str]: Snapshot file to write. Replaced atomically.
+        columns [list]: Column names.
+        rows [iterable]: Dicts with a str value for every column.
+        key [str]: Column to index (see ColumnarSnapshot.find).
+        source_path [str]: File the rows were read from, recorded so that
+                           a stale snapshot can be detected
+                           (see ColumnarSnapshot.is_current).
+
+    Returns:
+        [int]: Number of rows written.
+    """
+    def copy(src, dst):
+        src.seek(0)
+        while True:
+            block = src.read(1024 * 1024)
+            if not block:
+                break
+            dst.write(block)
+        src.close()
+
+    # Offsets and heaps are spilled to temporary files, so only the keys
+    # are held in memory (to sort the index)
+    offsets = { column: tempfile.TemporaryFile() for column in columns }
+    heaps = { column: tempfile.TemporaryFile() for column in columns }
+    heap_sizes = { column: 0 for column in columns }
+    for column in columns:
+        offsets[column].write(OFFSET.pack(0))
+    keys = []
+    for row in rows:
+        for column in columns:
+            value = row[column] or ''
+            heaps[column].write(value)
+            heap_sizes[column] += len(value)
+            if heap_sizes[column] > MAX_HEAP_SIZE:
+                raise ValueError('Column too large for a snapshot: %s'
+                                 % column)
+            offsets[column].write(OFFSET.pack(heap_sizes[column]))
+        keys.append(row[key] or '')
+    index = sorted(xrange(len(keys)), key=keys.__getitem__)
+    del keys
+
+    # Positions are relative to the end of the header
+    sections = {}
+    pos = 0
+    for column in columns:
+        sections[column] = [pos, pos + OFFSET.size * (len(index) + 1)]
+        pos = sections[column][1] + heap_sizes[column]
+    header = {
+        'rows': len(index),
+        'columns': columns,
+        'key': key,
+        'source': None,
+        'sections': sections,
+        'index': pos,
+    }
+    if source_path:
+        stat = os.stat(source_path)
+        header['source'] = { 'size': stat.st_size, 'mtime': stat.st_mtime }
+    header_json = json.dumps(header)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(ROW.pack(len(header_json)))
+        f.write(header_json)
+        for column in columns:
+            copy(offsets[column], f)
+            copy(heaps[column], f)
+        for row in index:
+            f.write(ROW.pack(row))
+    os.rename(tmp_path, path)
+    return len(index)
+
+class ColumnarSnapshot(object):
+    """
+    Reader for a file written by write_snapshot. Values are read from the
+    memory map on access, so the resident footprint is only the pages
+    touched. The map stays open until close, or the end of a with block:
+
+        with ColumnarSnapshot(path) as snapshot:
+            row = snapshot.get(key)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a snapshot file: %s' % path)
+        header_len, = ROW.unpack_from(self.mmap, len(MAGIC))
+        start = len(MAGIC) + ROW.size
+        header = json.loads(self.mmap[start:start + header_len])
+        data_pos = start + header_len
+        self.rows = header['rows']
+        self.columns = [str(column) for column in header['columns']]
+        self.key = str(header['key'])
+        self.source = header['source']
+        self.sections = {
+            str(column): [data_pos + pos for pos in positions]
+            for column, positions in header['sections'].iteritems()
+        }
+        self.index = data_pos + header['index']
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.mmap.close()
+
+    def is_current(self, source_path):
+        """
+        Returns:
+            [bool]: Whether the file at @source_path is unchanged since the
+                    snapshot was written from it.
+        """
+        stat = os.stat(source_path)
+        return (self.source is not None
+                and self.source['size'] == stat.st_size
+                and self.source['mtime'] == stat.st_mtime)
+
+    def get_value(self, column, row):
+        offsets_pos, heap_pos = self.sections[column]
+        start, = OFFSET.unpack_from(self.mmap, offsets_pos + OFFSET.size * row)
+        end, = OFFSET.unpack_from(self.mmap,
+                                  offsets_pos + OFFSET.size * (row + 1))
+        return self.mmap[heap_pos + start:heap_pos + end]
+
+    def get_row(self, row):
+        return { column: self.get_value(column, row)
+                 for column in self.columns }
+
+    def get_values(self, column, start, end):
+        """
+        Returns:
+            [list]: The values of @column in rows @start to @end (exclusive),
+                    decoding their offsets at once.
+        """
+        offsets_pos, heap_pos = self.sections[column]
+        offsets = struct.unpack_from('<%dI' % (end - start + 1), self.mmap,
+                                     offsets_pos + OFFSET.size * start)
+        base = offsets[0]
+        heap = self.mmap[heap_pos + base:heap_pos + offsets[-1]]
+        return [heap[offsets[i] - base:offsets[i + 1] - base]
+                for i in xrange(end - start)]
+
+    def iter_rows(self, start=0):
+        """
+        Yields:
+            [tuple]: ([int: row number], [dict])
+        """
+        for block_start in xrange(start, self.rows, BLOCK_ROWS):
+            block_end = min(block_start + BLOCK_ROWS, self.rows)
+            columns = [self.get_values(column, block_start, block_end)
+                       for column in self.columns]
+            for i, values in enumerate(itertools.izip(*columns)):
+                yield block_start + i, dict(itertools.izip(self.columns,
+                                                           values))
+
+    def find(self, key):
+        """
+        Binary search of the key index.
+
+        Returns:
+            [int]: Row number of the (first) row whose key column is @key,
+                   or None.
+        """
+        lo, hi = 0, self.rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row, = ROW.unpack_from(self.mmap, self.index + ROW.size * mid)
+            if self.get_value(self.key, row) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.rows:
+            row, = ROW.unpack_from(self.mmap, self.index + ROW.size * lo)
+            if self.get_value(self.key, row) == key:
+                return row
+        return None
+
+    def get(self, key):
+        """
+        Returns:
+            [dict]: The row whose key column is @key, or None.
+        """
+        row = self.find(key)
+        return self.get_row(row) if row is not None else None
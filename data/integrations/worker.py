@@ -1,17 +1,40 @@
-from data.integrations.crunchbase import API_MAP, get_organizations_csv
+import itertools
+import traceback
+
+from django.db import transaction
+from django.utils import timezone
+
+from data.integrations.crunchbase import API_MAP, ORGANIZATION_CSV_PATH,\
+    ORGANIZATION_SNAPSHOT_PATH, get_organizations_csv_from,\
+    get_organizations_csv_parallel, get_organizations_snapshot
+from data.entity import RecordMatcher
 from data.integrations.salesforce import get_accounts_with_auth
-from data.models import CustomFieldSource, CustomRecord, DataSource
+from data.models import CustomFieldSource, CustomRecord, DataSource,\
+    SyncCheckpoint
 
 from data.sql import get_custom_data
 
-def get_values_list(field_values):
+def sync_table(custom_table, user, progress=None, workers=None,
+               fuzzy_match=False):
     """
-    Currently only used for entity resolution in the Salesforce updater
-    [{'value': [val], 'source': [source]}, ...] => [[val], ...]
+    Args:
+        progress [function]: Optional callback, called every PROGRESS_EVERY
+                             rows with the number of rows synced so far.
+        workers [int]: If set, the Crunchbase CSV is parsed by this many
+                       processes (see get_organizations_csv_parallel).
+                       Unused if the organizations snapshot is up to date.
+        fuzzy_match [bool]: Whether Salesforce accounts that match no record
+                            by name or website are matched to similarly
+                            named records (see RecordMatcher).
     """
-    return [v['value'] for v in field_values]
+    PROGRESS_EVERY = 100
+    synced = [0]
+
+    def row_synced():
+        synced[0] += 1
+        if progress and synced[0] % PROGRESS_EVERY == 0:
+            progress(synced[0])
 
-def sync_table(custom_table, user):
     def create_field_map(custom_table, source_name, model_name):
         """
         Returns:
@@ -30,43 +53,96 @@ def sync_table(custom_table, user):
     print 'Syncing...', custom_table
 
     # Crunchbase
+    # Resumes from the table's checkpoint in the snapshot (offset in rows) or
+    # else the CSV (offset in bytes), and only writes rows that changed since
+    # they were last synced (see SyncCheckpoint)
+    CHECKPOINT_EVERY = 1000 # Rows
     field_map = create_field_map(custom_table, 'crunchbase', 'organization')
-    LIMIT = 500  # For testing
-    ct = 0       # For testing
     source = DataSource.objects.get(name='crunchbase')
-    for organization in get_organizations_csv():
-        if ct >= LIMIT:
-            break
-        formatted_response = {
-            field.api_name: organization[api_name]
-            for api_name, field in field_map.iteritems()
-            if organization[api_name] # Filter null values
-        }
-        # TODO: Upsert
-        CustomRecord.update_or_create_from_source(
-            user, custom_table, formatted_response, source, organization['uuid']
+    snapshot = get_organizations_snapshot()
+    try:
+        checkpoint = SyncCheckpoint.get_for_file(
+            custom_table, source,
+            ORGANIZATION_SNAPSHOT_PATH if snapshot else ORGANIZATION_CSV_PATH,
+            field_map
         )
-        ct += 1
+
+        def get_organization_batches():
+            """
+            Yields:
+                [tuple]: ([int: byte offset of the end of the batch],
+                          [list: organizations])
+            """
+            if snapshot:
+                organizations = (
+                    (row + 1, organization) for row, organization
+                    in snapshot.iter_rows(checkpoint.offset)
+                )
+            elif workers:
+                for batch in get_organizations_csv_parallel(checkpoint.offset,
+                                                            workers=workers):
+                    yield batch
+                return
+            else:
+                organizations = get_organizations_csv_from(checkpoint.offset)
+            while True:
+                batch = list(itertools.islice(organizations, CHECKPOINT_EVERY))
+                if not batch:
+                    break
+                yield batch[-1][0], [organization for _, organization in batch]
+
+        def get_organization_row(organization):
+            row_synced()
+            return organization['uuid'], {
+                field.api_name: organization[api_name]
+                for api_name, field in field_map.iteritems()
+                if organization[api_name] # Filter null values
+            }
+
+        if checkpoint.completed:
+            print 'Crunchbase CSV unchanged since the last sync, skipping'
+        else:
+            for offset, organizations in get_organization_batches():
+                with transaction.atomic():
+                    checkpoint.rows_written += \
+                        CustomRecord.bulk_update_or_create_from_source(
+                            user, custom_table,
+                            [get_organization_row(organization)
+                             for organization in organizations], source,
+                            chunk_size=CHECKPOINT_EVERY, skip_unchanged=True
+                        )
+                    checkpoint.offset = offset
+                    checkpoint.rows_read += len(organizations)
+                    checkpoint.save()
+            checkpoint.completed_at = timezone.now()
+            checkpoint.save()
+            print 'Crunchbase: %d rows read, %d written' % (
+                checkpoint.rows_read, checkpoint.rows_written
+            )
+    finally:
+        if snapshot:
+            snapshot.close()
 
     # Salesforce
-    # Currently does a lookup to see if there's already a match by name and
-    # resolve to that entity if so; otherwise, skips (does not create a new
-    # entity - yet)
+    # Currently does a lookup to see if there's already a match by name (or
+    # website) and resolve to that entity if so; otherwise, skips (does not
+    # create a new entity - yet)
     field_map = create_field_map(custom_table, 'salesforce', 'account')
-    data_map = get_custom_data(custom_table.id)
     name_field = field_map['Name'].api_name # Custom field API name for the
                                             # Salesforce Name field
+    website_field = (field_map['Website'].api_name if 'Website' in field_map
+                     else None)
+    matcher = RecordMatcher(get_custom_data(custom_table.id), name_field,
+                            website_field, fuzzy=fuzzy_match)
     source = DataSource.objects.get(name='salesforce')
     for account in get_accounts_with_auth(poll=True):
+        row_synced()
         formatted_response = {
             field.api_name: account[api_name]
             for api_name, field in field_map.iteritems()
             if account[api_name] # Filter null values
         }
-        data_map_matches = [r_id for r_id, r_dict in data_map.iteritems()
-                            if name_field in r_dict
-                            and formatted_response[name_field]
-                            in get_values_list(r_dict[name_field])]
+        data_map_matches = matcher.match(account['Name'], account['Website'])
         if data_map_matches:
             # Just take the first matching row for now. Don't want to have to
             # deal with many CustomRecord objects tying to a single source key
@@ -79,4 +155,20 @@ def sync_table(custom_table, user):
 
     # Add additional integrations here
 
+    if progress:
+        progress(synced[0])
+
+def run_sync_job(job):
+    """
+    Runs a claimed SyncJob (see SyncJob.claim_next) and records its outcome.
+    """
+    print 'Running job', job.id
+    try:
+        sync_table(job.table, job.owner, progress=job.set_progress)
+    except Exception:
+        traceback.print_exc()
+        job.finish(error=traceback.format_exc())
+    else:
+        job.finish()
+
 
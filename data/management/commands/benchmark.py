@@ -0,0 +1,221 @@
+import os
+import random
+import string
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from data.entity import levenshtein, LevenshteinScorer
+from data.models import (Company, CustomTable, CustomField, CustomRecord,
+                         CustomData, DataSource)
+from users.models import Account, User
+
+class Rollback(Exception):
+    pass
+
+def timed(fn, *args):
+    start = time.time()
+    fn(*args)
+    return time.time() - start
+
+def benchmark_levenshtein(count, limit):
+    """
+    Scores a single target against @count random candidate strings with the
+    reference levenshtein() and with LevenshteinScorer.
+    """
+    random.seed(0)
+    target = 'jonathan rosenberg'
+    candidates = [
+        ''.join(random.choice(string.ascii_lowercase + ' ')
+                for _ in range(random.randint(4, 24)))
+        for _ in range(count)
+    ]
+
+    results = [
+        ('levenshtein', timed(
+            lambda: [levenshtein(target, c) for c in candidates])),
+        ('LevenshteinScorer', timed(
+            lambda: LevenshteinScorer(target).batch(candidates))),
+        ('LevenshteinScorer (limit=%d)' % limit, timed(
+            lambda: LevenshteinScorer(target, limit).batch(candidates))),
+    ]
+    for name, seconds in results:
+        print '%-32s %8.3fs %12.0f candidates/s' % (name, seconds,
+                                                     count / seconds)
+
+def timed_queries(fn, *args):
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        seconds = timed(fn, *args)
+    return seconds, len(queries)
+
+def create_table(num_fields, source=None):
+    """
+    Creates a benchmark account, user and custom table with @num_fields
+    string fields, optionally also mapped to Crunchbase organization fields
+    if @source is 'crunchbase'. Should be called in a transaction that is
+    rolled back.
+    """
+    DataSource.create_sources()
+    company = Company.objects.create(name='Benchmark')
+    account = Account.objects.create(company=company)
+    user = User.objects.create(email='benchmark-%s@openvc.test'
+                                     % os.urandom(4).encode('hex'),
+                               account=account, role='Investor')
+    table = CustomTable.create_from_api(user, { 'displayName': 'Benchmark' })
+    organization_fields = DataSource.SOURCE_MAPPING[0]['models'][0]['fields']
+    fields = [
+        CustomField.create_from_api(user, table, {
+            'displayName': 'Field %d' % i,
+            'type': 'string',
+            'sources': [{
+                'source': source,
+                'model': 'organization',
+                'field': organization_fields[i % len(organization_fields)]['key']
+            }] if source else []
+        })
+        for i in range(num_fields)
+    ]
+    return account, user, table, fields
+
+def benchmark_custom_records(count, num_fields=5, max_per_record=1000):
+    """
+    Times the CustomRecordView list payload for tables of @count / 4,
+    @count / 2 and @count records with per-record get_api_format calls and
+    with CustomRecord.get_api_list_format. Per-record formatting is skipped
+    above @max_per_record records. All data is rolled back afterwards.
+    """
+    def per_record(records, fields, sources):
+        return {
+            source.name: [record.get_api_format(source=source, fields=fields)
+                          for record in records]
+            for source in sources
+        }
+
+    try:
+        with transaction.atomic():
+            account, user, table, fields = create_table(num_fields)
+            field_sources = [field.custom_field_sources.get()
+                             for field in fields]
+            sources = list(DataSource.objects.all())
+
+            print '%8s %-22s %8s %10s' % ('records', 'method', 'queries',
+                                          'seconds')
+            num_records = 0
+            for size in [count / 4, count / 2, count]:
+                new_records = CustomRecord.objects.bulk_create([
+                    CustomRecord(account=account, owner=user, table=table)
+                    for _ in range(size - num_records)
+                ])
+                if not new_records or new_records[0].id is None:
+                    new_records = CustomRecord.objects.filter(
+                        table=table
+                    ).order_by('id')[num_records:]
+                CustomData.objects.bulk_create([
+                    CustomData(account=account, owner=user, field=cfs,
+                               record=record, value='value %d' % record.id)
+                    for record in new_records for cfs in field_sources
+                ])
+                num_records = size
+
+                records = CustomRecord.objects.filter(account=account,
+                                                      table=table)
+                results = [('get_api_list_format', timed_queries(
+                    CustomRecord.get_api_list_format, records, fields,
+                    sources))]
+                if size <= max_per_record:
+                    results.append(('get_api_format', timed_queries(
+                        per_record, records, fields, sources)))
+                for name, (seconds, queries) in results:
+                    print '%8d %-22s %8d %10.3f' % (size, name, queries,
+                                                    seconds)
+            raise Rollback()
+    except Rollback:
+        pass
+
+def benchmark_upsert(count, num_fields=5, max_per_row=500):
+    """
+    Times syncing @count Crunchbase rows into a custom table with
+    CustomRecord.update_or_create_from_source (one row at a time, at most
+    @max_per_row rows) and with CustomRecord.bulk_update_or_create_from_source
+    (inserts, then updates of the same rows, then the same rows again with
+    skip_unchanged). All data is rolled back afterwards.
+    """
+    try:
+        with transaction.atomic():
+            account, user, table, fields = create_table(num_fields,
+                                                        'crunchbase')
+            source = DataSource.objects.get(name='crunchbase')
+
+            def get_rows(n, prefix):
+                return [
+                    ('%s-%d' % (prefix, i),
+                     { field.api_name: 'value %d' % i for field in fields })
+                    for i in range(n)
+                ]
+
+            def per_row(rows):
+                for source_key, request_json in rows:
+                    CustomRecord.update_or_create_from_source(
+                        user, table, request_json, source, source_key
+                    )
+
+            def bulk(rows, skip_unchanged=False):
+                CustomRecord.bulk_update_or_create_from_source(
+                    user, table, rows, source, skip_unchanged=skip_unchanged
+                )
+
+            per_row_count = min(count, max_per_row)
+            rows = get_rows(count, 'bulk')
+            results = [
+                ('update_or_create_from_source', per_row_count,
+                 timed_queries(per_row, get_rows(per_row_count, 'row'))),
+                ('bulk (insert)', count, timed_queries(bulk, rows)),
+                ('bulk (update)', count, timed_queries(bulk, rows)),
+                ('bulk (unchanged, skipped)', count,
+                 timed_queries(lambda r: bulk(r, skip_unchanged=True), rows)),
+            ]
+            print '%-30s %8s %8s %10s %10s' % ('method', 'rows', 'queries',
+                                               'seconds', 'rows/s')
+            for name, n, (seconds, queries) in results:
+                print '%-30s %8d %8d %10.3f %10.0f' % (name, n, queries,
+                                                       seconds, n / seconds)
+            raise Rollback()
+    except Rollback:
+        pass
+
+class Command(BaseCommand):
+    help = 'Runs performance benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', '-t',
+            action='store',
+            dest='type',
+            default='levenshtein',
+            help=("Benchmark to run ('levenshtein', 'custom_records' or "
+                  "'upsert').")
+        )
+        parser.add_argument('--count', '-n',
+            action='store',
+            dest='count',
+            type=int,
+            default=10000,
+            help='Number of candidates/records to benchmark with.'
+        )
+        parser.add_argument('--limit', '-l',
+            action='store',
+            dest='limit',
+            type=int,
+            default=3,
+            help='Maximum edit distance for banded scoring.'
+        )
+
+    def handle(self, *args, **options):
+        if options['type'] == 'levenshtein':
+            benchmark_levenshtein(options['count'], options['limit'])
+        elif options['type'] == 'custom_records':
+            benchmark_custom_records(options['count'])
+        elif options['type'] == 'upsert':
+            benchmark_upsert(options['count'])
+        else:
+            raise CommandError('Unknown benchmark: %s' % options['type'])
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+from data.integrations import crunchbase
+
+class Command(BaseCommand):
+    help = ('Converts the Crunchbase organizations CSV to a memory-mapped '
+            'columnar snapshot, used by syncs instead of the CSV until the '
+            'CSV changes.')
+
+    def handle(self, *args, **options):
+        ct = crunchbase.build_organizations_snapshot()
+        print '%d organizations written to %s' % (
+            ct, crunchbase.ORGANIZATION_SNAPSHOT_PATH
+        )
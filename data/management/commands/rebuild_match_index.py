@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from data.entity import get_company_keys, get_person_keys, index_person
+from data.models import Company, Person
+
+class Command(BaseCommand):
+    help = ('Backfills the Person and Company name keys, then rebuilds the '
+            'entity resolution blocking index (PersonMatchKey) and candidate '
+            'table (PersonMatchCandidate).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', '-a',
+            action='store',
+            dest='account',
+            type=int,
+            help='Only rebuild the index for this account id.'
+        )
+
+    def handle(self, *args, **options):
+        companies = Company.objects.order_by('id')
+        people = Person.objects.order_by('id')
+        if options['account']:
+            companies = companies.filter(account=options['account'])
+            people = people.filter(account=options['account'])
+
+        # .update() rather than .save() so that the signals don't reindex
+        # every employee once per company
+        ct = 0
+        for company_id, name in companies.values_list('id', 'name').iterator():
+            Company.objects.filter(id=company_id).update(
+                **get_company_keys(name)
+            )
+            ct += 1
+            if ct % 1000 == 0:
+                print '%d company keys backfilled' % ct
+        print '%d company keys backfilled' % ct
+
+        ct = 0
+        for person in people.iterator():
+            keys = get_person_keys(person.first_name, person.last_name)
+            Person.objects.filter(id=person.id).update(**keys)
+            for field, value in keys.iteritems():
+                setattr(person, field, value)
+            index_person(person)
+            ct += 1
+            if ct % 1000 == 0:
+                print '%d people indexed' % ct
+        print '%d people indexed' % ct
@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from data.models import PortfolioSummary
+from data.portfolio import get_account_investor, get_summary_values,\
+    refresh_summaries
+from users.models import Account, AccountPortfolio
+
+class Command(BaseCommand):
+    help = ('Rebuilds the portfolio summaries (see data.portfolio), or with '
+            '--check reports the ones that are missing or out of date.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', '-a',
+            action='store',
+            dest='account',
+            type=int,
+            help='Only rebuild (or check) the portfolio of this account id.'
+        )
+        parser.add_argument('--check',
+            action='store_true',
+            dest='check',
+            default=False,
+            help='Compare the summaries with freshly computed values instead '
+                 'of rebuilding them. Fails if any differs.'
+        )
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.order_by('id')
+        if options['account']:
+            accounts = accounts.filter(id=options['account'])
+
+        ct, bad_ct = 0, 0
+        for account in accounts:
+            portfolios = list(AccountPortfolio.objects.filter(account=account)
+                                                      .select_related('account'))
+            if not portfolios:
+                continue
+            if not options['check']:
+                with transaction.atomic():
+                    refresh_summaries(portfolios)
+                ct += len(portfolios)
+                print '%d summaries rebuilt' % ct
+                continue
+
+            values = get_summary_values(get_account_investor(account),
+                                        [portfolio.company_id
+                                         for portfolio in portfolios])
+            summaries = {
+                summary.portfolio_id: summary for summary
+                in PortfolioSummary.objects.filter(portfolio__in=portfolios)
+            }
+            for portfolio in portfolios:
+                ct += 1
+                summary = summaries.get(portfolio.id)
+                if summary is None:
+                    bad_ct += 1
+                    print 'Missing: account %d company %d' % (
+                        account.id, portfolio.company_id
+                    )
+                    continue
+                for field, value in values[portfolio.company_id].iteritems():
+                    stored = getattr(summary, field)
+                    if field in ('last_metrics', 'board'):
+                        (stored, value) = (json.loads(stored),
+                                           json.loads(value))
+                    if stored != value:
+                        bad_ct += 1
+                        print 'Out of date: account %d company %d (%s)' % (
+                            account.id, portfolio.company_id, field
+                        )
+                        break
+
+        if options['check']:
+            print '%d summaries checked, %d missing or out of date' % (ct,
+                                                                       bad_ct)
+            if bad_ct:
+                raise CommandError('Portfolio summaries are inconsistent, '
+                                   'run rebuild_portfolio_summaries')
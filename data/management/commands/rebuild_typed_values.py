@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from data.models import CustomField, CustomData
+
+class Command(BaseCommand):
+    help = ('Backfills the typed CustomData columns (value_number, value_date, '
+            'value_text) from CustomData.value and the CustomField types.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', '-t',
+            action='store',
+            dest='table',
+            type=int,
+            help='Only rebuild the values of this custom table id.'
+        )
+
+    def handle(self, *args, **options):
+        fields = CustomField.objects.order_by('id')
+        if options['table']:
+            fields = fields.filter(table=options['table'])
+
+        ct = 0
+        for field in fields.iterator():
+            CustomData.update_typed_values(field)
+            ct += 1
+            print '%d fields updated' % ct
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from data.integrations.worker import run_sync_job
+from data.models import SyncJob
+
+class Command(BaseCommand):
+    help = ('Runs queued SyncJobs (POST /tables/:id/sync). Several workers '
+            'can run at once; each job is claimed by a single worker.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', '-i',
+            action='store',
+            dest='interval',
+            type=float,
+            default=5,
+            help='Seconds to wait between polls of an empty queue.'
+        )
+        parser.add_argument('--once',
+            action='store_true',
+            dest='once',
+            default=False,
+            help='Exit once the queue is empty.'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # Long-lived process: drop connections past CONN_MAX_AGE or
+            # broken by a failed job
+            close_old_connections()
+            job = SyncJob.claim_next()
+            if job:
+                run_sync_job(job)
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
@@ -15,10 +15,17 @@ class Command(BaseCommand):
             dest='type',
             help="Type of data to retrieve (e.g. 'organizations')."
         )
+        parser.add_argument('--workers', '-w',
+            action='store',
+            dest='workers',
+            type=int,
+            help=('Number of processes to parse CSV files with (default: one '
+                  'per CPU).')
+        )
 
     def handle(self, *args, **options):
         if options['site'] == 'crunchbase':
             if options['type'] == 'organizations':
                 print 'Getting organizations'
                 #crunchbase.get_organizations(poll=True)
-                crunchbase.get_organizations_csv()
+                crunchbase.load_organizations_csv(workers=options['workers'])
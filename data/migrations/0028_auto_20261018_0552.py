@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 05:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_auto_20170513_0710'),
+        ('data', '0027_auto_20170629_0507'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonMatchKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.TextField(choices=[(b'last_name', b'Last Name'), (b'first_name', b'First Name'), (b'company', b'Company'), (b'linkedin', b'LinkedIn'), (b'email_domain', b'Email Domain')])),
+                ('key', models.TextField()),
+                ('account', models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='person_match_keys', to='users.Account')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_keys', to='data.Person')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='personmatchkey',
+            unique_together=set([('account', 'person', 'type', 'key')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='personmatchkey',
+            index_together=set([('account', 'type', 'key')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 06:30
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+def create_trigram_index(apps, schema_editor):
+    """
+    Trigram index for data.entity.match_company. Requires PostgreSQL with the
+    pg_trgm extension available; otherwise matching falls back to
+    data.entity.NGramIndex.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions "
+                       "WHERE name='pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX data_company_name_trgm ON data_company '
+        'USING gin (name gin_trgm_ops)'
+    )
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS data_company_name_trgm')
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0028_auto_20261018_0552'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 05:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_auto_20170513_0710'),
+        ('data', '0029_company_name_trgm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonMatchCandidate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.TextField()),
+                ('last_name', models.TextField()),
+                ('email', models.TextField(blank=True, null=True)),
+                ('location', models.TextField(blank=True, null=True)),
+                ('company', models.TextField(blank=True, null=True)),
+                ('linkedin_url', models.TextField(blank=True, null=True)),
+                ('account', models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='person_match_candidates', to='users.Account')),
+                ('employment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='match_candidate', to='data.Employment')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_candidates', to='data.Person')),
+            ],
+        ),
+    ]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 06:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0030_personmatchcandidate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='name_key',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='name_phonetic',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='first_name_key',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='first_name_phonetic',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='last_name_key',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='last_name_phonetic',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='personmatchcandidate',
+            name='first_name_phonetic',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='personmatchcandidate',
+            name='last_name_phonetic',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='personmatchkey',
+            name='type',
+            field=models.TextField(choices=[(b'email_domain', b'Email Domain'), (b'last_name_phonetic', b'Last Name Phonetic'), (b'last_name', b'Last Name'), (b'company', b'Company'), (b'linkedin', b'LinkedIn'), (b'first_name', b'First Name')]),
+        ),
+    ]
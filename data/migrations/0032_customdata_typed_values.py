@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 06:13
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0031_name_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customdata',
+            name='value_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customdata',
+            name='value_number',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customdata',
+            name='value_text',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='customdata',
+            index_together=set([('field', 'value_date'), ('field', 'value_number'), ('field', 'value_text')]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 06:20
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0012_auto_20170513_0710'),
+        ('data', '0032_customdata_typed_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.TextField(choices=[(b'failed', b'Failed'), (b'running', b'Running'), (b'queued', b'Queued'), (b'succeeded', b'Succeeded')], default=b'queued')),
+                ('progress', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('account', models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='sync_jobs', to='users.Account')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_jobs', to=settings.AUTH_USER_MODEL)),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_jobs', to='data.CustomTable')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='syncjob',
+            index_together=set([('status', 'created_at')]),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 06:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0033_sync_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.TextField()),
+                ('file_size', models.BigIntegerField()),
+                ('file_mtime', models.FloatField()),
+                ('field_map_hash', models.CharField(max_length=40)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('rows_read', models.IntegerField(default=0)),
+                ('rows_written', models.IntegerField(default=0)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_checkpoints', to='data.DataSource')),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_checkpoints', to='data.CustomTable')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='customrecordsource',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='synccheckpoint',
+            unique_together=set([('table', 'source', 'path')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 06:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_auto_20170513_0710'),
+        ('data', '0034_sync_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_raised', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('invested', models.DecimalField(decimal_places=6, default=0, max_digits=24)),
+                ('ownership', models.FloatField(blank=True, null=True)),
+                ('first_series', models.TextField(blank=True, null=True)),
+                ('first_date', models.DateField(blank=True, null=True)),
+                ('first_raised', models.DecimalField(blank=True, decimal_places=6, max_digits=24, null=True)),
+                ('first_post_money', models.DecimalField(blank=True, decimal_places=6, max_digits=24, null=True)),
+                ('last_series', models.TextField(blank=True, null=True)),
+                ('last_date', models.DateField(blank=True, null=True)),
+                ('last_raised', models.DecimalField(blank=True, decimal_places=6, max_digits=24, null=True)),
+                ('last_post_money', models.DecimalField(blank=True, decimal_places=6, max_digits=24, null=True)),
+                ('last_metrics', models.TextField(default=b'{}')),
+                ('board', models.TextField(default=b'[]')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('portfolio', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='users.AccountPortfolio')),
+            ],
+        ),
+    ]
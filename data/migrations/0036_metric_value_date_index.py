@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 06:46
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0035_portfolio_summary'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='metricvalue',
+            index_together=set([('metric', 'date')]),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 07:20
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+def has_trigram_index(schema_editor, name):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname=%s", [name])
+        return cursor.fetchone() is not None
+
+def index_name_key(apps, schema_editor):
+    """
+    Moves the trigram index of 0029 from name to name_key, which
+    data.entity.get_company_name_filter compares, as the NGramIndex
+    fallback and the scorer do.
+    """
+    if (schema_editor.connection.vendor != 'postgresql'
+            or not has_trigram_index(schema_editor, 'data_company_name_trgm')):
+        return
+    schema_editor.execute('DROP INDEX data_company_name_trgm')
+    schema_editor.execute(
+        'CREATE INDEX data_company_name_key_trgm ON data_company '
+        'USING gin (name_key gin_trgm_ops)'
+    )
+
+def index_name(apps, schema_editor):
+    if (schema_editor.connection.vendor != 'postgresql'
+            or not has_trigram_index(schema_editor,
+                                     'data_company_name_key_trgm')):
+        return
+    schema_editor.execute('DROP INDEX data_company_name_key_trgm')
+    schema_editor.execute(
+        'CREATE INDEX data_company_name_trgm ON data_company '
+        'USING gin (name gin_trgm_ops)'
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_auto_20170513_0710'),
+        ('data', '0036_metric_value_date_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_name_key, index_name),
+        migrations.AlterIndexTogether(
+            name='company',
+            index_together=set([('account', 'updated_at')]),
+        ),
+    ]
@@ -3,6 +3,8 @@ Models:
 
 * Person
 ** PersonTag
+** PersonMatchKey
+** PersonMatchCandidate
 
 * Company
 ** CompanyTag
@@ -20,10 +22,16 @@ Models:
 """
 
 import datetime
+import hashlib
 import json
+import math
 import os
+import re
+import threading
+import time
 from decimal import Decimal
-from django.db import models
+from django.db import connection, models, transaction
+from django.utils import timezone
 from shared.utils import parse_date
 from shared.constants import DEFAULT_ACCOUNT_ID, DATA_TYPES
 from data.api import get_api_format, create_from_api, update_from_api
@@ -87,6 +95,12 @@ class Person(models.Model):
     # Should be unique, but don't add a constraint for more flexibility around
     # user input.
     linkedin_url = models.TextField(null=True, blank=True)
+    # Normalized names and Double Metaphone codes for entity resolution. Set
+    # on save from first_name and last_name (see data.entity.set_person_keys).
+    first_name_key      = models.TextField(null=True, blank=True)
+    last_name_key       = models.TextField(null=True, blank=True)
+    first_name_phonetic = models.TextField(null=True, blank=True)
+    last_name_phonetic  = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -154,7 +168,15 @@ class Person(models.Model):
         return all_employment if not reverse else all_employment[::-1]
 
     def get_api_format(self):
-        latest_employment = self.get_latest_employment()
+        return self.get_api_format_with(self.get_latest_employment())
+
+    def get_api_format_with(self, latest_employment):
+        """
+        Args:
+            latest_employment [Employment]: The result of
+                                            get_latest_employment, when it's
+                                            already known.
+        """
         if latest_employment:
             (company, title) = (latest_employment.company.name,
                                 latest_employment.title)
@@ -311,9 +333,17 @@ class Company(models.Model):
     description = models.TextField(null=True, blank=True)
     crunchbase_id        = models.TextField(unique=True, null=True, blank=True)
     crunchbase_permalink = models.TextField(null=True, blank=True)
+    # Normalized name and Double Metaphone codes for entity resolution. Set
+    # on save from name (see data.entity.set_company_keys).
+    name_key      = models.TextField(null=True, blank=True)
+    name_phonetic = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Refreshes of data.entity.get_company_name_index
+        index_together = ('account', 'updated_at')
+
     def __unicode__(self):
         return u'(%s) %s' % (unicode(self.account), self.name or u'')
 
@@ -454,13 +484,9 @@ class Company(models.Model):
     # Investor API
 
     def get_last_metric(self, metric_name):
-        try:
-            return (self.metrics.get(name=metric_name, interval='Quarter',
-                                     estimated=False)
-                                .metric_values
-                                .order_by('date').last())
-        except Metric.DoesNotExist:
-            return None
+        return MetricValue.get_latest([self.id], [metric_name]).get(
+            (self.id, metric_name)
+        )
 
     def get_api_portco_format(self, investor):
         first_investment = self.get_latest_investment(investor)
@@ -481,14 +507,12 @@ class Company(models.Model):
             (last_series, last_date, last_raised, last_post) = \
                 (None, None, None, None)
 
-        revenue = self.get_last_metric('Revenue')
-        revenue = revenue.get_api_format() if revenue else {}
-        burn = self.get_last_metric('Burn')
-        burn = burn.get_api_format() if burn else {}
-        cash = self.get_last_metric('Cash')
-        cash = cash.get_api_format() if cash else {}
-        headcount = self.get_last_metric('Headcount')
-        headcount = headcount.get_api_format() if headcount else {}
+        last_metrics = {
+            metric_name: metric_value.get_api_format()
+            for (_, metric_name), metric_value in MetricValue.get_latest(
+                [self.id], ['Revenue', 'Burn', 'Cash', 'Headcount']
+            ).iteritems()
+        }
 
         return {
             'id': self.id,
@@ -515,10 +539,10 @@ class Company(models.Model):
                 'postMoney': first_post,
             },
             'lastMetrics': {
-                'revenue': revenue,
-                'burn': burn,
-                'cash': cash,
-                'headcount': headcount,
+                'revenue': last_metrics.get('Revenue', {}),
+                'burn': last_metrics.get('Burn', {}),
+                'cash': last_metrics.get('Cash', {}),
+                'headcount': last_metrics.get('Headcount', {}),
             },
             'board': self.get_api_board(),
             'interactions': investor.company.account.get_company_interactions(self),
@@ -890,20 +914,23 @@ class Metric(models.Model):
         }
         """
         metric_name = request_json.get('metric')
-        metric, _ = Metric.objects.update_or_create(
-            account=account, company=company, name=metric_name,
-            estimated=False, interval='Quarter'
-        )
-        for k, v in request_json.iteritems():
-            try:
-                date = datetime.datetime.strptime(k, '%Y-%m-%d').date()
-                if date and v:
-                    MetricValue.objects.update_or_create(
-                        account=account, metric=metric, date=date,
-                        defaults={ 'value': v }
-                    )
-            except ValueError:
-                continue
+        # One transaction, so that the portfolio summaries are refreshed once
+        # (see data.portfolio.refresh_summaries_on_commit)
+        with transaction.atomic():
+            metric, _ = Metric.objects.update_or_create(
+                account=account, company=company, name=metric_name,
+                estimated=False, interval='Quarter'
+            )
+            for k, v in request_json.iteritems():
+                try:
+                    date = datetime.datetime.strptime(k, '%Y-%m-%d').date()
+                    if date and v:
+                        MetricValue.objects.update_or_create(
+                            account=account, metric=metric, date=date,
+                            defaults={ 'value': v }
+                        )
+                except ValueError:
+                    continue
 
         return metric
 
@@ -918,18 +945,20 @@ class Metric(models.Model):
             ...
         }
         """
-        for k, v in request_json.iteritems():
-            try:
-                date = datetime.datetime.strptime(k, '%Y-%m-%d').date()
-                if date and v:
-                    MetricValue.objects.update_or_create(
-                        account=account,
-                        metric=self,
-                        date=date,
-                        defaults={ 'value': v }
-                    )
-            except ValueError:
-                continue
+        # One transaction, as in create_from_api
+        with transaction.atomic():
+            for k, v in request_json.iteritems():
+                try:
+                    date = datetime.datetime.strptime(k, '%Y-%m-%d').date()
+                    if date and v:
+                        MetricValue.objects.update_or_create(
+                            account=account,
+                            metric=self,
+                            date=date,
+                            defaults={ 'value': v }
+                        )
+                except ValueError:
+                    continue
 
         return self
 
@@ -955,11 +984,44 @@ class MetricValue(models.Model):
 
     class Meta:
         unique_together = ('account', 'metric', 'date')
+        # Latest value of a metric (see get_latest)
+        index_together = ('metric', 'date')
 
     def __unicode__(self):
         return (u'(%s) %s %s' % (unicode(self.account), unicode(self.metric),
                                  self.date))
 
+    @classmethod
+    def get_latest(cls, company_ids, metric_names, interval='Quarter',
+                   estimated=False):
+        """
+        Latest value of each of @metric_names for each of @company_ids, in
+        one DISTINCT ON query (PostgreSQL) that reads the (metric, date)
+        index backwards.
+
+        Returns:
+            [dict]: {
+                ([company_id], [metric name]): [MetricValue],
+                ...
+            }. Pairs without values are omitted. Of values on the same
+            date, the last one created is returned.
+        """
+        values = (cls.objects.filter(metric__company_id__in=company_ids,
+                                     metric__name__in=metric_names,
+                                     metric__interval=interval,
+                                     metric__estimated=estimated)
+                             .select_related('metric__company')
+                             .order_by('metric_id', '-date', '-id')
+                             .distinct('metric_id'))
+        # A company can have the same metric in more than one account
+        latest = {}
+        for value in values:
+            key = (value.metric.company_id, value.metric.name)
+            if key not in latest or ((value.date, value.id)
+                                     > (latest[key].date, latest[key].id)):
+                latest[key] = value
+        return latest
+
     def get_api_format(self):
         return {
             'id': self.id,
@@ -1347,6 +1409,90 @@ class Deal(models.Model):
         self.save()
         return self
 
+#####################
+# Entity resolution #
+#####################
+
+class PersonMatchKey(models.Model):
+    """
+    Blocking keys for entity resolution (see data.entity.match_person). Only
+    people that share at least one key with the input are fetched and scored.
+    Maintained by the Person/Employment signals in data.signals.
+
+    Relationships:
+        Person (N:1)
+    Candidate key:
+        (account_id, person_id, type, key)
+    Required fields:
+        account, person, type, key
+    """
+
+    TYPES = {
+        'First Name': 'first_name',
+        'Last Name': 'last_name',
+        'Last Name Phonetic': 'last_name_phonetic',
+        'Email Domain': 'email_domain',
+        'Company': 'company',
+        'LinkedIn': 'linkedin',
+    }
+    TYPE_CHOICES = [(v, k) for k, v in TYPES.iteritems()]
+
+    account    = models.ForeignKey('users.Account',
+                                   related_name='person_match_keys',
+                                   default=DEFAULT_ACCOUNT_ID)
+
+    person     = models.ForeignKey(Person, related_name='match_keys',
+                                   on_delete=models.CASCADE)
+    type       = models.TextField(choices=TYPE_CHOICES)
+    key        = models.TextField()
+
+    class Meta:
+        unique_together = ('account', 'person', 'type', 'key')
+        index_together = ('account', 'type', 'key')
+
+    def __unicode__(self):
+        return (u'(%s) %s %s %s' % (unicode(self.account), unicode(self.person),
+                                    self.type, self.key))
+
+class PersonMatchCandidate(models.Model):
+    """
+    Denormalized Person x Employment x Company rows scored by
+    data.entity.match_person, so matching doesn't re-join the three tables on
+    every call. Values are normalized (see data.entity.normalize), and names
+    are the Person/Company name keys. Refreshed incrementally by the
+    Person/Employment/Company signals in data.signals.
+
+    Relationships:
+        Person (N:1)
+        Employment (1:1)
+    Candidate key:
+        (employment_id)
+    Required fields:
+        account, person, employment, first_name, last_name
+    """
+
+    account    = models.ForeignKey('users.Account',
+                                   related_name='person_match_candidates',
+                                   default=DEFAULT_ACCOUNT_ID)
+
+    person     = models.ForeignKey(Person, related_name='match_candidates',
+                                   on_delete=models.CASCADE)
+    employment = models.OneToOneField(Employment,
+                                      related_name='match_candidate',
+                                      on_delete=models.CASCADE)
+    first_name = models.TextField()
+    last_name  = models.TextField()
+    first_name_phonetic = models.TextField(null=True, blank=True)
+    last_name_phonetic  = models.TextField(null=True, blank=True)
+    email      = models.TextField(null=True, blank=True)
+    location   = models.TextField(null=True, blank=True)
+    company    = models.TextField(null=True, blank=True)
+    linkedin_url = models.TextField(null=True, blank=True)
+
+    def __unicode__(self):
+        return (u'(%s) %s %s' % (unicode(self.account), unicode(self.person),
+                                 self.company))
+
 #################
 # Model Sources #
 #################
@@ -1414,16 +1560,24 @@ class DataSource(models.Model):
 
     @classmethod
     def get_default(cls):
-        return cls.objects.get(name='self')
+        return cls.get_source('self')
 
     @classmethod
     def get_source(cls, source):
-        if source is None or source == 'self':
-            return cls.get_default()
-        elif isinstance(source, cls):
+        """
+        Resolves a DataSource name (None for 'self') to the cached
+        DataSource (see get_data_sources).
+        """
+        if isinstance(source, cls):
             return source
-        else:
-            return cls.objects.get(name=source)
+        name = 'self' if source is None else source
+        data_sources = get_data_sources()
+        if name not in data_sources:
+            # Possibly created since the cache was loaded
+            data_sources = get_data_sources(reload=True)
+        if name not in data_sources:
+            raise cls.DoesNotExist('DataSource matching query does not exist.')
+        return data_sources[name]
 
     def get_api_format(self):
         data_source_options = (self.data_source_options.distinct('model')
@@ -1496,6 +1650,7 @@ class DataSource(models.Model):
                             'field_icon': get_key(field, 'icon'),
                         }
                     )
+        invalidate_schema()
 
 class DataSourceOption(models.Model):
     DEFAULT_ID = 1
@@ -1821,6 +1976,7 @@ class CustomField(models.Model):
         (self.custom_field_sources.filter(account=self.account, owner=self.owner)
                                   .exclude(source__name__in=source_names)
                                   .delete())
+        invalidate_schema(self.table_id)
 
 class CustomFieldSource(models.Model):
     account     = models.ForeignKey('users.Account',
@@ -1889,8 +2045,7 @@ class CustomRecord(models.Model):
             'Field_N': valN,
         }
         """
-        # TODO: Optimize
-        fields = fields if fields else self.table.custom_fields.all()
+        fields = fields if fields else get_table_schema(self.table_id).fields
         data_source = DataSource.get_source(source)
         record = { 'id': self.id }
 
@@ -1904,6 +2059,59 @@ class CustomRecord(models.Model):
 
         return record
 
+    @classmethod
+    def get_api_list_format(cls, records, fields, sources, chunk_size=500):
+        """
+        Batch version of get_api_format for a list endpoint: loads the
+        CustomData of all @records for all @sources with a single query and
+        pivots it in memory, instead of one query per record per source.
+
+        Args:
+            records [QuerySet|list]: CustomRecords of a single table, or an
+                                     ordered list of their ids (fetched
+                                     @chunk_size records per query).
+            fields [iterable]: CustomFields to include.
+            sources [iterable]: DataSources to include.
+
+        Returns:
+            [dict]: {
+                [source_name]: [<get_api_format(source, fields)>, ...],
+                ...
+            }, with records in the order of @records.
+        """
+        if isinstance(records, models.QuerySet):
+            record_ids = list(records.values_list('id', flat=True))
+            chunks = [records]
+        else:
+            record_ids = list(records)
+            chunks = [record_ids[i:i + chunk_size]
+                      for i in range(0, len(record_ids), chunk_size)]
+        empty_record = { field.api_name: None for field in fields }
+        source_names = { source.id: source.name for source in sources }
+        by_source = {
+            source_id: { record_id: dict(empty_record, id=record_id)
+                         for record_id in record_ids }
+            for source_id in source_names
+        }
+
+        for chunk in chunks:
+            custom_data = CustomData.objects.filter(
+                record__in=chunk, field__source__in=source_names.keys(),
+                field__field__in=fields
+            ).values_list('record_id', 'field__source_id',
+                          'field__field__api_name', 'value')
+            for record_id, source_id, field_name, value in \
+                    custom_data.iterator():
+                record = by_source[source_id].get(record_id)
+                if record is not None:
+                    record[field_name] = value
+
+        return {
+            source_names[source_id]: [records_by_id[record_id]
+                                      for record_id in record_ids]
+            for source_id, records_by_id in by_source.iteritems()
+        }
+
     @classmethod
     def create_from_api(cls, user, table, request_json, source=None,
                         source_key=None):
@@ -1916,19 +2124,14 @@ class CustomRecord(models.Model):
         data_source = DataSource.get_source(source)
         record = CustomRecord.objects.create(account=user.account, owner=user,
                                              table=table)
+        resolver = FieldSourceResolver(table.id)
         for field_name, value in request_json.iteritems():
             # TODO: Transform value based on type
-            try:
-                field = CustomFieldSource.objects.get(
-                    field__table=table,
-                    field__api_name=field_name,
-                    source=data_source
-                )
-                CustomData.objects.create(field=field, record=record,
-                                          owner=user, account=user.account,
-                                          value=value)
-            except CustomFieldSource.DoesNotExist:
+            field = resolver.get_field_source(field_name, data_source)
+            if field is None:
                 continue
+            CustomData.objects.create(field=field, record=record, owner=user,
+                                      account=user.account, value=value)
 
         if source_key:
             CustomRecordSource.objects.update_or_create(
@@ -1950,20 +2153,16 @@ class CustomRecord(models.Model):
         Currently only used in worker.py for data source/integration syncs.
         """
         data_source = DataSource.get_source(source)
+        resolver = FieldSourceResolver(table.id)
         for field_name, value in request_json.iteritems():
             # TODO: Transform value based on type
-            try:
-                field = CustomFieldSource.objects.get(
-                    field__table=table,
-                    field__api_name=field_name,
-                    source=data_source
-                )
-                CustomData.objects.update_or_create(field=field, record=self,
-                                                    owner=user,
-                                                    account=user.account,
-                                                    defaults={ 'value': value })
-            except CustomFieldSource.DoesNotExist:
+            field = resolver.get_field_source(field_name, data_source)
+            if field is None:
                 continue
+            CustomData.objects.update_or_create(field=field, record=self,
+                                                owner=user,
+                                                account=user.account,
+                                                defaults={ 'value': value })
 
         if source_key:
             CustomRecordSource.objects.update_or_create(
@@ -1995,6 +2194,138 @@ class CustomRecord(models.Model):
                 source=data_source, source_key=source_key
             )
 
+    @classmethod
+    def bulk_update_or_create_from_source(cls, user, table, rows, source,
+                                          chunk_size=1000,
+                                          skip_unchanged=False):
+        """
+        Batch version of update_or_create_from_source for syncs and imports.
+        Field sources are resolved once, then every @chunk_size rows are
+        written in one transaction with a constant number of queries: new
+        records and record sources with bulk_create, and data with a single
+        INSERT ... ON CONFLICT upsert (PostgreSQL 9.5+ or SQLite 3.24+).
+
+        The content hash of each row (see CustomRecordSource.get_content_hash)
+        is stored on its record sources. With @skip_unchanged, rows whose
+        hash matches the stored one are skipped.
+
+        Args:
+            rows [iterable]: (source_key, request_json) pairs. Later rows win
+                             if a source key is repeated.
+
+        Returns:
+            [int]: Number of rows written.
+        """
+        UPSERT_BATCH_SIZE = 1000
+
+        data_source = DataSource.get_source(source)
+        resolver = FieldSourceResolver(table.id)
+
+        def write_chunk(chunk):
+            record_sources = CustomRecordSource.objects.filter(
+                account=user.account, owner=user, table=table,
+                source=data_source, source_key__in=chunk.keys()
+            ).values_list('id', 'source_key', 'record_id', 'content_hash')
+            content_hashes = {
+                source_key: CustomRecordSource.get_content_hash(request_json)
+                for source_key, request_json in chunk.iteritems()
+            }
+            record_ids = {}
+            changed_hashes = {} # Record source id => new content hash
+            unchanged_keys = set(chunk.keys())
+            for record_source_id, source_key, record_id, content_hash \
+                    in record_sources:
+                record_ids.setdefault(source_key, []).append(record_id)
+                if content_hash != content_hashes[source_key]:
+                    changed_hashes[record_source_id] = content_hashes[source_key]
+                    unchanged_keys.discard(source_key)
+            unchanged_keys.difference_update(
+                k for k in chunk if k not in record_ids
+            )
+            if skip_unchanged:
+                for source_key in unchanged_keys:
+                    del chunk[source_key]
+
+            if changed_hashes:
+                CustomRecordSource.objects.filter(
+                    id__in=changed_hashes.keys()
+                ).update(content_hash=models.Case(*[
+                    models.When(id=record_source_id, then=models.Value(h))
+                    for record_source_id, h in changed_hashes.iteritems()
+                ], output_field=models.CharField()))
+
+            new_keys = [k for k in chunk if k not in record_ids]
+            if connection.features.can_return_ids_from_bulk_insert:
+                new_records = cls.objects.bulk_create([
+                    cls(account=user.account, owner=user, table=table)
+                    for _ in new_keys
+                ])
+            else:
+                new_records = [
+                    cls.objects.create(account=user.account, owner=user,
+                                       table=table)
+                    for _ in new_keys
+                ]
+            CustomRecordSource.objects.bulk_create([
+                CustomRecordSource(account=user.account, owner=user,
+                                   table=table, record=record,
+                                   source=data_source, source_key=source_key,
+                                   content_hash=content_hashes[source_key])
+                for source_key, record in zip(new_keys, new_records)
+            ])
+            for source_key, record in zip(new_keys, new_records):
+                record_ids[source_key] = [record.id]
+
+            now = timezone.now()
+            values = []
+            for source_key, request_json in chunk.iteritems():
+                for field_name, value in request_json.iteritems():
+                    # TODO: Transform value based on type
+                    field_source = resolver.get_field_source(field_name,
+                                                             data_source)
+                    if field_source is None:
+                        continue
+                    typed_values = CustomData.get_typed_values(
+                        field_source.field.type, value
+                    )
+                    for record_id in record_ids[source_key]:
+                        values.append([
+                            user.account.id, user.id, field_source.id,
+                            record_id, value, typed_values['value_number'],
+                            typed_values['value_date'],
+                            typed_values['value_text'], now, now
+                        ])
+            # Batched to stay under database parameter limits
+            cursor = connection.cursor()
+            for i in range(0, len(values), UPSERT_BATCH_SIZE):
+                batch = values[i:i + UPSERT_BATCH_SIZE]
+                RAW_SQL = '''
+INSERT INTO data_customdata (account_id, owner_id, field_id, record_id, value,
+                             value_number, value_date, value_text, created_at,
+                             updated_at)
+    VALUES %s
+    ON CONFLICT (field_id, record_id) DO UPDATE
+        SET value=excluded.value, value_number=excluded.value_number,
+            value_date=excluded.value_date, value_text=excluded.value_text,
+            updated_at=excluded.updated_at;''' % ','.join(
+                    ['(%s)' % ','.join(['%s'] * len(batch[0]))] * len(batch)
+                )
+                cursor.execute(RAW_SQL, [v for row in batch for v in row])
+            return len(chunk)
+
+        ct = 0
+        chunk = {}
+        for source_key, request_json in rows:
+            chunk.setdefault(source_key, {}).update(request_json)
+            if len(chunk) >= chunk_size:
+                with transaction.atomic():
+                    ct += write_chunk(chunk)
+                chunk = {}
+        if chunk:
+            with transaction.atomic():
+                ct += write_chunk(chunk)
+        return ct
+
 class CustomRecordSource(models.Model):
     account     = models.ForeignKey('users.Account',
                                     related_name='custom_record_sources',
@@ -2010,6 +2341,8 @@ class CustomRecordSource(models.Model):
                                     related_name='custom_record_sources',
                                     default=DataSource.DEFAULT_ID)
     source_key  = models.CharField(max_length=255)
+    # Hash of the data last synced from the source, see get_content_hash
+    content_hash = models.CharField(max_length=40, null=True, blank=True)
     created_at  = models.DateTimeField(auto_now_add=True)
     updated_at  = models.DateTimeField(auto_now=True)
 
@@ -2024,6 +2357,19 @@ class CustomRecordSource(models.Model):
         return (u'%s %s %s' % (unicode(self.record), unicode(self.source),
                                source_key))
 
+    @staticmethod
+    def get_content_hash(request_json):
+        """
+        Args:
+            request_json [dict]: { [field_api_name]: [value], ... }
+
+        Returns:
+            [str]: SHA-1 hex digest of @request_json, independent of key
+                   order.
+        """
+        return hashlib.sha1(json.dumps(request_json, sort_keys=True))\
+                      .hexdigest()
+
 class CustomData(models.Model):
     API_FIELDS = [
         'value',
@@ -2041,6 +2387,12 @@ class CustomData(models.Model):
                                    related_name='custom_data')
     record     = models.ForeignKey(CustomRecord, related_name='custom_data')
     value      = models.TextField()
+    # Typed copy of value according to the CustomField type, for indexed
+    # filtering and sorting (see data.query.CustomRecordQuery). Set on save
+    # (see set_typed_values); only the column of the field's type is used.
+    value_number = models.FloatField(null=True, blank=True)
+    value_date = models.DateField(null=True, blank=True)
+    value_text = models.CharField(max_length=255, null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -2050,7 +2402,527 @@ class CustomData(models.Model):
 
     class Meta:
         unique_together = ('field', 'record')
+        index_together = [
+            ('field', 'value_number'),
+            ('field', 'value_date'),
+            ('field', 'value_text'),
+        ]
+
+    NUMERIC_TYPES = set([DATA_TYPES['number'], DATA_TYPES['money']])
+    DATE_TYPES = set([DATA_TYPES['date']])
 
     def get_api_format(self):
         return get_api_format(self, self.API_FIELDS)
 
+    @classmethod
+    def get_typed_column(cls, field_type):
+        if field_type in cls.NUMERIC_TYPES:
+            return 'value_number'
+        elif field_type in cls.DATE_TYPES:
+            return 'value_date'
+        else:
+            return 'value_text'
+
+    @classmethod
+    def get_typed_values(cls, field_type, value):
+        """
+        Args:
+            field_type [str]: CustomField type (see DATA_TYPES).
+            value [str]: CustomData value.
+
+        Returns:
+            [dict]: {
+                'value_number': [float],
+                'value_date': [datetime.date],
+                'value_text': [str],
+            }, where only the column of @field_type (see get_typed_column) is
+            set, or None if @value can't be parsed as @field_type. Text is
+            lowercased and truncated to 255 characters.
+        """
+        typed_values = {
+            'value_number': None,
+            'value_date': None,
+            'value_text': None,
+        }
+        column = cls.get_typed_column(field_type)
+        value = value.strip() if value else ''
+        if not value:
+            return typed_values
+
+        if column == 'value_number':
+            try:
+                number = float(re.sub(r'[\s,$]', '', value))
+                if not math.isinf(number) and not math.isnan(number):
+                    typed_values[column] = number
+            except ValueError:
+                pass
+        elif column == 'value_date':
+            try:
+                typed_values[column] = parse_date(value)
+            except (ValueError, OverflowError):
+                pass
+        else:
+            typed_values[column] = value.lower()[:255]
+        return typed_values
+
+    def set_typed_values(self, field_type=None):
+        field_type = field_type or self.field.field.type
+        for column, typed_value in self.get_typed_values(
+            field_type, self.value
+        ).iteritems():
+            setattr(self, column, typed_value)
+
+    # Rows per UPDATE statement in update_typed_values
+    UPDATE_BATCH_SIZE = 1000
+
+    @classmethod
+    def update_typed_values(cls, field):
+        """
+        Recomputes the typed values of all CustomData of CustomField @field,
+        e.g. after its type changed. The values are parsed here (see
+        get_typed_values) and written with one UPDATE ... FROM (VALUES ...)
+        statement per UPDATE_BATCH_SIZE rows (PostgreSQL or SQLite 3.33+).
+        """
+        custom_data = (cls.objects.filter(field__field=field)
+                                  .values_list('id', 'value'))
+        cursor = connection.cursor()
+        batch = []
+        for custom_data_id, value in custom_data.iterator():
+            typed_values = cls.get_typed_values(field.type, value)
+            batch.append([custom_data_id, typed_values['value_number'],
+                          typed_values['value_date'],
+                          typed_values['value_text']])
+            if len(batch) >= cls.UPDATE_BATCH_SIZE:
+                cls.__update_typed_values(cursor, batch)
+                batch = []
+        if batch:
+            cls.__update_typed_values(cursor, batch)
+
+    @classmethod
+    def __update_typed_values(cls, cursor, batch):
+        # NULL literals in VALUES are untyped on PostgreSQL. SQLite doesn't
+        # need the casts (and CAST(... AS date) would truncate the dates).
+        columns = ['v.column%d' % i for i in range(1, 5)]
+        if connection.vendor == 'postgresql':
+            columns = ['%s::%s' % (column, column_type) for column, column_type
+                       in zip(columns, ['integer', 'double precision', 'date',
+                                        'varchar(255)'])]
+        RAW_SQL = '''
+UPDATE data_customdata
+    SET value_number=%s, value_date=%s, value_text=%s
+    FROM (VALUES %s) AS v
+    WHERE data_customdata.id=%s;''' % tuple(
+            columns[1:] + [','.join(['(%s,%s,%s,%s)'] * len(batch)),
+                           columns[0]]
+        )
+        cursor.execute(RAW_SQL, [v for row in batch for v in row])
+
+
+#############
+# Sync jobs #
+#############
+
+class SyncJob(models.Model):
+    """
+    Queued run of data.integrations.worker.sync_table, executed by the
+    run_jobs command so that syncs don't tie up a web worker. At most one job
+    per table is queued or running at a time (see enqueue).
+
+    Relationships:
+        CustomTable (N:1)
+    Required fields:
+        account, owner, table, status
+    """
+
+    STATUSES = {
+        'Queued': 'queued',
+        'Running': 'running',
+        'Succeeded': 'succeeded',
+        'Failed': 'failed',
+    }
+    STATUS_CHOICES = [(v, k) for k, v in STATUSES.iteritems()]
+    ACTIVE_STATUSES = [STATUSES['Queued'], STATUSES['Running']]
+
+    # A running job whose heartbeat is older than this (in seconds) is
+    # assumed to have lost its worker and is requeued, up to MAX_ATTEMPTS
+    # times in total.
+    HEARTBEAT_TIMEOUT = 15 * 60
+    MAX_ATTEMPTS = 3
+
+    API_FIELDS = [
+        'table_id', 'status', 'progress', 'error', 'attempts', 'created_at',
+        'started_at', 'finished_at',
+    ]
+
+    account    = models.ForeignKey('users.Account', related_name='sync_jobs',
+                                   default=DEFAULT_ACCOUNT_ID)
+    owner      = models.ForeignKey('users.User', related_name='sync_jobs')
+
+    table      = models.ForeignKey(CustomTable, related_name='sync_jobs',
+                                   on_delete=models.CASCADE)
+    status     = models.TextField(choices=STATUS_CHOICES,
+                                  default=STATUSES['Queued'])
+    progress   = models.IntegerField(default=0) # Rows synced so far
+    error      = models.TextField(null=True, blank=True)
+    attempts   = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = ('status', 'created_at')
+
+    def __unicode__(self):
+        return u'%s %s' % (unicode(self.table), self.status)
+
+    def get_api_format(self):
+        return get_api_format(self, self.API_FIELDS)
+
+    @classmethod
+    def enqueue(cls, user, table):
+        """
+        Queues a sync of @table, unless one is already queued or running.
+
+        Returns:
+            [tuple]: ([SyncJob], [bool: whether a new job was created])
+        """
+        with transaction.atomic():
+            # Serializes concurrent enqueues of the same table
+            CustomTable.objects.select_for_update().get(id=table.id)
+            job = (cls.objects.filter(table=table,
+                                      status__in=cls.ACTIVE_STATUSES)
+                              .order_by('created_at').first())
+            if job:
+                return job, False
+            return cls.objects.create(account=user.account, owner=user,
+                                      table=table), True
+
+    @classmethod
+    def claim_next(cls):
+        """
+        Marks the oldest queued job as running and returns it, or None if
+        the queue is empty. Safe to call from several workers: a job is only
+        claimed by the worker whose conditional UPDATE matches it.
+        """
+        cls.requeue_stale()
+        queued = (cls.objects.filter(status=cls.STATUSES['Queued'])
+                             .order_by('created_at')
+                             .values_list('id', flat=True))
+        for job_id in queued[:10]:
+            now = timezone.now()
+            claimed = cls.objects.filter(
+                id=job_id, status=cls.STATUSES['Queued']
+            ).update(status=cls.STATUSES['Running'], started_at=now,
+                     heartbeat_at=now, attempts=models.F('attempts') + 1)
+            if claimed:
+                return cls.objects.get(id=job_id)
+        return None
+
+    @classmethod
+    def requeue_stale(cls):
+        stale = cls.objects.filter(
+            status=cls.STATUSES['Running'],
+            heartbeat_at__lt=timezone.now() - datetime.timedelta(
+                seconds=cls.HEARTBEAT_TIMEOUT
+            )
+        )
+        stale.filter(attempts__gte=cls.MAX_ATTEMPTS).update(
+            status=cls.STATUSES['Failed'], error='Worker timed out',
+            finished_at=timezone.now()
+        )
+        stale.update(status=cls.STATUSES['Queued'])
+
+    def set_progress(self, progress):
+        """
+        Records the number of rows synced so far, which is also the job's
+        heartbeat.
+        """
+        self.progress = progress
+        self.heartbeat_at = timezone.now()
+        SyncJob.objects.filter(id=self.id).update(
+            progress=self.progress, heartbeat_at=self.heartbeat_at
+        )
+
+    def finish(self, error=None):
+        self.status = (self.STATUSES['Failed'] if error
+                       else self.STATUSES['Succeeded'])
+        self.error = error
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'error', 'finished_at'])
+
+class SyncCheckpoint(models.Model):
+    """
+    Progress of a table sync through a source file, so an interrupted sync
+    resumes where it stopped and a completed one is skipped until the file
+    changes. Rows that did change are found with the record source content
+    hashes (see CustomRecord.bulk_update_or_create_from_source).
+
+    Relationships:
+        CustomTable (N:1)
+        DataSource (N:1)
+    Candidate key:
+        (table_id, source_id, path)
+    Required fields:
+        table, source, path, file_size, file_mtime, field_map_hash
+    """
+
+    table      = models.ForeignKey(CustomTable, related_name='sync_checkpoints',
+                                   on_delete=models.CASCADE)
+    source     = models.ForeignKey(DataSource, related_name='sync_checkpoints')
+    path       = models.TextField()
+    # Identify the version of the file the offset belongs to
+    file_size  = models.BigIntegerField()
+    file_mtime = models.FloatField()
+    # Identifies the fields synced from the file; rows are reread if it
+    # changes even though the file hasn't
+    field_map_hash = models.CharField(max_length=40)
+    # Bytes (or rows, for snapshots) read and committed
+    offset     = models.BigIntegerField(default=0)
+    rows_read  = models.IntegerField(default=0)
+    rows_written = models.IntegerField(default=0)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('table', 'source', 'path')
+
+    def __unicode__(self):
+        return u'%s %s %s %d' % (unicode(self.table), unicode(self.source),
+                                 self.path, self.offset)
+
+    @classmethod
+    def get_for_file(cls, table, source, path, field_map):
+        """
+        Returns the checkpoint of @table for the file at @path, reset to the
+        start of the file if the file or @field_map has changed since it was
+        recorded.
+
+        Args:
+            field_map [dict]: { [file column]: [CustomField], ... }
+        """
+        stat = os.stat(path)
+        field_map_hash = hashlib.sha1(json.dumps(sorted(
+            (column, field.api_name) for column, field in field_map.iteritems()
+        ))).hexdigest()
+        checkpoint, created = cls.objects.get_or_create(
+            table=table, source=source, path=path,
+            defaults={ 'file_size': stat.st_size,
+                       'file_mtime': stat.st_mtime,
+                       'field_map_hash': field_map_hash }
+        )
+        if not created and (checkpoint.file_size != stat.st_size
+                            or checkpoint.file_mtime != stat.st_mtime
+                            or checkpoint.field_map_hash != field_map_hash):
+            checkpoint.file_size = stat.st_size
+            checkpoint.file_mtime = stat.st_mtime
+            checkpoint.field_map_hash = field_map_hash
+            checkpoint.offset = 0
+            checkpoint.rows_read = 0
+            checkpoint.rows_written = 0
+            checkpoint.completed_at = None
+            checkpoint.save()
+        return checkpoint
+
+    @property
+    def completed(self):
+        return self.completed_at is not None
+
+#######################
+# Portfolio summaries #
+#######################
+
+class PortfolioSummary(models.Model):
+    """
+    Totals, rounds, last metrics and board of a portfolio company as seen by
+    the account's investor (see Account.get_api_portfolio), refreshed when a
+    transaction that changes an Investment, InvestorInvestment, Metric,
+    MetricValue or BoardMember of the company commits (see data.signals and
+    data.portfolio.refresh_summaries_on_commit). A refresh that fails after
+    the commit leaves the summary stale until rebuild_portfolio_summaries
+    is run.
+
+    Relationships:
+        AccountPortfolio (1:1)
+    Candidate key:
+        portfolio_id
+    Required fields:
+        portfolio
+    """
+
+    portfolio  = models.OneToOneField('users.AccountPortfolio',
+                                      related_name='summary',
+                                      on_delete=models.CASCADE)
+    total_raised = models.DecimalField(max_digits=24, decimal_places=6,
+                                       default=0)
+    invested   = models.DecimalField(max_digits=24, decimal_places=6,
+                                     default=0)
+    ownership  = models.FloatField(null=True, blank=True)
+    first_series = models.TextField(null=True, blank=True)
+    first_date = models.DateField(null=True, blank=True)
+    first_raised = models.DecimalField(max_digits=24, decimal_places=6,
+                                       null=True, blank=True)
+    first_post_money = models.DecimalField(max_digits=24, decimal_places=6,
+                                           null=True, blank=True)
+    last_series = models.TextField(null=True, blank=True)
+    last_date  = models.DateField(null=True, blank=True)
+    last_raised = models.DecimalField(max_digits=24, decimal_places=6,
+                                      null=True, blank=True)
+    last_post_money = models.DecimalField(max_digits=24, decimal_places=6,
+                                          null=True, blank=True)
+    # JSON: { [lastMetrics key]: [MetricValue API format or {}], ... }
+    last_metrics = models.TextField(default='{}')
+    # JSON: board member person ids, in Company.get_board order
+    board      = models.TextField(default='[]')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Fields set by data.portfolio.get_summary_values
+    VALUE_FIELDS = [
+        'total_raised', 'invested', 'ownership', 'first_series', 'first_date',
+        'first_raised', 'first_post_money', 'last_series', 'last_date',
+        'last_raised', 'last_post_money', 'last_metrics', 'board',
+    ]
+
+    def __unicode__(self):
+        return u'%s' % unicode(self.portfolio)
+
+    def get_board_person_ids(self):
+        return json.loads(self.board)
+
+    def get_api_format(self):
+        """
+        Returns:
+            [dict]: The summarized part of Company.get_api_portco_format.
+        """
+        return {
+            'totalRaised': self.total_raised,
+            'invested': self.invested,
+            'ownership': self.ownership,
+            'latestRoundSeries': self.last_series,
+            'lastRound': {
+                'series': self.last_series,
+                'date': self.last_date,
+                'raised': self.last_raised,
+                'postMoney': self.last_post_money,
+            },
+            'firstRound': {
+                'series': self.first_series,
+                'date': self.first_date,
+                'raised': self.first_raised,
+                'postMoney': self.first_post_money,
+            },
+            'lastMetrics': json.loads(self.last_metrics),
+        }
+
+################
+# Schema cache #
+################
+
+# Seconds a cached schema is used before being reloaded. Writes made by this
+# process invalidate it immediately (see invalidate_schema); this bounds how
+# long other processes can see a stale schema.
+SCHEMA_CACHE_TTL = 60
+
+class TableSchema(object):
+    """
+    Cached fields and field sources of a custom table (see get_table_schema).
+    The model instances are shared between threads and must not be modified.
+    """
+
+    def __init__(self, table_id):
+        self.loaded_at = time.time()
+        self.fields = list(CustomField.objects.filter(table=table_id)
+                                              .order_by('created_at'))
+        self.fields_by_name = { field.api_name: field for field in self.fields }
+        fields_by_id = { field.id: field for field in self.fields }
+        self.field_sources = {} # (field api name, source id) => field source
+        for field_source in CustomFieldSource.objects.filter(
+            field__table=table_id
+        ):
+            field_source.field = fields_by_id[field_source.field_id]
+            self.field_sources[(field_source.field.api_name,
+                                field_source.source_id)] = field_source
+
+    def get_field_source(self, field_name, source):
+        """
+        Returns:
+            [CustomFieldSource]: The field source of the field @field_name
+                                 for the DataSource @source, or None.
+        """
+        return self.field_sources.get((field_name, source.id))
+
+    def get_field_sources(self, fields, sources):
+        field_names = set(field.api_name for field in fields)
+        source_ids = set(source.id for source in sources)
+        return [
+            field_source
+            for (field_name, source_id), field_source
+            in self.field_sources.iteritems()
+            if field_name in field_names and source_id in source_ids
+        ]
+
+class FieldSourceResolver(object):
+    """
+    Resolves field names to the field sources of a custom table for one
+    write. On a miss the cached schema is reloaded once, since the field (or
+    its field source) may have been created by another process since it was
+    cached, before the field is given up on.
+    """
+
+    def __init__(self, table_id):
+        self.table_id = table_id
+        self.schema = get_table_schema(table_id)
+        self.reloaded = False
+
+    def get_field_source(self, field_name, source):
+        field_source = self.schema.get_field_source(field_name, source)
+        if field_source is None and not self.reloaded:
+            self.schema = get_table_schema(self.table_id, reload=True)
+            self.reloaded = True
+            field_source = self.schema.get_field_source(field_name, source)
+        return field_source
+
+_schema_lock = threading.Lock()
+_table_schemas = {} # table id => TableSchema
+_data_sources = {}  # 'loaded_at' => [float], 'by_name' => { name: DataSource }
+
+def is_expired(loaded_at):
+    return loaded_at is None or time.time() - loaded_at > SCHEMA_CACHE_TTL
+
+def get_table_schema(table_id, reload=False):
+    schema = _table_schemas.get(table_id)
+    if reload or schema is None or is_expired(schema.loaded_at):
+        schema = TableSchema(table_id)
+        with _schema_lock:
+            _table_schemas[table_id] = schema
+    return schema
+
+def get_data_sources(reload=False):
+    """
+    Returns:
+        [dict]: { [name]: [DataSource], ... }
+    """
+    by_name = _data_sources.get('by_name')
+    if reload or by_name is None or is_expired(_data_sources.get('loaded_at')):
+        by_name = { source.name: source
+                    for source in DataSource.objects.all() }
+        with _schema_lock:
+            _data_sources.update({ 'loaded_at': time.time(),
+                                   'by_name': by_name })
+    return by_name
+
+def invalidate_schema(table_id=None):
+    """
+    Drops the cached schema of custom table @table_id, or every cached
+    schema and the data sources if None. Repeated once the current
+    transaction commits, in case the schema was reloaded in between.
+    """
+    def invalidate():
+        with _schema_lock:
+            if table_id is None:
+                _table_schemas.clear()
+                _data_sources.clear()
+            else:
+                _table_schemas.pop(table_id, None)
+    invalidate()
+    transaction.on_commit(invalidate)
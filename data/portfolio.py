@@ -0,0 +1,325 @@
+"""
+Batched version of Company.get_api_portco_format for a whole portfolio. The
+investments, metric values, investor investments, board members and
+interactions of all the companies are loaded with one query each, so the
+number of queries doesn't depend on the size of the portfolio.
+
+Everything but the company, board member and interaction details is
+materialized in PortfolioSummary, refreshed when a transaction that changes
+the underlying rows commits (see data.signals).
+"""
+
+import collections
+import json
+import threading
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from contacts.models import Interaction
+from data.models import BoardMember, Employment, Investment,\
+    InvestorInvestment, Metric, MetricValue, Person, PortfolioSummary
+
+# Metric name => key in 'lastMetrics' (see MetricValue.get_latest)
+LAST_METRICS = {
+    'Revenue': 'revenue',
+    'Burn': 'burn',
+    'Cash': 'cash',
+    'Headcount': 'headcount',
+}
+
+def group_by(rows, key):
+    """
+    Returns:
+        [dict]: { [key(row)]: [list: rows, in order] }
+    """
+    groups = collections.defaultdict(list)
+    for row in rows:
+        groups[key(row)].append(row)
+    return groups
+
+def get_latest_employments(person_ids):
+    """
+    Person.get_latest_employment for many people.
+
+    Returns:
+        [dict]: { [person_id]: [Employment] }
+    """
+    employments = (Employment.objects.filter(person_id__in=person_ids)
+                                     .select_related('company')
+                                     .order_by('person_id', 'end_date',
+                                               'start_date', 'company__name',
+                                               'title'))
+    # Current employment first, then employment without an end date, then
+    # the rest: the last of the first non-empty group
+    latest = {}
+    for employment in employments:
+        group = (0 if employment.current
+                 else 1 if employment.end_date is None
+                 else 2)
+        person_latest = latest.get(employment.person_id)
+        if person_latest is None or group <= person_latest[0]:
+            latest[employment.person_id] = (group, employment)
+    return { person_id: employment
+             for person_id, (_, employment) in latest.iteritems() }
+
+def get_round_values(prefix, investment):
+    return {
+        prefix + 'series': investment.series if investment else None,
+        prefix + 'date': investment.date if investment else None,
+        prefix + 'raised': investment.raised if investment else None,
+        prefix + 'post_money': investment.post_money if investment else None,
+    }
+
+def get_account_investor(account):
+    company = account.company
+    return company.investor if company.is_investor() else None
+
+def get_summary_values(investor, company_ids):
+    """
+    Args:
+        investor [Investor]: Investor whose investments are summarized, or
+                             None.
+        company_ids [list]
+
+    Returns:
+        [dict]: {
+            [company_id]: { [PortfolioSummary field]: [value], ... },
+            ...
+        }
+    """
+    # Ordered as in Company.get_investments, so the last is the latest
+    investments = group_by(
+        Investment.objects.filter(company_id__in=company_ids)
+                          .order_by('date', 'series'),
+        lambda investment: investment.company_id
+    )
+    investor_investments = group_by(
+        InvestorInvestment.objects.filter(investor=investor,
+                                          investment__company_id__in=company_ids)
+                                  .select_related('investment')
+                                  .order_by('-date')
+        if investor else [],
+        lambda ii: ii.investment.company_id
+    )
+    last_metric_values = MetricValue.get_latest(company_ids,
+                                                LAST_METRICS.keys())
+
+    # Distinct as in Company.get_board
+    board_order = ('person__first_name', 'person__last_name', 'end_date',
+                   'start_date', 'person_id')
+    board = collections.defaultdict(list)
+    last_key = None
+    for key in (BoardMember.objects.filter(company_id__in=company_ids)
+                                   .order_by('company_id', *board_order)
+                                   .values_list('company_id', *board_order)):
+        if key != last_key:
+            board[key[0]].append(key[-1])
+        last_key = key
+
+    summaries = {}
+    for company_id in company_ids:
+        company_investments = investments[company_id]
+        company_investor_investments = investor_investments[company_id]
+        invested_ids = set(ii.investment_id
+                           for ii in company_investor_investments)
+        first_investment = None
+        for investment in company_investments:
+            if investment.id in invested_ids:
+                first_investment = investment
+        last_investment = (company_investments[-1] if company_investments
+                           else None)
+
+        last_metrics = {}
+        for metric_name, key in LAST_METRICS.iteritems():
+            value = last_metric_values.get((company_id, metric_name))
+            last_metrics[key] = value.get_api_format() if value else {}
+
+        summaries[company_id] = dict(
+            total_raised=(sum(investment.raised
+                              for investment in company_investments
+                              if investment.raised is not None)
+                          or Decimal(0)),
+            invested=(sum(ii.invested for ii in company_investor_investments
+                          if ii.invested is not None)
+                      or Decimal(0)),
+            ownership=next((ii.ownership
+                            for ii in company_investor_investments
+                            if ii.ownership), None),
+            last_metrics=json.dumps(last_metrics, cls=DjangoJSONEncoder,
+                                    sort_keys=True),
+            board=json.dumps(board[company_id]),
+            **dict(get_round_values('first_', first_investment).items()
+                   + get_round_values('last_', last_investment).items())
+        )
+    return summaries
+
+def refresh_summaries(portfolios):
+    """
+    Creates or recomputes the PortfolioSummary of each of @portfolios.
+
+    Args:
+        portfolios [list]: AccountPortfolio rows.
+    """
+    by_account = group_by(portfolios, lambda portfolio: portfolio.account_id)
+    for account_portfolios in by_account.itervalues():
+        investor = get_account_investor(account_portfolios[0].account)
+        values = get_summary_values(investor, [portfolio.company_id
+                                               for portfolio
+                                               in account_portfolios])
+        for portfolio in account_portfolios:
+            PortfolioSummary.objects.update_or_create(
+                portfolio=portfolio, defaults=values[portfolio.company_id]
+            )
+
+def refresh_company_summaries(company_ids):
+    """
+    Recomputes the existing summaries of @company_ids, in every portfolio
+    they're in. Summaries aren't created here, so that none is recreated
+    while the portfolio is being deleted (e.g. when cascading from the
+    company).
+    """
+    summaries = group_by(
+        PortfolioSummary.objects.filter(portfolio__company_id__in=company_ids)
+                                .select_related('portfolio__account__company'),
+        lambda summary: summary.portfolio.account_id
+    )
+    for account_summaries in summaries.itervalues():
+        investor = get_account_investor(account_summaries[0].portfolio.account)
+        values = get_summary_values(investor, [summary.portfolio.company_id
+                                               for summary
+                                               in account_summaries])
+        for summary in account_summaries:
+            for field, value in values[summary.portfolio.company_id].iteritems():
+                setattr(summary, field, value)
+            summary.save()
+
+class SummaryRefresh(object):
+    """
+    Changes whose summaries are refreshed once the current transaction
+    commits (see refresh_summaries_on_commit). Metric and Investment ids are
+    resolved to their companies then, with one query each.
+    """
+
+    def __init__(self):
+        self.company_ids = set()
+        self.metric_ids = set()
+        self.investment_ids = set()
+
+    def __call__(self):
+        company_ids = set(self.company_ids)
+        # Rows deleted since are ignored: their deletion added the company
+        company_ids.update(Metric.objects.filter(id__in=self.metric_ids)
+                                         .values_list('company_id', flat=True))
+        company_ids.update(Investment.objects
+                                     .filter(id__in=self.investment_ids)
+                                     .values_list('company_id', flat=True))
+        if company_ids:
+            with transaction.atomic():
+                refresh_company_summaries(sorted(company_ids))
+
+# The changes not refreshed yet on this thread
+_pending = threading.local()
+
+def refresh_pending_summaries():
+    refresh = getattr(_pending, 'refresh', None)
+    _pending.refresh = None
+    if refresh is not None:
+        refresh()
+
+def refresh_summaries_on_commit(company_id=None, metric_id=None,
+                                investment_id=None):
+    """
+    Refreshes the summaries of the company of a changed row once the current
+    transaction commits (right away in autocommit mode). All the changes of
+    a transaction are refreshed together by the first of its on_commit
+    callbacks to run, so deleting a company or metric doesn't recompute its
+    summaries once per cascaded row. Changes whose transaction (or
+    savepoint) rolled back are refreshed with the next commit, which is
+    harmless since summaries are recomputed from the database.
+    """
+    refresh = getattr(_pending, 'refresh', None)
+    if refresh is None:
+        refresh = _pending.refresh = SummaryRefresh()
+    if company_id is not None:
+        refresh.company_ids.add(company_id)
+    if metric_id is not None:
+        refresh.metric_ids.add(metric_id)
+    if investment_id is not None:
+        refresh.investment_ids.add(investment_id)
+    # Registered for every change, since the callbacks of a savepoint that
+    # rolls back are dropped
+    transaction.on_commit(refresh_pending_summaries)
+
+def get_api_portfolio(account, portfolios):
+    """
+    Args:
+        account [Account]
+        portfolios [QuerySet]: AccountPortfolio rows of @account.
+
+    Returns:
+        [list]: Company.get_api_portco_format(investor) for the company of
+                each of @portfolios, in order, from their PortfolioSummary
+                (computed first if missing).
+    """
+    portfolios = list(portfolios.select_related('company', 'summary'))
+    company_ids = [portfolio.company_id for portfolio in portfolios]
+    summaries = { portfolio.company_id: portfolio.summary
+                  for portfolio in portfolios
+                  if hasattr(portfolio, 'summary') }
+    missing = [portfolio for portfolio in portfolios
+               if portfolio.company_id not in summaries]
+    if missing:
+        refresh_summaries(missing)
+        for summary in (PortfolioSummary.objects.filter(portfolio__in=missing)
+                                                .select_related('portfolio')):
+            summaries[summary.portfolio.company_id] = summary
+
+    board_person_ids = set(person_id for summary in summaries.itervalues()
+                           for person_id in summary.get_board_person_ids())
+    people = Person.objects.in_bulk(board_person_ids)
+    latest_employments = get_latest_employments(board_person_ids)
+
+    # An interaction is listed once per employment of the person at the
+    # company, as in Account.get_company_interactions
+    employers = collections.defaultdict(list)
+    for person_id, company_id in (Employment.objects
+                                            .filter(company_id__in=company_ids)
+                                            .values_list('person_id',
+                                                         'company_id')):
+        employers[person_id].append(company_id)
+    interactions = collections.defaultdict(list)
+    for interaction in (Interaction.objects
+                                   .filter(user__account=account,
+                                           person_id__in=employers.keys())
+                                   .select_related('person', 'user__person')
+                                   .order_by('-date', 'label')):
+        api_format = interaction.get_api_format()
+        for company_id in employers[interaction.person_id]:
+            interactions[company_id].append(api_format)
+
+    api_portfolio = []
+    for portfolio in portfolios:
+        company = portfolio.company
+        summary = summaries[company.id]
+        api_format = {
+            'id': company.id,
+            'name': company.name,
+            'segment': company.segment,
+            'sector': company.sector,
+            'location': company.location,
+            'website': company.website,
+            'logoUrl': company.logo_url,
+            'board': [
+                people[person_id].get_api_format_with(
+                    latest_employments.get(person_id)
+                )
+                for person_id in summary.get_board_person_ids()
+                if person_id in people
+            ],
+            'interactions': interactions[company.id],
+        }
+        api_format.update(summary.get_api_format())
+        api_portfolio.append(api_format)
+    return api_portfolio
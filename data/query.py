@@ -0,0 +1,257 @@
+"""
+Server-side filtering, sorting and projection of custom table records,
+compiled into SQL over the EAV tables (CustomRecord x CustomData).
+"""
+
+from django.db import connection
+
+from data.models import CustomRecord, CustomData, DataSource,\
+    get_data_sources, get_table_schema
+from data.sql import stream_query
+
+def get_typed_param(field_type, value):
+    """
+    Converts a filter value from the query string to the typed CustomData
+    column it's compared with (see CustomData.get_typed_values). Raises
+    ValueError if it can't be.
+    """
+    column = CustomData.get_typed_column(field_type)
+    typed_value = CustomData.get_typed_values(field_type, value)[column]
+    if typed_value is None:
+        raise ValueError('Invalid %s value: %s' % (field_type, value))
+    return typed_value
+
+def escape_like(s):
+    return s.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+class CustomRecordQuery(object):
+    """
+    Query over the records of a custom table:
+
+        * filters: [(field_api_name, op, value), ...], ANDed. Values are
+          compared according to the field's CustomField.type, using the
+          indexed typed CustomData columns.
+        * sort: Field api name to order by (nulls last), then by id.
+        * fields: Field api names to return (all by default).
+        * source: DataSource whose values are filtered, sorted and returned.
+          Filters and sorts use 'self' and all sources are returned if None.
+
+    Paginated with either @after (keyset, unsorted queries only) or @offset,
+    and @limit.
+    """
+
+    OPERATORS = {
+        'eq': '=',
+        'ne': '<>',
+        'lt': '<',
+        'lte': '<=',
+        'gt': '>',
+        'gte': '>=',
+        'contains': 'LIKE',
+    }
+
+    def __init__(self, account, table, source=None, filters=None, sort=None,
+                 descending=False, fields=None, after=None, limit=None,
+                 offset=None):
+        self.account = account
+        self.table = table
+        self.source = DataSource.get_source(source)
+        self.sources = ([self.source] if source
+                        else sorted(get_data_sources().values(),
+                                    key=lambda s: s.id))
+        self.filters = filters or []
+        self.sort = sort
+        self.descending = descending
+        self.after = after
+        self.limit = limit
+        self.offset = offset
+
+        field_names = [field_name for field_name
+                       in [f for f, _, _ in self.filters] + [sort]
+                       + (fields or [])
+                       if field_name]
+        self.schema = get_table_schema(table.id)
+        if any(f not in self.schema.fields_by_name for f in field_names):
+            # Possibly created by another process since the schema was cached
+            self.schema = get_table_schema(table.id, reload=True)
+        self.table_fields = self.schema.fields_by_name
+        for field_name in field_names:
+            if field_name not in self.table_fields:
+                raise ValueError('Unknown field: %s' % field_name)
+        for _, op, _ in self.filters:
+            if op not in self.OPERATORS:
+                raise ValueError('Unknown operator: %s' % op)
+        if sort and after is not None:
+            raise ValueError('after can\'t be combined with sort, use offset')
+        if offset is not None and limit is None:
+            raise ValueError('offset requires limit')
+
+        self.fields = ([self.table_fields[f] for f in fields] if fields
+                       else self.schema.fields)
+
+    @classmethod
+    def from_query_params(cls, account, table, query_params, max_limit):
+        """
+        Query parameters:
+            filter [str]: '<field>:<op>:<value>', e.g. 'Revenue-ab12:gte:1000'.
+                          May be repeated.
+            sort [str]: '<field>', or '-<field>' for descending order.
+            fields [str]: Comma separated field api names.
+            source [str]: DataSource name (default: 'self').
+            after, limit, offset [int]: Pagination.
+        """
+        def get_int(name):
+            value = query_params.get(name)
+            return int(value) if value else None
+
+        filters = []
+        for f in query_params.getlist('filter'):
+            parts = f.split(':', 2)
+            if len(parts) != 3:
+                raise ValueError('Invalid filter: %s' % f)
+            filters.append(tuple(parts))
+        sort = query_params.get('sort') or None
+        descending = bool(sort) and sort.startswith('-')
+        fields = query_params.get('fields')
+        limit = get_int('limit')
+        if limit is not None:
+            if limit <= 0:
+                raise ValueError('limit must be positive')
+            limit = min(limit, max_limit)
+
+        return cls(account, table, source=query_params.get('source'),
+                   filters=filters, sort=sort.lstrip('-') if sort else None,
+                   descending=descending,
+                   fields=fields.split(',') if fields else None,
+                   after=get_int('after'), limit=limit,
+                   offset=get_int('offset'))
+
+    def get_sql(self):
+        """
+        Returns:
+            [tuple]: (SQL selecting the ids of the matching records in order,
+                      params).
+        """
+        used_fields = [f for f, _, _ in self.filters] + [self.sort]
+
+        # One join per field used in a filter or sort
+        joins, join_params, aliases = [], [], {}
+        for field_name in used_fields:
+            if field_name and field_name not in aliases:
+                alias = aliases[field_name] = 'd%d' % len(aliases)
+                joins.append('LEFT JOIN data_customdata %s '
+                             'ON %s.record_id=cr.id AND %s.field_id=%%s'
+                             % (alias, alias, alias))
+                field_source = self.schema.get_field_source(field_name,
+                                                            self.source)
+                join_params.append(field_source.id if field_source else None)
+
+        def typed_value(field_name):
+            return '%s.%s' % (aliases[field_name], CustomData.get_typed_column(
+                self.table_fields[field_name].type
+            ))
+
+        where = ['cr.account_id=%s', 'cr.table_id=%s']
+        where_params = [self.account.id, self.table.id]
+        for field_name, op, value in self.filters:
+            field_type = self.table_fields[field_name].type
+            if op == 'contains':
+                where.append("LOWER(%s.value) LIKE %%s ESCAPE '\\'"
+                             % aliases[field_name])
+                where_params.append('%%%s%%' % escape_like(value.lower()))
+            else:
+                where.append('%s %s %%s' % (typed_value(field_name),
+                                            self.OPERATORS[op]))
+                where_params.append(get_typed_param(field_type, value))
+        if self.after is not None:
+            where.append('cr.id>%s')
+            where_params.append(self.after)
+
+        order_by = ['cr.id']
+        if self.sort:
+            order_by = ['%s %s NULLS LAST' % (typed_value(self.sort),
+                                              'DESC' if self.descending
+                                              else 'ASC'),
+                        'cr.id']
+
+        limit, limit_params = '', []
+        if self.limit is not None:
+            limit = ' LIMIT %s OFFSET %s'
+            limit_params = [self.limit, self.offset or 0]
+
+        RAW_SQL = '''
+SELECT cr.id FROM data_customrecord cr
+    %s
+WHERE %s
+ORDER BY %s%s''' % ('\n    '.join(joins), ' AND '.join(where),
+                    ', '.join(order_by), limit)
+        return RAW_SQL, join_params + where_params + limit_params
+
+    def get_records(self):
+        """
+        Returns:
+            [QuerySet|list]: The matching records for
+                             CustomRecord.get_api_list_format: a QuerySet if
+                             there are no filters or sort, otherwise their
+                             ids in order.
+        """
+        if self.filters or self.sort:
+            return self.get_record_ids()
+        records = CustomRecord.objects.filter(account=self.account,
+                                              table=self.table).order_by('id')
+        if self.after is not None:
+            records = records.filter(id__gt=self.after)
+        if self.limit is not None:
+            offset = self.offset or 0
+            records = records[offset:offset + self.limit]
+        return records
+
+    def get_record_ids(self):
+        sql, params = self.get_sql()
+        return [record_id for record_id, in stream_query(sql, params)]
+
+    def stream(self, chunk_size=500):
+        """
+        Streams the matching records in the alternate CustomRecordView
+        format, reading the CustomData of @chunk_size records at a time.
+
+        Yields:
+            [dict]: {
+                'id': [int],
+                [field_api_name]: { [source_name]: [value] },
+                ...
+            }. Fields without data are omitted.
+        """
+        field_source_ids = [
+            field_source.id for field_source
+            in self.schema.get_field_sources(self.fields, self.sources)
+        ]
+        sql, params = self.get_sql()
+        chunk = []
+        for record_id, in stream_query(sql, params):
+            chunk.append(record_id)
+            if len(chunk) >= chunk_size:
+                for record in self.__get_records(chunk, field_source_ids):
+                    yield record
+                chunk = []
+        for record in self.__get_records(chunk, field_source_ids):
+            yield record
+
+    def __get_records(self, record_ids, field_source_ids):
+        if not record_ids:
+            return []
+        records = { record_id: { 'id': record_id } for record_id in record_ids }
+        if field_source_ids:
+            cursor = connection.cursor()
+            cursor.execute('''
+SELECT cd.record_id, cf.api_name, ds.name, cd.value
+    FROM data_customdata cd JOIN data_customfieldsource cfs ON cd.field_id=cfs.id
+        JOIN data_customfield cf ON cfs.field_id=cf.id
+        JOIN data_datasource ds ON cfs.source_id=ds.id
+    WHERE cd.record_id IN (%s) AND cd.field_id IN (%s)''' % (
+                ','.join(['%s'] * len(record_ids)),
+                ','.join(['%s'] * len(field_source_ids))
+            ), list(record_ids) + list(field_source_ids))
+            for record_id, field_name, source, value in cursor.fetchall():
+                records[record_id].setdefault(field_name, {})[source] = value
+        return [records[record_id] for record_id in record_ids]
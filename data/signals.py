@@ -0,0 +1,136 @@
+"""
+Signal handlers that keep derived data in sync with the models it is computed
+from: entity resolution data (see data.entity), typed CustomData values,
+the custom table schema cache (see data.models.get_table_schema) and
+portfolio summaries (see data.portfolio).
+"""
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from data.entity import (index_person, index_company_name, set_person_keys,
+                         set_company_keys)
+from data.models import Person, Company, Employment, CustomTable, CustomField,\
+    CustomData, invalidate_schema, BoardMember, Investment, InvestorInvestment,\
+    Metric, MetricValue
+from data.portfolio import refresh_summaries, refresh_summaries_on_commit
+from users.models import AccountPortfolio
+
+def reindex_person(person_id):
+    """
+    Reindexes the person once the current transaction commits. Deferred
+    because the person may be deleted by the same transaction (e.g. when
+    cascading to its Employment rows).
+    """
+    def reindex():
+        person = Person.objects.filter(id=person_id).first()
+        if person:
+            index_person(person)
+    transaction.on_commit(reindex)
+
+@receiver(pre_save, sender=Person)
+def person_saving(sender, instance, raw=False, **kwargs):
+    if not raw:
+        set_person_keys(instance)
+
+@receiver(post_save, sender=Person)
+def person_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        reindex_person(instance.id)
+
+@receiver(post_save, sender=Employment)
+@receiver(post_delete, sender=Employment)
+def employment_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        reindex_person(instance.person_id)
+
+@receiver(pre_save, sender=Company)
+def company_saving(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance._previous_name_key = (
+        Company.objects.filter(id=instance.id)
+                       .values_list('name_key', flat=True).first()
+        if instance.id else None
+    )
+    set_company_keys(instance)
+
+@receiver(post_save, sender=Company)
+def company_saved(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    index_company_name(instance)
+    if (created or getattr(instance, '_previous_name_key', None)
+            == instance.name_key):
+        return
+    # Company name keys are blocking keys for everyone employed there, so
+    # they're reindexed when it is renamed
+    person_ids = (Employment.objects.filter(company=instance)
+                                    .values_list('person_id', flat=True)
+                                    .distinct())
+    for person_id in person_ids:
+        reindex_person(person_id)
+
+@receiver(post_delete, sender=Company)
+def company_deleted(sender, instance, **kwargs):
+    index_company_name(instance, deleted=True)
+
+@receiver(pre_save, sender=CustomData)
+def custom_data_saving(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.set_typed_values()
+
+@receiver(pre_save, sender=CustomField)
+def custom_field_saving(sender, instance, raw=False, **kwargs):
+    instance._previous_type = (
+        CustomField.objects.filter(id=instance.id)
+                           .values_list('type', flat=True).first()
+        if instance.id and not raw else None
+    )
+
+@receiver(post_save, sender=CustomField)
+def custom_field_saved(sender, instance, raw=False, created=False, **kwargs):
+    invalidate_schema(instance.table_id)
+    previous_type = getattr(instance, '_previous_type', None)
+    if not raw and not created and previous_type != instance.type:
+        CustomData.update_typed_values(instance)
+
+@receiver(post_delete, sender=CustomField)
+def custom_field_deleted(sender, instance, **kwargs):
+    invalidate_schema(instance.table_id)
+
+@receiver(post_delete, sender=CustomTable)
+def custom_table_deleted(sender, instance, **kwargs):
+    invalidate_schema(instance.id)
+
+# Portfolio summaries are refreshed once the transaction of the change
+# commits, once per company (see data.portfolio.refresh_summaries_on_commit)
+
+@receiver(post_save, sender=Investment)
+@receiver(post_delete, sender=Investment)
+@receiver(post_save, sender=Metric)
+@receiver(post_delete, sender=Metric)
+@receiver(post_save, sender=BoardMember)
+@receiver(post_delete, sender=BoardMember)
+def portfolio_company_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_summaries_on_commit(company_id=instance.company_id)
+
+@receiver(post_save, sender=InvestorInvestment)
+@receiver(post_delete, sender=InvestorInvestment)
+def investor_investment_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_summaries_on_commit(investment_id=instance.investment_id)
+
+@receiver(post_save, sender=MetricValue)
+@receiver(post_delete, sender=MetricValue)
+def metric_value_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_summaries_on_commit(metric_id=instance.metric_id)
+
+@receiver(post_save, sender=AccountPortfolio)
+def account_portfolio_saved(sender, instance, raw=False, created=False,
+                            **kwargs):
+    if not raw and created:
+        refresh_summaries([instance])
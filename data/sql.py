@@ -1,8 +1,31 @@
-from django.db import connection
+import uuid
+from django.db import connection, transaction
 
-# Module-level
-# TODO: Consider impact on performance
-cursor = connection.cursor()
+def stream_query(sql, params=None, size=2000):
+    """
+    Yields the rows of a raw query without materializing the whole result set.
+    Uses a server-side (named) cursor on PostgreSQL, since psycopg2's default
+    client-side cursors buffer the entire result on execute.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            connection.ensure_connection()
+            cursor = connection.connection.cursor(
+                name='stream_%s' % uuid.uuid4().hex
+            )
+            cursor.itersize = size
+        else:
+            cursor = connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
 
 def get_custom_data(table_id, field_names=None):
     """
@@ -29,6 +52,7 @@ SELECT ct.api_name, cr.id, cf.id, cf.api_name, cf.type, ds.name, cd.value
         JOIN data_datasource ds ON cfs.source_id=ds.id
         JOIN users_account a ON ct.account_id=a.id
     WHERE ct.id=%s %s;''' % (table_id, FIELD_CLAUSE)
+    cursor = connection.cursor()
     cursor.execute(RAW_SQL)
 
     results = {}
@@ -1,3 +1,1946 @@
-from django.test import TestCase
+import BaseHTTPServer
+import csv
+import datetime
+import json
+import os
+import random
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import urlparse
+from decimal import Decimal
+from StringIO import StringIO
+from unittest import skipIf
 
-# Create your tests here.
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.utils.encoders import JSONEncoder
+
+from contacts.models import Interaction
+from data import entity, portfolio, signals
+from data.entity import (LevenshteinScorer, RecordMatcher, get_company_keys,
+                         get_company_name_key, get_matching_domain,
+                         get_name_key, levenshtein)
+from data.integrations import crunchbase, salesforce, snapshot, worker
+from data.models import (BoardMember, Company, CustomData, CustomField,
+                         CustomFieldSource, CustomRecord, CustomRecordSource,
+                         CustomTable, DataSource, DataSourceOption,
+                         Employment, Investment, InvestorInvestment,
+                         Investor, Metric, MetricValue, Person,
+                         PersonMatchCandidate, PersonMatchKey,
+                         PortfolioSummary, SyncCheckpoint, SyncJob,
+                         get_data_sources)
+from data.query import CustomRecordQuery
+from shared.constants import DEFAULT_ACCOUNT_ID
+from users.models import Account, AccountPortfolio, User
+
+############
+# Fixtures #
+############
+
+def create_account(name='Fund'):
+    """
+    Creates the DEFAULT_ACCOUNT_ID account and its company, which reference
+    each other.
+    """
+    with transaction.atomic():
+        company = Company.objects.create(account_id=DEFAULT_ACCOUNT_ID,
+                                         name=name)
+        return Account.objects.create(id=DEFAULT_ACCOUNT_ID, company=company)
+
+def create_user(account, email='owner@fund.com'):
+    return User.objects.create(account=account, email=email,
+                               person=Person.objects.create(
+                                   account=account, first_name='Owner',
+                                   last_name='Fund'
+                               ))
+
+def create_table(user, fields, source=None, model=None):
+    """
+    Creates a custom table with @fields, a list of (display name, type)
+    pairs. With @source and @model, each field is also mapped to the
+    source's field of the same name.
+
+    Returns:
+        [tuple]: (CustomTable, [dict]: { [display name]: [CustomField] })
+    """
+    DataSource.create_sources()
+    get_data_sources(reload=True)
+    table = CustomTable.create_from_api(user, { 'displayName': 'Deals' })
+    return table, {
+        display_name: CustomField.create_from_api(user, table, {
+            'displayName': display_name,
+            'type': field_type,
+            'sources': [{ 'source': source, 'model': model,
+                          'field': display_name }] if source else [],
+        })
+        for display_name, field_type in fields
+    }
+
+##################
+# Fake API stubs #
+##################
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Local HTTP server standing in for a third party API. The handler reads
+    and updates the per-test @state dict as self.server.state.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler, state):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.state = state
+        self.lock = threading.Lock()
+        self.requests = [] # (method, path, query params), in order
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+def start_server(handler, state):
+    server = FakeServer(handler, state)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body):
+        self.send_content(status, json.dumps(body), 'application/json')
+
+    def send_content(self, status, content, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def record_request(self):
+        url = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(url.query)
+        if self.command == 'POST':
+            length = int(self.headers.get('Content-Length', 0))
+            params.update(urlparse.parse_qs(self.rfile.read(length)))
+        with self.server.lock:
+            self.server.requests.append((self.command, url.path, params))
+        return url.path, params
+
+class FakeSalesforceHandler(FakeHandler):
+    """
+    OAuth token endpoint and a paged SOQL query endpoint. Page n (from 0) is
+    served at /services/data/v20.0/query/ for n=0 and at the nextRecordsUrl
+    .../query/01g-n after that.
+
+    State:
+        token [str]: Token accepted in the Authorization header. The token
+                     endpoint returns it.
+        pages [int], per_page [int]
+        fail [dict]: { [page]: [status] }: respond with @status once.
+                     { [page]: ([status], [str]) } responds with the text
+                     body instead of a JSON error.
+    """
+
+    QUERY_PATH = '/services/data/v20.0/query/'
+
+    def do_POST(self):
+        path, params = self.record_request()
+        if path != '/services/oauth2/token':
+            return self.send_json(404, {})
+        self.send_json(200, { 'access_token': self.server.state['token'] })
+
+    def do_GET(self):
+        path, params = self.record_request()
+        state = self.server.state
+        if (self.headers.get('Authorization')
+                != 'Bearer %s' % state['token']):
+            return self.send_json(401, [{ 'errorCode': 'INVALID_SESSION_ID' }])
+        page = int(path.rsplit('-', 1)[1]) if '-' in path else 0
+        with self.server.lock:
+            status = state['fail'].pop(page, None)
+        if isinstance(status, tuple):
+            return self.send_content(status[0], status[1], 'text/html')
+        if status:
+            return self.send_json(status,
+                                  [{ 'errorCode': 'SERVER_UNAVAILABLE' }])
+
+        done = page == state['pages'] - 1
+        body = {
+            'totalSize': state['pages'] * state['per_page'],
+            'done': done,
+            'records': [{
+                'attributes': { 'type': 'Account' },
+                'Id': '%d-%d' % (page, i),
+                'Name': 'Account %d-%d' % (page, i),
+                'Website': None,
+                'Description': None,
+            } for i in range(state['per_page'])],
+        }
+        if not done:
+            body['nextRecordsUrl'] = '%s01g-%d' % (self.QUERY_PATH, page + 1)
+        self.send_json(200, body)
+
+class FakeCrunchbaseHandler(FakeHandler):
+    """
+    Paged organizations endpoint (page n from 1, as ?page=n).
+
+    State:
+        token [str]: Accepted user_key.
+        pages [int], per_page [int]
+        fail [dict]: { [page]: [list: statuses] }: respond with the statuses
+                     in order before serving @page.
+    """
+
+    def do_GET(self):
+        path, params = self.record_request()
+        state = self.server.state
+        if params.get('user_key') != [state['token']]:
+            return self.send_json(401, { 'error': 'Invalid user_key' })
+        page = int(params.get('page', ['1'])[0])
+        with self.server.lock:
+            statuses = state['fail'].get(page)
+            status = statuses.pop(0) if statuses else None
+        if status == 429:
+            return self.send_json(429, { 'error': 'Rate limit exceeded' })
+        elif status:
+            # Not JSON, as from a proxy
+            content = 'Internal Server Error'
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+
+        self.send_json(200, {
+            'data': {
+                'paging': {
+                    'current_page': page,
+                    'number_of_pages': state['pages'],
+                    'next_page_url': ('%s%s?page=%d' % (self.server.url, path,
+                                                        page + 1)
+                                      if page < state['pages'] else None),
+                },
+                'items': [{
+                    'uuid': '%d-%d' % (page, i),
+                    'properties': { 'name': 'Company %d-%d' % (page, i),
+                                    'primary_role': 'company' },
+                } for i in range(state['per_page'])],
+            }
+        })
+
+##############
+# Salesforce #
+##############
+
+class SalesforceTestCase(SimpleTestCase):
+
+    ENVIRON = {
+        'SALESFORCE_API_CLIENT_ID': 'client',
+        'SALESFORCE_API_CLIENT_SECRET': 'secret',
+        'SALESFORCE_API_USERNAME': 'user',
+        'SALESFORCE_API_PASSWORD': 'password',
+    }
+
+    def setUp(self):
+        self.server = start_server(FakeSalesforceHandler, {
+            'token': 'token-1',
+            'pages': 3,
+            'per_page': 4,
+            'fail': {},
+        })
+        environ = dict(self.ENVIRON,
+                       SALESFORCE_API_LOGIN_URL=self.server.url,
+                       SALESFORCE_API_INSTANCE=self.server.url)
+        self.saved_environ = { k: os.environ.get(k) for k in environ }
+        os.environ.update(environ)
+
+    def tearDown(self):
+        # Drop the pooled keep-alive connections, so the server's handler
+        # threads exit
+        salesforce.get_session().close()
+        self.server.shutdown()
+        self.server.server_close()
+        for k, v in self.saved_environ.iteritems():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    def get_query_requests(self):
+        return [(path, params) for method, path, params in self.server.requests
+                if method == 'GET']
+
+    def test_follows_next_records_url(self):
+        accounts = list(salesforce.get_accounts_with_auth())
+        self.assertEqual([a['Id'] for a in accounts],
+                         ['%d-%d' % (page, i)
+                          for page in range(3) for i in range(4)])
+        requests = self.get_query_requests()
+        self.assertEqual([path for path, _ in requests], [
+            FakeSalesforceHandler.QUERY_PATH,
+            FakeSalesforceHandler.QUERY_PATH + '01g-1',
+            FakeSalesforceHandler.QUERY_PATH + '01g-2',
+        ])
+        # The query is only sent with the first page
+        self.assertEqual(requests[0][1], { 'q': [salesforce.ACCOUNT_SOQL] })
+        self.assertEqual(requests[1][1], {})
+
+    def test_poll_false_fetches_one_page(self):
+        accounts = list(salesforce.get_accounts('token-1', poll=False))
+        self.assertEqual(len(accounts), 4)
+        self.assertEqual(len(self.get_query_requests()), 1)
+
+    def test_refreshes_rejected_token(self):
+        calls = []
+        def get_token():
+            calls.append(1)
+            return salesforce.get_api_token()
+
+        accounts = list(salesforce.get_accounts('expired',
+                                                get_token=get_token))
+        self.assertEqual(len(accounts), 12)
+        self.assertEqual(len(calls), 1)
+        token_requests = [params for method, _, params
+                          in self.server.requests if method == 'POST']
+        self.assertEqual(len(token_requests), 1)
+        self.assertEqual(token_requests[0]['username'], ['user'])
+
+    def test_raises_if_refreshed_token_is_rejected(self):
+        with self.assertRaises(salesforce.APIError):
+            list(salesforce.get_accounts('expired',
+                                         get_token=lambda: 'expired'))
+
+    def test_retries_unavailable(self):
+        self.server.state['fail'] = { 1: 503 }
+        accounts = list(salesforce.get_accounts('token-1'))
+        self.assertEqual(len(accounts), 12)
+        paths = [path for path, _ in self.get_query_requests()]
+        self.assertEqual(paths.count(FakeSalesforceHandler.QUERY_PATH
+                                     + '01g-1'), 2)
+
+    def test_raises_error_body(self):
+        self.server.state['fail'] = { 1: (400, '<h1>Bad Request</h1>') }
+        with self.assertRaises(salesforce.APIError) as context:
+            list(salesforce.get_accounts('token-1'))
+        self.assertIn('<h1>Bad Request</h1>', str(context.exception))
+        self.server.state['fail'] = {
+            0: (400, '[{"errorCode": "MALFORMED_QUERY"}]'),
+        }
+        with self.assertRaises(salesforce.APIError) as context:
+            list(salesforce.get_accounts('token-1'))
+        self.assertIn('MALFORMED_QUERY', str(context.exception))
+
+    def test_early_exit_stops_prefetch(self):
+        def get_prefetch_threads():
+            return [thread for thread in threading.enumerate()
+                    if thread.name == 'prefetch']
+
+        self.server.state['pages'] = 50
+        for account in salesforce.get_accounts('token-1'):
+            break
+        deadline = time.time() + 5
+        while get_prefetch_threads() and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(get_prefetch_threads(), [])
+        # The page being processed and at most the prefetched ones after it
+        self.assertLessEqual(len(self.get_query_requests()), 3)
+
+    def test_prefetch_raises_in_caller(self):
+        def fail():
+            yield 1
+            raise ValueError('producer failed')
+
+        items = salesforce.prefetch(fail())
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(ValueError):
+            next(items)
+
+##############
+# Crunchbase #
+##############
+
+class CrunchbaseTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = start_server(FakeCrunchbaseHandler, {
+            'token': 'key',
+            'pages': 3,
+            'per_page': 2,
+            'fail': {},
+        })
+        environ = {
+            'CRUNCHBASE_API_TOKEN': 'key',
+            'CRUNCHBASE_API_URL': self.server.url + '/v/3/odm-organizations',
+        }
+        self.saved_environ = { k: os.environ.get(k) for k in environ }
+        os.environ.update(environ)
+        self.session = crunchbase.requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        for k, v in self.saved_environ.iteritems():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    def get_page(self, wait=0.05, rate=1000, **params):
+        return crunchbase.get_organizations_page(
+            self.session, crunchbase.TokenBucket(rate, capacity=1), wait,
+            **params
+        )
+
+    def test_backs_off_on_rate_limit_and_errors(self):
+        self.server.state['fail'] = { 2: [429, 500] }
+        start = time.time()
+        data = self.get_page(page=2, organization_types='investor')
+        # Waited 0.05, then 0.1 seconds
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        self.assertEqual(data['paging']['current_page'], 2)
+        self.assertEqual([item['uuid'] for item in data['items']],
+                         ['2-0', '2-1'])
+        # Every retry is sent with the same params
+        self.assertEqual([params for _, _, params in self.server.requests],
+                         [{ 'user_key': ['key'], 'page': ['2'],
+                            'organization_types': ['investor'] }] * 3)
+
+    def test_gives_up_after_max_wait(self):
+        self.server.state['fail'] = { 1: [500] }
+        self.assertIsNone(self.get_page(wait=crunchbase.API_MAX_WAIT * 2))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_rate_limit(self):
+        # One call right away, then one per 1 / rate seconds, across threads
+        rate = 20.0
+        bucket = crunchbase.TokenBucket(rate, capacity=1)
+        pool = crunchbase.ThreadPool(3)
+        try:
+            start = time.time()
+            pages = pool.map(
+                lambda page: crunchbase.get_organizations_page(
+                    self.session, bucket, 0.05, page=page
+                ),
+                [1, 2, 3] * 2
+            )
+            elapsed = time.time() - start
+        finally:
+            pool.terminate()
+            pool.join()
+        self.assertEqual([data['paging']['current_page'] for data in pages],
+                         [1, 2, 3] * 2)
+        self.assertGreaterEqual(elapsed, 5 / rate - 0.01)
+
+        # A rate limited page is retried within the same quota
+        self.server.requests[:] = []
+        self.server.state['fail'] = { 1: [429] }
+        start = time.time()
+        self.assertIsNotNone(crunchbase.get_organizations_page(
+            self.session, crunchbase.TokenBucket(rate, capacity=1), 0,
+            page=1
+        ))
+        self.assertGreaterEqual(time.time() - start, 1 / rate - 0.01)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_snapshot_is_closed_after_use(self):
+        tmp_dir = tempfile.mkdtemp()
+        paths = (crunchbase.ORGANIZATION_CSV_PATH,
+                 crunchbase.ORGANIZATION_SNAPSHOT_PATH)
+        get_organizations_snapshot = crunchbase.get_organizations_snapshot
+        snapshots = []
+        def record():
+            snapshots.append(get_organizations_snapshot())
+            return snapshots[-1]
+
+        crunchbase.ORGANIZATION_CSV_PATH = os.path.join(tmp_dir, 'orgs.csv')
+        crunchbase.ORGANIZATION_SNAPSHOT_PATH = os.path.join(tmp_dir,
+                                                             'orgs.snapshot')
+        crunchbase.get_organizations_snapshot = record
+        try:
+            open(crunchbase.ORGANIZATION_CSV_PATH, 'w').close()
+            snapshot.write_snapshot(
+                crunchbase.ORGANIZATION_SNAPSHOT_PATH, ['uuid', 'name'],
+                [{ 'uuid': str(i), 'name': 'Company %d' % i }
+                 for i in range(3)],
+                'uuid', source_path=crunchbase.ORGANIZATION_CSV_PATH
+            )
+            self.assertEqual(crunchbase.get_organization_csv('1')['name'],
+                             'Company 1')
+            organizations = crunchbase.get_organizations_csv()
+            self.assertEqual(next(organizations)['uuid'], '0')
+            organizations.close()
+            self.assertEqual(len(list(crunchbase.get_organizations_csv())), 3)
+        finally:
+            (crunchbase.ORGANIZATION_CSV_PATH,
+             crunchbase.ORGANIZATION_SNAPSHOT_PATH) = paths
+            crunchbase.get_organizations_snapshot = get_organizations_snapshot
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(len(snapshots), 3)
+        for columnar_snapshot in snapshots:
+            with self.assertRaises(ValueError):
+                columnar_snapshot.get('1')
+
+class CsvChunkTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'orgs.csv')
+        self.csv_path = crunchbase.ORGANIZATION_CSV_PATH
+        crunchbase.ORGANIZATION_CSV_PATH = self.path
+        random.seed(17)
+        descriptions = ['', 'Plain', 'With, comma', 'Line 1\nLine 2',
+                        'Ends with a newline\n', '"Quoted"', '""',
+                        'Quote and newline "\n" and\r\nCRLF', '\n\n\n']
+        with open(self.path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['crunchbase_uuid', 'type', 'primary_role',
+                             'name', 'crunchbase_url', 'homepage_domain',
+                             'homepage_url', 'profile_image_url',
+                             'facebook_url', 'twitter_url', 'linkedin_url',
+                             'stock_symbol', 'location_city',
+                             'location_region', 'location_country_code',
+                             'short_description'])
+            for i in range(300):
+                writer.writerow(['uuid-%d' % i, 'organization', 'company',
+                                 random.choice(descriptions), '', '', '', '',
+                                 '', '', '', '', random.choice(descriptions),
+                                 '', '', random.choice(descriptions)])
+            # Without a final newline
+            f.write('uuid-300,organization,company,"Last\nrow",'
+                    ',,,,,,,,,,,"The end"')
+
+    def tearDown(self):
+        crunchbase.ORGANIZATION_CSV_PATH = self.csv_path
+        shutil.rmtree(self.tmp_dir)
+
+    def read_rows(self, offset=0):
+        """
+        Returns:
+            [list]: The rows from @offset, from a single csv.reader pass.
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            rows = list(csv.reader(f))
+        return rows[1:] if offset == 0 else rows
+
+    def read_chunks(self, chunks):
+        rows = []
+        for start, end in chunks:
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                rows.extend(csv.reader(StringIO(f.read(end - start))))
+        return rows
+
+    def test_chunks_match_single_pass(self):
+        rows = self.read_rows()
+        self.assertEqual(len(rows), 301)
+        size = os.path.getsize(self.path)
+        for chunk_bytes in (1, 13, 100, 1000, size):
+            for block_bytes in (7, 64, 1024 * 1024):
+                chunks = list(crunchbase.get_csv_chunks(
+                    self.path, chunk_bytes=chunk_bytes,
+                    block_bytes=block_bytes
+                ))
+                # Contiguous, up to the end of the file
+                self.assertEqual(chunks[-1][1], size)
+                for (_, end), (start, _) in zip(chunks, chunks[1:]):
+                    self.assertEqual(end, start)
+                self.assertEqual(self.read_chunks(chunks), rows)
+
+    def test_chunks_from_offset(self):
+        chunks = list(crunchbase.get_csv_chunks(self.path, chunk_bytes=500))
+        offset = chunks[len(chunks) / 2][0]
+        self.assertEqual(
+            self.read_chunks(crunchbase.get_csv_chunks(self.path, offset,
+                                                       chunk_bytes=100,
+                                                       block_bytes=64)),
+            self.read_rows(offset)
+        )
+
+    def test_parallel_parse_matches_single_pass(self):
+        organizations = [organization for _, organization
+                         in crunchbase.get_organizations_csv_from(0)]
+        self.assertEqual(
+            organizations,
+            [crunchbase.get_organization_from_csv_row(row)
+             for row in self.read_rows()]
+        )
+        for workers in (1, 2):
+            batches = list(crunchbase.get_organizations_csv_parallel(
+                workers=workers, chunk_bytes=1000
+            ))
+            self.assertGreater(len(batches), 1)
+            self.assertEqual([organization for _, batch in batches
+                              for organization in batch], organizations)
+            # Resuming from a batch's end offset reads the following batches
+            self.assertEqual(
+                list(crunchbase.get_organizations_csv_parallel(
+                    batches[0][0], workers=workers, chunk_bytes=1000
+                )),
+                batches[1:]
+            )
+
+class OrganizationWriterTestCase(TestCase):
+
+    def setUp(self):
+        self.account = create_account()
+        self.company = Company.objects.create(
+            account=self.account, crunchbase_id='acme', name='Acme',
+            website='acme.com', description='Old'
+        )
+        self.employee = Person.objects.create(account=self.account,
+                                              first_name='Jane',
+                                              last_name='Doe')
+        Employment.objects.create(account=self.account,
+                                  person=self.employee, company=self.company)
+        self.reindexed = []
+        self.reindex_person = crunchbase.reindex_person
+        crunchbase.reindex_person = self.reindexed.append
+
+    def tearDown(self):
+        crunchbase.reindex_person = self.reindex_person
+
+    def organization(self, name, role='company', **properties):
+        data = { 'name': name, 'primary_role': role, 'permalink': None,
+                 'profile_image_url': None, 'city_name': None,
+                 'homepage_url': None, 'short_description': None }
+        data.update(properties)
+        return data
+
+    def test_inserts_and_updates(self):
+        ct = crunchbase.OrganizationWriter(chunk_size=2).write([
+            ('acme', self.organization('Acme', short_description='New')),
+            ('cafe', self.organization('Caf\xc3\xa9 Inc', role='investor')),
+            ('globex', self.organization('Globex')),
+        ])
+        self.assertEqual(ct, 3)
+        self.assertEqual(Company.objects.filter(crunchbase_id__isnull=False)
+                                        .count(), 3)
+        company = Company.objects.get(id=self.company.id)
+        self.assertEqual(company.description, 'New')
+        cafe = Company.objects.get(crunchbase_id='cafe')
+        self.assertEqual(cafe.name, u'Caf\xe9 Inc')
+        self.assertEqual(cafe.name_key, u'cafe')
+        self.assertEqual(Investor.objects.get(company=cafe).name,
+                         u'Caf\xe9 Inc')
+        # The name key didn't change
+        self.assertEqual(self.reindexed, [])
+
+    def test_null_properties_keep_existing_values(self):
+        crunchbase.OrganizationWriter().write([
+            ('acme', self.organization(None, homepage_url='',
+                                       city_name='Paris')),
+        ])
+        company = Company.objects.get(id=self.company.id)
+        self.assertEqual((company.name, company.name_key, company.website,
+                          company.description, company.location),
+                         ('Acme', 'acme', 'acme.com', 'Old', 'Paris'))
+        self.assertEqual(self.reindexed, [])
+
+    def test_rename_reindexes_employees(self):
+        crunchbase.OrganizationWriter().write([
+            ('acme', self.organization('Acme, Inc.')),
+        ])
+        self.assertEqual(self.reindexed, [])
+        crunchbase.OrganizationWriter().write([
+            ('acme', self.organization('Acme Labs')),
+        ])
+        self.assertEqual(Company.objects.get(id=self.company.id).name_key,
+                         'acme labs')
+        self.assertEqual(self.reindexed, [self.employee.id])
+
+#############
+# Name keys #
+#############
+
+class NameKeyTestCase(SimpleTestCase):
+
+    def test_name_key(self):
+        self.assertEqual(get_name_key(u" Jos\xe9  O'Brien "), u'jose o brien')
+        self.assertEqual(get_name_key(None), u'')
+        self.assertEqual(get_company_name_key('Acme, Inc.'), u'acme')
+
+    def test_byte_string_name(self):
+        # As read from the Crunchbase CSV or snapshot
+        self.assertEqual(get_name_key('Caf\xc3\xa9 Inc'), u'cafe inc')
+        self.assertEqual(get_company_name_key('Caf\xc3\xa9 Inc'), u'cafe')
+        self.assertEqual(get_company_keys('Caf\xc3\xa9 Inc'),
+                         get_company_keys(u'Caf\xe9 Inc'))
+        # Invalid UTF-8 doesn't raise
+        self.assertEqual(get_name_key('Caf\xe9'), u'caf')
+
+###########
+# Scoring #
+###########
+
+class LevenshteinScorerTestCase(SimpleTestCase):
+
+    def random_string(self, rng, max_length):
+        # Few distinct characters, so that strings share many of them
+        return ''.join(rng.choice('abc AB') for _ in
+                       range(rng.randint(0, max_length)))
+
+    def assert_same_distance(self, target, candidate, limit):
+        # levenshtein only stops early once a whole row exceeds @limit, so
+        # compare distances capped at @limit
+        self.assertEqual(
+            LevenshteinScorer(target, limit)(candidate),
+            min(levenshtein(target, candidate, limit), limit),
+            (target, candidate, limit)
+        )
+
+    def test_matches_levenshtein(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            target = self.random_string(rng, 12)
+            candidate = self.random_string(rng, 12)
+            self.assert_same_distance(target, candidate, 1000)
+            for limit in (0, 1, 2, 3):
+                self.assert_same_distance(target, candidate, limit)
+
+    def test_long_strings(self):
+        # Longer than a 64 bit word, e.g. multi-word company names
+        rng = random.Random(1)
+        for _ in range(50):
+            target = self.random_string(rng, 150)
+            candidate = (target[:rng.randint(0, len(target))]
+                         + self.random_string(rng, 20)
+                         + target[rng.randint(0, len(target)):])
+            for limit in (1000, 2, 10):
+                self.assert_same_distance(target, candidate, limit)
+        words = 'andreessen horowitz growth opportunities fund iii lp ' * 2
+        self.assertGreater(len(words), 64)
+        self.assert_same_distance(words, words.replace('iii', 'ii'), 1000)
+        self.assertEqual(LevenshteinScorer(words, 1000)(words[1:]), 1)
+
+    def test_empty_strings(self):
+        self.assertEqual(LevenshteinScorer('')('abc'), 0)
+        self.assertEqual(LevenshteinScorer(None)('abc'), 0)
+        self.assertEqual(LevenshteinScorer('abc')(''), 3)
+        self.assertEqual(LevenshteinScorer('abc')(None), 3)
+        self.assertEqual(LevenshteinScorer('abc', limit=1)(''), 1)
+        for candidate in ['', None, 'abc']:
+            self.assert_same_distance('abc', candidate, 100)
+            self.assert_same_distance('', candidate, 100)
+
+    def test_early_exit(self):
+        scorer = LevenshteinScorer('acme', limit=1)
+        self.assertEqual(scorer('acme'), 0)
+        self.assertEqual(scorer('acne'), 1)
+        self.assertEqual(scorer('globex'), 1)
+        # Length difference alone exceeds the limit
+        self.assertEqual(scorer('acme corporation'), 1)
+        self.assertEqual(scorer.batch(['Acme', 'acm', 'xyz']), [0, 1, 1])
+
+###############
+# Match index #
+###############
+
+class MatchIndexTestCase(TransactionTestCase):
+    """
+    TransactionTestCase, since people are reindexed on commit.
+    """
+
+    def setUp(self):
+        self.account = create_account()
+        self.company = Company.objects.create(account=self.account,
+                                              name='Acme, Inc.')
+        self.person = Person.objects.create(account=self.account,
+                                            first_name='Bob',
+                                            last_name='Smith',
+                                            email='bob@acme.com')
+        Employment.objects.create(account=self.account, person=self.person,
+                                  company=self.company)
+
+    def get_keys(self):
+        return set(PersonMatchKey.objects.filter(person=self.person)
+                                         .values_list('type', 'key'))
+
+    def get_candidates(self):
+        return list(PersonMatchCandidate.objects.filter(person=self.person)
+                                                .values_list('first_name',
+                                                             'last_name',
+                                                             'email',
+                                                             'company'))
+
+    def test_keys_are_built(self):
+        TYPES = PersonMatchKey.TYPES
+        keys = self.get_keys()
+        self.assertTrue(set([
+            (TYPES['First Name'], 'robert'),
+            (TYPES['Last Name'], 'smith'),
+            (TYPES['Email Domain'], 'acme.com'),
+            (TYPES['Company'], 'acme'),
+        ]).issubset(keys))
+        self.assertIn(TYPES['Last Name Phonetic'],
+                      [key_type for key_type, _ in keys])
+        self.assertEqual(self.get_candidates(),
+                         [('robert', 'smith', 'bob@acme.com', 'acme')])
+
+    def test_free_email_domain_isnt_a_key(self):
+        self.person.email = 'bob@gmail.com'
+        self.person.save()
+        self.assertNotIn((PersonMatchKey.TYPES['Email Domain'], 'gmail.com'),
+                         self.get_keys())
+
+    def test_person_rename_updates_keys(self):
+        self.person.first_name = 'Alice'
+        self.person.last_name = 'Jones'
+        self.person.save()
+        keys = self.get_keys()
+        self.assertIn((PersonMatchKey.TYPES['Last Name'], 'jones'), keys)
+        self.assertNotIn((PersonMatchKey.TYPES['Last Name'], 'smith'), keys)
+        self.assertEqual(self.get_candidates(),
+                         [('alice', 'jones', 'bob@acme.com', 'acme')])
+
+    def test_company_rename_updates_keys(self):
+        reindexed = []
+        index_person = signals.index_person
+        def record(person):
+            reindexed.append(person.id)
+            index_person(person)
+
+        signals.index_person = record
+        try:
+            # Same name key
+            self.company.name = 'Acme Inc'
+            self.company.description = 'Anvils'
+            self.company.save()
+            self.assertEqual(reindexed, [])
+            self.company.name = 'Acme Labs'
+            self.company.save()
+            self.assertEqual(reindexed, [self.person.id])
+        finally:
+            signals.index_person = index_person
+        keys = self.get_keys()
+        self.assertIn((PersonMatchKey.TYPES['Company'], 'acme labs'), keys)
+        self.assertNotIn((PersonMatchKey.TYPES['Company'], 'acme'), keys)
+        self.assertEqual(self.get_candidates()[0][3], 'acme labs')
+
+class CompanyNameIndexTestCase(TestCase):
+    """
+    The in-process fallback of get_company_name_filter for databases without
+    pg_trgm.
+    """
+
+    def setUp(self):
+        entity._company_name_indexes.clear()
+        self.has_pg_trgm = entity.has_pg_trgm
+        entity.has_pg_trgm = lambda: False
+        self.account = create_account()
+        self.company = Company.objects.create(account=self.account,
+                                              name='Acme Corporation')
+
+    def tearDown(self):
+        entity.has_pg_trgm = self.has_pg_trgm
+        entity._company_name_indexes.clear()
+
+    def get_shortlist(self, name):
+        name_filter = entity.get_company_name_filter(self.account, name)
+        return name_filter[1] if name_filter else []
+
+    def test_shortlists_name_keys(self):
+        self.assertEqual(self.get_shortlist('ACME'), [self.company.id])
+        self.assertEqual(self.get_shortlist('Inc.'), [])
+        # Written by this process
+        company = Company.objects.create(account=self.account,
+                                         name='Acme, Inc.')
+        self.assertEqual(sorted(self.get_shortlist('Acme')),
+                         [self.company.id, company.id])
+
+    def test_refresh_reads_updated_companies(self):
+        index = entity.get_company_name_index(self.account.id)
+        # Written by another process (no signals)
+        Company.objects.filter(id=self.company.id).update(
+            name='Globex', name_key='globex', updated_at=timezone.now()
+        )
+        self.assertEqual(self.get_shortlist('Globex'), [])
+        index.refreshed_at -= entity.COMPANY_NAME_INDEX_TTL + 1
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_shortlist('Globex'), [self.company.id])
+        self.assertIs(entity.get_company_name_index(self.account.id), index)
+        self.assertEqual(self.get_shortlist('Acme'), [])
+
+###################
+# Record matching #
+###################
+
+class RecordMatcherTestCase(SimpleTestCase):
+
+    def test_matching_domain(self):
+        self.assertEqual(get_matching_domain('https://www.Acme.com/about'),
+                         'acme.com')
+        for website in ['https://www.facebook.com/acme',
+                        'http://m.facebook.com/acme', 'acme.wordpress.com',
+                        'https://sites.google.com/view/acme', '']:
+            self.assertEqual(get_matching_domain(website), '')
+        # Only whole labels are shared
+        self.assertEqual(get_matching_domain('notfacebook.com'),
+                         'notfacebook.com')
+
+    def test_shared_domains_dont_match(self):
+        def record(name, website):
+            return { 'name': [{ 'value': name }],
+                     'website': [{ 'value': website }] }
+
+        matcher = RecordMatcher({
+            1: record('Acme', 'https://www.facebook.com/acme'),
+            2: record('Initech', 'https://initech.wordpress.com'),
+            3: record('Globex', 'https://globex.com'),
+        }, 'name', 'website')
+        self.assertEqual(matcher.match('Globex Holdings Group',
+                                       'http://www.globex.com/'), [3])
+        self.assertEqual(matcher.match('Hooli',
+                                       'https://facebook.com/hooli'), [])
+        self.assertEqual(matcher.match('Hooli',
+                                       'https://initech.wordpress.com'), [])
+        self.assertEqual(matcher.match('Acme', 'https://facebook.com/hooli'),
+                         [1])
+
+###########
+# Metrics #
+###########
+
+@skipIf(connection.vendor == 'sqlite', 'DISTINCT ON is PostgreSQL only')
+class LatestMetricValueTestCase(TestCase):
+
+    def setUp(self):
+        self.account = create_account()
+        self.other_account = Account.objects.create(
+            id=DEFAULT_ACCOUNT_ID + 1,
+            company=Company.objects.create(account=self.account,
+                                           name='Other Fund')
+        )
+        self.companies = [Company.objects.create(account=self.account,
+                                                 name='Company %d' % i)
+                          for i in range(3)]
+
+    def add_values(self, company, name, values, account=None, **kwargs):
+        """
+        Args:
+            values [list]: (date, value) pairs.
+        """
+        account = account or self.account
+        metric = Metric.objects.create(account=account, company=company,
+                                       name=name, **kwargs)
+        return [MetricValue.objects.create(account=account, metric=metric,
+                                           date=date, value=value)
+                for date, value in values]
+
+    def get_latest(self, company_ids, metric_names, **kwargs):
+        return {
+            key: value.value for key, value
+            in MetricValue.get_latest(company_ids, metric_names,
+                                      **kwargs).iteritems()
+        }
+
+    def test_latest_by_date(self):
+        company = self.companies[0]
+        # Not created in date order
+        self.add_values(company, 'Revenue', [
+            (datetime.date(2016, 4, 1), 2), (datetime.date(2016, 10, 1), 4),
+            (datetime.date(2016, 1, 1), 1), (datetime.date(2016, 7, 1), 3),
+        ])
+        self.assertEqual(self.get_latest([company.id], ['Revenue']),
+                         { (company.id, 'Revenue'): 4 })
+
+    def test_missing_metrics(self):
+        company = self.companies[0]
+        self.add_values(company, 'Revenue', [(datetime.date(2016, 1, 1), 1)])
+        self.add_values(company, 'Burn', [])
+        # Only estimated or monthly values
+        self.add_values(company, 'Cash', [(datetime.date(2016, 1, 1), 5)],
+                        estimated=True)
+        self.add_values(company, 'Headcount', [(datetime.date(2016, 1, 1), 9)],
+                        interval='Month')
+        names = ['Revenue', 'Burn', 'Cash', 'Headcount']
+        self.assertEqual(self.get_latest([company.id], names),
+                         { (company.id, 'Revenue'): 1 })
+        self.assertEqual(self.get_latest([company.id], names,
+                                         estimated=True),
+                         { (company.id, 'Cash'): 5 })
+        self.assertEqual(self.get_latest([company.id], names,
+                                         interval='Month'),
+                         { (company.id, 'Headcount'): 9 })
+        self.assertEqual(self.get_latest([self.companies[1].id], names), {})
+        self.assertEqual(self.get_latest([], names), {})
+        self.assertEqual(self.get_latest([company.id], []), {})
+
+    def test_multiple_companies(self):
+        for i, company in enumerate(self.companies[:2]):
+            for name in ('Revenue', 'Burn'):
+                self.add_values(company, name, [
+                    (datetime.date(2016, month, 1), 10 * i + month)
+                    for month in (1, 4, 7)
+                ])
+        # Not asked for
+        self.add_values(self.companies[2], 'Revenue',
+                        [(datetime.date(2017, 1, 1), 100)])
+        self.add_values(self.companies[0], 'Cash',
+                        [(datetime.date(2017, 1, 1), 100)])
+        company_ids = [company.id for company in self.companies[:2]]
+        with self.assertNumQueries(1):
+            latest = self.get_latest(company_ids, ['Revenue', 'Burn'])
+        self.assertEqual(latest, {
+            (company_ids[0], 'Revenue'): 7,
+            (company_ids[0], 'Burn'): 7,
+            (company_ids[1], 'Revenue'): 17,
+            (company_ids[1], 'Burn'): 17,
+        })
+        # The company is loaded with the value for get_api_format
+        value = MetricValue.get_latest(company_ids[:1], ['Revenue'])\
+                           .values()[0]
+        with self.assertNumQueries(0):
+            self.assertEqual(value.get_api_format()['company'], 'Company 0')
+
+    def test_metric_in_several_accounts(self):
+        company = self.companies[0]
+        self.add_values(company, 'Revenue', [(datetime.date(2016, 1, 1), 1),
+                                             (datetime.date(2016, 7, 1), 3)])
+        other = self.add_values(company, 'Revenue',
+                                [(datetime.date(2016, 4, 1), 2)],
+                                account=self.other_account)[0].metric
+        self.assertEqual(self.get_latest([company.id], ['Revenue']),
+                         { (company.id, 'Revenue'): 3 })
+        MetricValue.objects.create(account=self.other_account, metric=other,
+                                   date=datetime.date(2016, 10, 1), value=4)
+        self.assertEqual(self.get_latest([company.id], ['Revenue']),
+                         { (company.id, 'Revenue'): 4 })
+
+    def test_ties_on_date(self):
+        company = self.companies[0]
+        date = datetime.date(2016, 1, 1)
+        # In two accounts: the value created last wins
+        self.add_values(company, 'Revenue', [(date, 1)],
+                        account=self.other_account)
+        self.add_values(company, 'Revenue', [(date, 2)])
+        self.assertEqual(self.get_latest([company.id], ['Revenue']),
+                         { (company.id, 'Revenue'): 2 })
+        # In one metric, entered by two accounts
+        burn = self.add_values(company, 'Burn', [(date, 1)])[0].metric
+        MetricValue.objects.create(account=self.other_account, metric=burn,
+                                   date=date, value=2)
+        self.assertEqual(self.get_latest([company.id], ['Burn']),
+                         { (company.id, 'Burn'): 2 })
+
+#######################
+# Portfolio summaries #
+#######################
+
+class PortfolioSummaryTestCase(TransactionTestCase):
+    """
+    TransactionTestCase, since summaries are refreshed on commit.
+    PostgreSQL only (see MetricValue.get_latest).
+    """
+
+    def setUp(self):
+        self.account = create_account()
+        fund = self.account.company
+        self.investor = Investor.objects.create(account=self.account,
+                                                company=fund, name='Fund')
+        self.user = create_user(self.account)
+        self.companies = [self.add_company(i) for i in range(3)]
+
+    def add_company(self, i):
+        company = Company.objects.create(account=self.account,
+                                         name='Company %d' % i)
+        AccountPortfolio.objects.create(account=self.account, company=company)
+        self.add_round(company, 'Seed', datetime.date(2016, 1, 1), 100, 0.1)
+        self.add_metric(company, 'Revenue', range(4))
+        BoardMember.objects.create(
+            account=self.account, company=company,
+            person=Person.objects.create(account=self.account,
+                                         first_name='Board',
+                                         last_name=str(i))
+        )
+        return company
+
+    def add_round(self, company, series, date, raised, ownership=None):
+        investment = Investment.objects.create(
+            account=self.account, company=company, series=series, date=date,
+            raised=Decimal(raised), post_money=Decimal(raised * 4)
+        )
+        if ownership is not None:
+            InvestorInvestment.objects.create(
+                account=self.account, investment=investment,
+                investor=self.investor, date=date, ownership=ownership,
+                invested=Decimal(raised / 10)
+            )
+
+    def add_metric(self, company, name, values):
+        metric = Metric.objects.create(account=self.account, company=company,
+                                       name=name)
+        for quarter, value in enumerate(values):
+            MetricValue.objects.create(
+                account=self.account, metric=metric,
+                date=datetime.date(2016, 1 + 3 * quarter, 1), value=value
+            )
+
+    def add_details(self, company, i):
+        """
+        Adds a round the fund sat out (for odd @i), more metrics, and
+        interactions with the company's board member, who works there.
+        """
+        self.add_round(company, 'B', datetime.date(2018, 1, 1), 1000,
+                       None if i % 2 else 0.15)
+        self.add_metric(company, 'Burn', [i, i + 1, i + 2])
+        self.add_metric(company, 'Headcount', [10 * i])
+        person = company.board_members.get().person
+        Employment.objects.create(account=self.account, person=person,
+                                  company=company, title='CEO')
+        for day in (1, 2):
+            Interaction.objects.create(user=self.user, person=person,
+                                       date=datetime.date(2017, 1, day),
+                                       label='Meeting %d' % day)
+
+    def get_summary(self, company):
+        return PortfolioSummary.objects.get(portfolio__company=company)
+
+    def assert_consistent(self):
+        call_command('rebuild_portfolio_summaries', check=True)
+        self.account.refresh_from_db()
+        for company, api_format in zip(self.companies,
+                                       self.account.get_api_portfolio()):
+            self.assertEqual(api_format['name'], company.name)
+            expected = company.get_api_portco_format(self.investor)
+            for key in ('invested', 'ownership', 'totalRaised'):
+                self.assertEqual(api_format[key], expected[key])
+            self.assertEqual(api_format['lastRound']['series'],
+                             expected['lastRound']['series'])
+            self.assertEqual(
+                api_format['lastMetrics']['revenue'].get('value'),
+                expected['lastMetrics']['revenue'].get('value')
+            )
+            self.assertEqual([p['id'] for p in api_format['board']],
+                             [p['id'] for p in expected['board']])
+
+    def test_api_portfolio_matches_portco_format(self):
+        # Compared as rendered, since summaries store the last metrics as
+        # JSON
+        def render(api_format):
+            return json.loads(JSONEncoder().encode(api_format))
+
+        for i, company in enumerate(self.companies):
+            self.add_details(company, i)
+        api_portfolio = self.account.get_api_portfolio()
+        self.assertEqual(len(api_portfolio), len(self.companies))
+        self.maxDiff = None
+        for company, api_format in zip(self.companies, api_portfolio):
+            self.assertEqual(
+                render(api_format),
+                render(company.get_api_portco_format(self.investor))
+            )
+
+    def test_api_portfolio_query_count(self):
+        def count_queries():
+            self.account.refresh_from_db()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(self.account.get_api_portfolio()),
+                                 len(self.companies))
+            return len(queries)
+
+        for i, company in enumerate(self.companies):
+            self.add_details(company, i)
+        count = count_queries()
+        for i in range(3, 9):
+            self.companies.append(self.add_company(i))
+            self.add_details(self.companies[-1], i)
+        self.assertEqual(count_queries(), count)
+
+    def test_summaries_follow_changes(self):
+        self.assert_consistent()
+        company = self.companies[0]
+        with transaction.atomic():
+            investment = Investment.objects.create(
+                account=self.account, company=company, series='A',
+                date=datetime.date(2017, 1, 1), raised=Decimal(1000)
+            )
+            InvestorInvestment.objects.create(
+                account=self.account, investment=investment,
+                investor=self.investor, date=datetime.date(2017, 1, 1),
+                ownership=0.2, invested=Decimal(50)
+            )
+        summary = self.get_summary(company)
+        self.assertEqual(summary.total_raised, Decimal(1100))
+        self.assertEqual(summary.invested, Decimal(60))
+        self.assertEqual(summary.ownership, 0.2)
+        self.assertEqual(summary.last_series, 'A')
+
+        MetricValue.objects.create(
+            account=self.account, metric=company.metrics.get(),
+            date=datetime.date(2017, 1, 1), value=42
+        )
+        self.assertEqual(json.loads(self.get_summary(company).last_metrics)
+                         ['revenue']['value'], 42)
+
+        BoardMember.objects.filter(company=self.companies[1]).delete()
+        Metric.objects.filter(company=self.companies[1]).delete()
+        Investment.objects.filter(company=self.companies[2]).delete()
+        self.assert_consistent()
+
+    def test_rolled_back_change_keeps_summary(self):
+        before = self.get_summary(self.companies[0]).total_raised
+        try:
+            with transaction.atomic():
+                Investment.objects.create(account=self.account,
+                                          company=self.companies[0],
+                                          series='A', raised=Decimal(1))
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.get_summary(self.companies[0]).total_raised,
+                         before)
+        # The next transaction still refreshes
+        Investment.objects.create(account=self.account,
+                                  company=self.companies[0], series='B',
+                                  raised=Decimal(1))
+        self.assert_consistent()
+
+    def test_cascades_refresh_once(self):
+        refreshed = []
+        refresh_company_summaries = portfolio.refresh_company_summaries
+        def record(company_ids):
+            refreshed.append(list(company_ids))
+            refresh_company_summaries(company_ids)
+
+        portfolio.refresh_company_summaries = record
+        try:
+            Metric.objects.filter(company=self.companies[0]).delete()
+            self.assertEqual(refreshed, [[self.companies[0].id]])
+            self.companies.pop().delete()
+        finally:
+            portfolio.refresh_company_summaries = refresh_company_summaries
+        self.assertEqual(len(refreshed), 2)
+        self.assert_consistent()
+
+    def test_metric_values_refresh_once(self):
+        refreshed = []
+        refresh_company_summaries = portfolio.refresh_company_summaries
+        def record(company_ids):
+            refreshed.append(list(company_ids))
+            refresh_company_summaries(company_ids)
+
+        values = { '%d-%02d-01' % (2010 + i // 4, 1 + 3 * (i % 4)): i + 1
+                   for i in range(24) }
+        portfolio.refresh_company_summaries = record
+        try:
+            metric = Metric.create_from_api(self.account, self.companies[0],
+                                            dict(values, metric='Burn'))
+            self.assertEqual(refreshed, [[self.companies[0].id]])
+            metric.update_from_api(self.account, values)
+            self.assertEqual(len(refreshed), 2)
+        finally:
+            portfolio.refresh_company_summaries = refresh_company_summaries
+        self.assertEqual(metric.metric_values.count(), 24)
+        self.assert_consistent()
+
+    def test_check_fails_on_stale_or_missing_summary(self):
+        PortfolioSummary.objects.filter(
+            portfolio__company=self.companies[0]
+        ).update(invested=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_portfolio_summaries', check=True)
+        call_command('rebuild_portfolio_summaries')
+        PortfolioSummary.objects.filter(
+            portfolio__company=self.companies[1]
+        ).delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_portfolio_summaries', check=True)
+        # Missing summaries are built when the portfolio is read
+        self.account.get_api_portfolio()
+        self.assert_consistent()
+
+#####################
+# Typed custom data #
+#####################
+
+class TypedValuesTestCase(TestCase):
+
+    VALUES = ['1,000', 'n/a', '', '2016-02-01', 'Text']
+
+    def setUp(self):
+        account = create_account()
+        owner = create_user(account)
+        table = CustomTable.objects.create(account=account, owner=owner,
+                                           display_name='Deals',
+                                           api_name='deals')
+        self.field = CustomField.objects.create(
+            account=account, owner=owner, table=table, display_name='Size',
+            api_name='size', type='string'
+        )
+        source = DataSource.objects.get(name='self')
+        source_option = DataSourceOption.objects.get(
+            source=source, model='self', field='self'
+        )
+        field_source = CustomFieldSource.objects.create(
+            account=account, owner=owner, field=self.field, source=source,
+            source_option=source_option
+        )
+        for value in self.VALUES:
+            CustomData.objects.create(
+                account=account, owner=owner, field=field_source,
+                record=CustomRecord.objects.create(account=account,
+                                                   owner=owner, table=table),
+                value=value
+            )
+
+    def assert_typed_values(self, field_type):
+        for custom_data in CustomData.objects.order_by('id'):
+            self.assertEqual(
+                (custom_data.value_number, custom_data.value_date,
+                 custom_data.value_text),
+                tuple(CustomData.get_typed_values(field_type,
+                                                  custom_data.value)[column]
+                      for column in ('value_number', 'value_date',
+                                     'value_text'))
+            )
+
+    def test_type_change_updates_in_batches(self):
+        CustomData.objects.update(value_text=None)
+        self.field.type = 'number'
+        # Previous type, field UPDATE and CustomData rows, then one UPDATE
+        # per batch
+        batch_size, CustomData.UPDATE_BATCH_SIZE = (
+            CustomData.UPDATE_BATCH_SIZE, 2
+        )
+        try:
+            with self.assertNumQueries(6):
+                self.field.save()
+        finally:
+            CustomData.UPDATE_BATCH_SIZE = batch_size
+        self.assert_typed_values('number')
+        self.assertEqual(CustomData.objects.get(value='1,000').value_number,
+                         1000)
+
+        self.field.type = 'date'
+        self.field.save()
+        self.assert_typed_values('date')
+        self.assertEqual(CustomData.objects.get(value='2016-02-01').value_date,
+                         datetime.date(2016, 2, 1))
+
+#########################
+# Custom record queries #
+#########################
+
+class CustomRecordQueryTestCase(TestCase):
+
+    RECORDS = [
+        ('Acme', '100', '2010-01-01'),
+        ('Globex', '2,000', '2012-06-01'),
+        ('Initech', '', '2011-03-01'),
+        ('acme_labs 100%', '50', ''),
+    ]
+
+    def setUp(self):
+        self.account = create_account()
+        self.user = create_user(self.account)
+        self.table, fields = create_table(self.user, [('Name', 'string'),
+                                                      ('Revenue', 'money'),
+                                                      ('Founded', 'date')])
+        self.fields = { display_name: field.api_name
+                        for display_name, field in fields.iteritems() }
+        self.ids = []
+        for values in self.RECORDS:
+            record = CustomRecord.create_from_api(self.user, self.table, {
+                self.fields[display_name]: value for display_name, value
+                in zip(('Name', 'Revenue', 'Founded'), values) if value
+            })
+            self.ids.append(record.id)
+
+    def query(self, **kwargs):
+        if kwargs.get('filters'):
+            kwargs['filters'] = [(self.fields[f], op, value)
+                                 for f, op, value in kwargs['filters']]
+        if kwargs.get('sort'):
+            kwargs['sort'] = self.fields[kwargs['sort']]
+        return CustomRecordQuery(self.account, self.table, **kwargs)
+
+    def get_ids(self, *filters, **kwargs):
+        """
+        Returns:
+            [list]: Indexes in RECORDS of the matching records, in order.
+        """
+        record_ids = self.query(filters=list(filters), **kwargs) \
+                         .get_record_ids()
+        return [self.ids.index(record_id) for record_id in record_ids]
+
+    def test_number_operators(self):
+        self.assertEqual(self.get_ids(('Revenue', 'eq', '100')), [0])
+        self.assertEqual(self.get_ids(('Revenue', 'eq', '$2,000')), [1])
+        # Records without a value don't match any comparison
+        self.assertEqual(self.get_ids(('Revenue', 'ne', '100')), [1, 3])
+        self.assertEqual(self.get_ids(('Revenue', 'lt', '100')), [3])
+        self.assertEqual(self.get_ids(('Revenue', 'lte', '100')), [0, 3])
+        self.assertEqual(self.get_ids(('Revenue', 'gt', '100')), [1])
+        self.assertEqual(self.get_ids(('Revenue', 'gte', '100')), [0, 1])
+        # Compared as numbers, not strings
+        self.assertEqual(self.get_ids(('Revenue', 'gt', '99.5')), [0, 1])
+
+    def test_date_operators(self):
+        self.assertEqual(self.get_ids(('Founded', 'eq', '2011-03-01')), [2])
+        self.assertEqual(self.get_ids(('Founded', 'gte', '2011-01-01')),
+                         [1, 2])
+        self.assertEqual(self.get_ids(('Founded', 'lt', '2011-01-01')), [0])
+        self.assertEqual(self.get_ids(('Founded', 'gte', '2011-01-01'),
+                                      ('Revenue', 'gt', '0')), [1])
+
+    def test_string_operators(self):
+        # Case insensitive, as the typed text is lowercased
+        self.assertEqual(self.get_ids(('Name', 'eq', 'ACME')), [0])
+        self.assertEqual(self.get_ids(('Name', 'ne', 'acme')), [1, 2, 3])
+        self.assertEqual(self.get_ids(('Name', 'lt', 'b')), [0, 3])
+        self.assertEqual(self.get_ids(('Name', 'contains', 'ACME')), [0, 3])
+        # LIKE wildcards are matched literally
+        self.assertEqual(self.get_ids(('Name', 'contains', '_')), [3])
+        self.assertEqual(self.get_ids(('Name', 'contains', '0%')), [3])
+        self.assertEqual(self.get_ids(('Revenue', 'contains', ',')), [1])
+
+    def test_invalid_typed_values(self):
+        with self.assertRaises(ValueError):
+            self.get_ids(('Revenue', 'gt', 'a lot'))
+        with self.assertRaises(ValueError):
+            self.get_ids(('Founded', 'gt', 'last year'))
+
+    def test_sort(self):
+        self.assertEqual(self.get_ids(sort='Revenue'), [3, 0, 1, 2])
+        # Nulls last either way
+        self.assertEqual(self.get_ids(sort='Revenue', descending=True),
+                         [1, 0, 3, 2])
+        self.assertEqual(self.get_ids(sort='Founded'), [0, 2, 1, 3])
+        self.assertEqual(self.get_ids(sort='Name'), [0, 3, 1, 2])
+        self.assertEqual(self.get_ids(('Revenue', 'gte', '50'),
+                                      sort='Revenue', descending=True,
+                                      limit=2, offset=1), [0, 3])
+
+    def test_pagination(self):
+        self.assertEqual(self.get_ids(limit=2), [0, 1])
+        self.assertEqual(self.get_ids(limit=2, after=self.ids[1]), [2, 3])
+        self.assertEqual(self.get_ids(limit=3, offset=2), [2, 3])
+        self.assertEqual(self.get_ids(('Revenue', 'gt', '0'),
+                                      after=self.ids[0]), [1, 3])
+
+    def test_invalid_queries(self):
+        with self.assertRaises(ValueError):
+            CustomRecordQuery(self.account, self.table,
+                              filters=[('Name', 'eq', 'Acme')])
+        with self.assertRaises(ValueError):
+            CustomRecordQuery(self.account, self.table, sort='missing-0a1b')
+        with self.assertRaises(ValueError):
+            CustomRecordQuery(self.account, self.table, fields=['missing'])
+        with self.assertRaises(ValueError):
+            self.query(filters=[('Name', 'like', 'Acme')])
+        with self.assertRaises(ValueError):
+            self.query(sort='Name', after=1)
+        with self.assertRaises(ValueError):
+            self.query(offset=1)
+
+    def test_from_query_params(self):
+        query_params = QueryDict(mutable=True)
+        query_params.setlist('filter', [
+            '%s:gte:100' % self.fields['Revenue'],
+            '%s:contains:a:b' % self.fields['Name'],
+        ])
+        query_params.update({ 'sort': '-' + self.fields['Founded'],
+                              'fields': self.fields['Name'],
+                              'limit': '500' })
+        query = CustomRecordQuery.from_query_params(self.account, self.table,
+                                                    query_params, 100)
+        self.assertEqual(query.filters, [
+            (self.fields['Revenue'], 'gte', '100'),
+            (self.fields['Name'], 'contains', 'a:b'),
+        ])
+        self.assertEqual((query.sort, query.descending, query.limit),
+                         (self.fields['Founded'], True, 100))
+        self.assertEqual([field.api_name for field in query.fields],
+                         [self.fields['Name']])
+        for query_string in ('filter=%s:eq' % self.fields['Name'],
+                             'filter=Name:eq:Acme', 'limit=0',
+                             'sort=-Name', 'offset=1'):
+            with self.assertRaises(ValueError):
+                CustomRecordQuery.from_query_params(
+                    self.account, self.table, QueryDict(query_string), 100
+                )
+
+    def test_stream(self):
+        records = list(self.query(filters=[('Revenue', 'gt', '0')],
+                                  fields=[self.fields['Name']]).stream())
+        self.assertEqual(records, [
+            { 'id': self.ids[0], self.fields['Name']: { 'self': 'Acme' } },
+            { 'id': self.ids[1], self.fields['Name']: { 'self': 'Globex' } },
+            { 'id': self.ids[3],
+              self.fields['Name']: { 'self': 'acme_labs 100%' } },
+        ])
+
+class CustomRecordViewTestCase(TestCase):
+
+    def setUp(self):
+        self.account = create_account()
+        self.user = create_user(self.account)
+        self.token = Token.objects.create(user=self.user)
+        self.table, fields = create_table(self.user, [('Name', 'string'),
+                                                      ('Revenue', 'number')])
+        self.name = fields['Name'].api_name
+        self.revenue = fields['Revenue'].api_name
+        self.url = '/api/v1/tables/%d/records' % self.table.id
+        # Ties and missing values in the sorted field
+        self.revenues = { 'Acme %d' % i: str(i % 3) if i % 4 else ''
+                          for i in range(9) }
+        for name in sorted(self.revenues):
+            CustomRecord.create_from_api(self.user, self.table, {
+                self.name: name, self.revenue: self.revenues[name],
+            })
+
+    def get(self, **params):
+        response = self.client.get(
+            self.url, params, HTTP_AUTHORIZATION='Token %s' % self.token.key
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return json.loads(response.content)
+
+    def walk(self, cursor, **params):
+        """
+        Returns:
+            [list]: Names of the records of every page, following @cursor
+                    until the last page.
+        """
+        names = []
+        for _ in range(20):
+            results = self.get(**params)
+            page = results['_sources']['self']['data']
+            self.assertLessEqual(len(page), params['limit'])
+            names.extend(record[self.name] for record in page)
+            if results[cursor] is None:
+                return names
+            self.assertEqual(len(page), params['limit'])
+            params[{ '_next': 'after',
+                     '_next_offset': 'offset' }[cursor]] = results[cursor]
+        self.fail('No last page')
+
+    def test_walk_pages(self):
+        names = sorted(self.revenues)
+        for limit in (1, 2, 3, 4, 9, 10):
+            self.assertEqual(self.walk('_next', limit=limit), names)
+
+    def test_walk_filtered_pages(self):
+        names = [name for name in sorted(self.revenues)
+                 if self.revenues[name] and int(self.revenues[name]) >= 1]
+        for limit in (1, 2, 4, 5):
+            self.assertEqual(self.walk('_next', limit=limit,
+                                       filter='%s:gte:1' % self.revenue),
+                             names)
+
+    def test_walk_sorted_pages(self):
+        # Nulls last either way, then by id, i.e. by name
+        names = sorted(self.revenues)
+        for sort, sign in ((self.revenue, 1), ('-' + self.revenue, -1)):
+            expected = sorted(names, key=lambda name: (
+                self.revenues[name] == '',
+                sign * int(self.revenues[name] or 0), name
+            ))
+            for limit in (1, 2, 3, 9):
+                self.assertEqual(self.walk('_next_offset', limit=limit,
+                                           sort=sort), expected)
+
+    def test_last_page_has_no_cursor(self):
+        results = self.get(limit=9)
+        self.assertEqual(len(results['_sources']['self']['data']), 9)
+        self.assertIsNone(results['_next'])
+        results = self.get(limit=3, offset=6, sort=self.revenue)
+        self.assertEqual(len(results['_sources']['self']['data']), 3)
+        self.assertIsNone(results['_next_offset'])
+        results = self.get()
+        self.assertNotIn('_next', results)
+        self.assertNotIn('_next_offset', results)
+
+#######################
+# Bulk record upserts #
+#######################
+
+class BulkUpsertTestCase(TestCase):
+
+    def setUp(self):
+        self.account = create_account()
+        self.user = create_user(self.account)
+        self.table, fields = create_table(self.user, [
+            ('Name', 'string'), ('Website', 'string'),
+        ], source='salesforce', model='account')
+        self.name = fields['Name'].api_name
+        self.website = fields['Website'].api_name
+
+    def row(self, source_key, name, website):
+        return source_key, { self.name: name, self.website: website }
+
+    def upsert(self, rows, **kwargs):
+        return CustomRecord.bulk_update_or_create_from_source(
+            self.user, self.table, rows, 'salesforce', **kwargs
+        )
+
+    def get_values(self):
+        """
+        Returns:
+            [dict]: { [source_key]: { [field_api_name]: [value] } } from the
+                    salesforce field sources of the table.
+        """
+        record_keys = dict(CustomRecordSource.objects.filter(
+            table=self.table
+        ).values_list('record_id', 'source_key'))
+        self.assertEqual(
+            CustomRecord.objects.filter(table=self.table).count(),
+            len(record_keys)
+        )
+        values = { source_key: {} for source_key in record_keys.values() }
+        for record_id, field_name, value in CustomData.objects.filter(
+            record__table=self.table, field__source__name='salesforce'
+        ).values_list('record_id', 'field__field__api_name', 'value'):
+            values[record_keys[record_id]][field_name] = value
+        return values
+
+    def get_updated_at(self):
+        return dict(CustomData.objects.filter(record__table=self.table)
+                                      .values_list('id', 'updated_at'))
+
+    def test_insert(self):
+        self.assertEqual(self.upsert([self.row('001', 'Acme', 'Acme.com'),
+                                      self.row('002', 'Globex', '')]), 2)
+        self.assertEqual(self.get_values(), {
+            '001': { self.name: 'Acme', self.website: 'Acme.com' },
+            '002': { self.name: 'Globex', self.website: '' },
+        })
+        data = CustomData.objects.get(
+            record__custom_record_sources__source_key='001',
+            field__field__api_name=self.website
+        )
+        self.assertEqual(data.value_text, 'acme.com')
+        _, request_json = self.row('001', 'Acme', 'Acme.com')
+        self.assertEqual(
+            CustomRecordSource.objects.get(source_key='001').content_hash,
+            CustomRecordSource.get_content_hash(request_json)
+        )
+
+    def test_update(self):
+        self.upsert([self.row('001', 'Acme', 'Acme.com'),
+                     self.row('002', 'Globex', 'globex.com')])
+        records = CustomRecord.objects.filter(table=self.table)
+        record_ids = set(records.values_list('id', flat=True))
+        # Without skip_unchanged, unchanged rows are written again
+        self.assertEqual(self.upsert([
+            self.row('001', 'Acme Corp', 'ACME.io'),
+            self.row('002', 'Globex', 'globex.com'),
+        ]), 2)
+        self.assertEqual(set(records.values_list('id', flat=True)), record_ids)
+        self.assertEqual(self.get_values(), {
+            '001': { self.name: 'Acme Corp', self.website: 'ACME.io' },
+            '002': { self.name: 'Globex', self.website: 'globex.com' },
+        })
+        self.assertEqual(
+            CustomData.objects.get(
+                record__custom_record_sources__source_key='001',
+                field__field__api_name=self.website
+            ).value_text,
+            'acme.io'
+        )
+        # Fields missing from a row keep their values
+        self.upsert([('002', { self.website: 'globex.io' })])
+        self.assertEqual(self.get_values()['002'],
+                         { self.name: 'Globex', self.website: 'globex.io' })
+
+    def test_skip_unchanged(self):
+        rows = [self.row('001', 'Acme', 'Acme.com'),
+                self.row('002', 'Globex', 'globex.com')]
+        self.upsert(rows, skip_unchanged=True)
+        updated_at = self.get_updated_at()
+        self.assertEqual(self.upsert(rows, skip_unchanged=True), 0)
+        self.assertEqual(self.get_updated_at(), updated_at)
+        # A changed row is still written
+        self.assertEqual(self.upsert([self.row('001', 'Acme', 'acme.io')],
+                                     skip_unchanged=True), 1)
+        self.assertNotEqual(self.get_updated_at(), updated_at)
+
+    def test_mixed_batches(self):
+        self.upsert([self.row('001', 'Acme', 'Acme.com'),
+                     self.row('002', 'Globex', 'globex.com')])
+        updated_at = self.get_updated_at()
+        # Each chunk of 2 mixes a new row with an unchanged or updated one
+        self.assertEqual(self.upsert([
+            self.row('004', 'Hooli', 'hooli.com'),
+            self.row('004', 'Hooli', 'hooli.xyz'), # Repeated, the last wins
+            self.row('001', 'Acme', 'Acme.com'),
+            self.row('003', 'Initech', 'initech.com'),
+            self.row('002', 'Globex', 'globex.io'),
+        ], chunk_size=2, skip_unchanged=True), 3)
+        self.assertEqual(self.get_values(), {
+            '001': { self.name: 'Acme', self.website: 'Acme.com' },
+            '002': { self.name: 'Globex', self.website: 'globex.io' },
+            '003': { self.name: 'Initech', self.website: 'initech.com' },
+            '004': { self.name: 'Hooli', self.website: 'hooli.xyz' },
+        })
+        unchanged = set(CustomData.objects.filter(
+            record__custom_record_sources__source_key='001'
+        ).values_list('id', flat=True))
+        self.assertEqual(len(unchanged), 2)
+        self.assertEqual({ i: t for i, t in self.get_updated_at().iteritems()
+                           if i in unchanged },
+                         { i: updated_at[i] for i in unchanged })
+
+#############
+# Sync jobs #
+#############
+
+class SyncJobTestCase(TestCase):
+
+    def setUp(self):
+        self.account = create_account()
+        self.user = create_user(self.account)
+        self.tables = [CustomTable.create_from_api(self.user,
+                                                   { 'displayName': name })
+                       for name in ('Deals', 'Leads', 'Funds')]
+
+    def enqueue(self, table, minutes_ago=0):
+        job, _ = SyncJob.enqueue(self.user, table)
+        SyncJob.objects.filter(id=job.id).update(
+            created_at=timezone.now() - datetime.timedelta(minutes=minutes_ago)
+        )
+        return job
+
+    def set_heartbeat(self, job, seconds_ago):
+        SyncJob.objects.filter(id=job.id).update(
+            heartbeat_at=timezone.now() - datetime.timedelta(
+                seconds=seconds_ago
+            )
+        )
+
+    def test_enqueue_once_per_table(self):
+        job, created = SyncJob.enqueue(self.user, self.tables[0])
+        self.assertTrue(created)
+        self.assertEqual(SyncJob.enqueue(self.user, self.tables[0]),
+                         (job, False))
+        self.assertEqual(SyncJob.claim_next(), job)
+        # Still active while running
+        self.assertEqual(SyncJob.enqueue(self.user, self.tables[0]),
+                         (job, False))
+        job.finish()
+        new_job, created = SyncJob.enqueue(self.user, self.tables[0])
+        self.assertTrue(created)
+        self.assertNotEqual(new_job, job)
+
+    def test_claim_oldest_first(self):
+        jobs = [self.enqueue(table, minutes_ago)
+                for table, minutes_ago in zip(self.tables, (5, 10, 1))]
+        claimed = [SyncJob.claim_next() for _ in range(4)]
+        self.assertEqual(claimed, [jobs[1], jobs[0], jobs[2], None])
+        for job in claimed[:3]:
+            self.assertEqual((job.status, job.attempts),
+                             (SyncJob.STATUSES['Running'], 1))
+            self.assertIsNotNone(job.started_at)
+            self.assertEqual(job.heartbeat_at, job.started_at)
+
+    def test_job_is_claimed_once(self):
+        job = self.enqueue(self.tables[0])
+        self.assertEqual(SyncJob.claim_next(), job)
+        self.assertIsNone(SyncJob.claim_next())
+        self.assertEqual(SyncJob.objects.get(id=job.id).attempts, 1)
+
+    def test_stale_job_is_requeued(self):
+        job = self.enqueue(self.tables[0])
+        SyncJob.claim_next()
+        # Within the timeout, the job is left to its worker
+        self.set_heartbeat(job, SyncJob.HEARTBEAT_TIMEOUT - 60)
+        self.assertIsNone(SyncJob.claim_next())
+        job.set_progress(100)
+        self.assertIsNone(SyncJob.claim_next())
+        # Past it, the worker is assumed dead and the job retried
+        self.set_heartbeat(job, SyncJob.HEARTBEAT_TIMEOUT + 60)
+        job = SyncJob.claim_next()
+        self.assertEqual((job.status, job.attempts),
+                         (SyncJob.STATUSES['Running'], 2))
+
+    def test_stale_job_fails_after_max_attempts(self):
+        job = self.enqueue(self.tables[0])
+        for attempt in range(1, SyncJob.MAX_ATTEMPTS + 1):
+            self.assertEqual(SyncJob.claim_next().attempts, attempt)
+            self.set_heartbeat(job, SyncJob.HEARTBEAT_TIMEOUT + 60)
+        self.assertIsNone(SyncJob.claim_next())
+        job = SyncJob.objects.get(id=job.id)
+        self.assertEqual((job.status, job.error),
+                         (SyncJob.STATUSES['Failed'], 'Worker timed out'))
+        self.assertIsNotNone(job.finished_at)
+        # The table can be synced again
+        self.assertTrue(SyncJob.enqueue(self.user, self.tables[0])[1])
+
+@skipIf(connection.vendor == 'sqlite',
+        'The in-memory test database isn\'t shared between threads')
+class SyncJobClaimTestCase(TransactionTestCase):
+    """
+    TransactionTestCase, since workers claim jobs from their own
+    connections.
+    """
+
+    def test_concurrent_claims(self):
+        account = create_account()
+        user = create_user(account)
+        jobs = [SyncJob.enqueue(user, CustomTable.create_from_api(
+                    user, { 'displayName': 'Table %d' % i }
+                ))[0] for i in range(3)]
+        claimed = []
+        start = threading.Event()
+
+        def work():
+            try:
+                start.wait(5)
+                claimed.append(SyncJob.claim_next())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(len(claimed), 6)
+        # Each job is claimed by exactly one worker
+        self.assertEqual(sorted(job.id for job in claimed if job),
+                         sorted(job.id for job in jobs))
+        self.assertEqual(
+            set(SyncJob.objects.values_list('status', 'attempts')),
+            set([(SyncJob.STATUSES['Running'], 1)])
+        )
+
+###############
+# Table syncs #
+###############
+
+class SyncCheckpointTestCase(TestCase):
+
+    ROWS = 2500 # Checkpointed every 1000
+
+    def setUp(self):
+        self.account = create_account()
+        self.user = create_user(self.account)
+        self.table, _ = create_table(self.user, [('name', 'string'),
+                                                 ('homepage_url', 'string')],
+                                     source='crunchbase',
+                                     model='organization')
+        CustomField.create_from_api(self.user, self.table, {
+            'displayName': 'Salesforce Name',
+            'type': 'string',
+            'sources': [{ 'source': 'salesforce', 'model': 'account',
+                          'field': 'Name' }],
+        })
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patched = (worker.ORGANIZATION_CSV_PATH,
+                        crunchbase.ORGANIZATION_CSV_PATH,
+                        worker.get_organizations_snapshot,
+                        worker.get_accounts_with_auth,
+                        CustomRecord.__dict__[
+                            'bulk_update_or_create_from_source'
+                        ])
+        worker.ORGANIZATION_CSV_PATH = crunchbase.ORGANIZATION_CSV_PATH = \
+            self.path = os.path.join(self.tmp_dir, 'orgs.csv')
+        worker.get_organizations_snapshot = lambda: None
+        worker.get_accounts_with_auth = lambda poll: []
+
+        # Records the source keys of each batch written, and fails once
+        # self.stop_after batches have been
+        self.written = []
+        self.stop_after = None
+        bulk_upsert = CustomRecord.bulk_update_or_create_from_source
+        def upsert(user, table, rows, source, **kwargs):
+            if len(self.written) == self.stop_after:
+                raise RuntimeError('Interrupted')
+            self.written.append([source_key for source_key, _ in rows])
+            return bulk_upsert(user, table, rows, source, **kwargs)
+        CustomRecord.bulk_update_or_create_from_source = staticmethod(upsert)
+
+        self.write_csv(self.ROWS)
+
+    def tearDown(self):
+        (worker.ORGANIZATION_CSV_PATH, crunchbase.ORGANIZATION_CSV_PATH,
+         worker.get_organizations_snapshot, worker.get_accounts_with_auth,
+         CustomRecord.bulk_update_or_create_from_source) = self.patched
+        shutil.rmtree(self.tmp_dir)
+
+    def write_csv(self, rows):
+        with open(self.path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['crunchbase_uuid', 'type', 'primary_role',
+                             'name', 'crunchbase_url', 'homepage_domain',
+                             'homepage_url', 'profile_image_url',
+                             'facebook_url', 'twitter_url', 'linkedin_url',
+                             'stock_symbol', 'location_city',
+                             'location_region', 'location_country_code',
+                             'short_description'])
+            for i in range(rows):
+                writer.writerow(['uuid-%d' % i, 'organization', 'company',
+                                 'Company %d' % i, '', '',
+                                 'http://company%d.com' % i, '', '', '', '',
+                                 '', '', '', '', 'Line 1\nLine 2'])
+
+    def sync(self):
+        worker.sync_table(self.table, self.user)
+        return SyncCheckpoint.objects.get(table=self.table,
+                                          path=self.path)
+
+    def get_written(self):
+        written, self.written = self.written, []
+        return [source_key for batch in written for source_key in batch]
+
+    def test_resume(self):
+        keys = ['uuid-%d' % i for i in range(self.ROWS)]
+        self.stop_after = 1
+        with self.assertRaises(RuntimeError):
+            self.sync()
+        self.assertEqual(self.get_written(), keys[:1000])
+        checkpoint = SyncCheckpoint.objects.get(table=self.table)
+        self.assertEqual((checkpoint.rows_read, checkpoint.rows_written),
+                         (1000, 1000))
+        self.assertFalse(checkpoint.completed)
+        self.assertEqual(
+            CustomRecord.objects.filter(table=self.table).count(), 1000
+        )
+
+        # Picks up after the last committed batch
+        self.stop_after = None
+        checkpoint = self.sync()
+        self.assertEqual(self.get_written(), keys[1000:])
+        self.assertEqual((checkpoint.rows_read, checkpoint.rows_written),
+                         (self.ROWS, self.ROWS))
+        self.assertEqual(checkpoint.offset, os.path.getsize(self.path))
+        self.assertTrue(checkpoint.completed)
+        self.assertEqual(
+            CustomRecord.objects.filter(table=self.table).count(), self.ROWS
+        )
+
+        # Skipped while the file is unchanged
+        self.sync()
+        self.assertEqual(self.get_written(), [])
+
+    def test_changed_file_is_reread(self):
+        self.sync()
+        self.get_written()
+        self.write_csv(self.ROWS + 1)
+        checkpoint = self.sync()
+        # Every row is read again, but only the new one is written
+        self.assertEqual(len(self.get_written()), self.ROWS + 1)
+        self.assertEqual((checkpoint.rows_read, checkpoint.rows_written),
+                         (self.ROWS + 1, 1))
+        self.assertEqual(
+            CustomRecord.objects.filter(table=self.table).count(),
+            self.ROWS + 1
+        )
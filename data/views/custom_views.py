@@ -1,5 +1,6 @@
 import json
 
+from django.db.models import QuerySet
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.response import Response
 from rest_framework import status
@@ -8,9 +9,10 @@ from rest_framework.views import APIView
 from users.models import Account
 from data.api import validate_request
 from data.models import CustomTable, CustomField, CustomRecord, CustomData,\
-    DataSource, CompanyCustomField, CompanyCustomData
-from data.integrations.worker import sync_table
+    DataSource, CompanyCustomField, CompanyCustomData, SyncJob
+from data.query import CustomRecordQuery
 from shared.auth import check_authentication
+from shared.utils import stream_json_lines
 
 
 class CustomTableView(APIView):
@@ -228,10 +230,33 @@ class CustomRecordView(APIView):
 
     authentication_classes = (TokenAuthentication,)
 
+    _MAX_LIMIT = 5000
+
     # GET /tables/:table_id/records
     def __get_list(self, request, table_id, format=None):
         """
+        Optional query parameters (see data.query.CustomRecordQuery):
+            filter [str]: '<field>:<op>:<value>', where op is one of eq, ne,
+                          lt, lte, gt, gte or contains. Values are compared
+                          according to the field type. May be repeated.
+            sort [str]: '<field>' or '-<field>'.
+            fields [str]: Comma separated field api names to return.
+            source [str]: Source to filter, sort and return (default: filter
+                          and sort on 'self', return all sources).
+            limit [int]: Maximum number of records (at most _MAX_LIMIT).
+            after [int]: Unsorted queries only. Only return records with an
+                         id greater than this, i.e. the '_next' cursor of
+                         the previous page.
+            offset [int]: Number of records to skip (requires limit).
+            stream [bool]: 'true' to stream records as newline-delimited JSON
+                           in the alternate format below, one record per
+                           line, as they are read from the database.
+
         Format: {
+            '_next': [int], # Only with ?limit and no ?sort: cursor for
+                            # the next page, or None on the last page
+            '_next_offset': [int], # Only with ?limit and ?sort: offset of
+                                   # the next page, or None on the last page
             '_sources': {
                 'self': {
                     'key': 'self',
@@ -252,7 +277,7 @@ class CustomRecordView(APIView):
                 ...
             }
         }
-        Alternate format: [
+        Alternate format (?stream=true): [
             {
                 'id': 1,
                 'field1': {
@@ -273,9 +298,27 @@ class CustomRecordView(APIView):
             user = check_authentication(request)
             account = user.account
             custom_table = CustomTable.objects.get(account=account, id=table_id)
-            custom_records = CustomRecord.objects.filter(account=account,
-                                                         table=custom_table)
-            fields = custom_table.custom_fields.all()
+            query = CustomRecordQuery.from_query_params(
+                account, custom_table, request.query_params, self._MAX_LIMIT
+            )
+
+            if request.query_params.get('stream') == 'true':
+                return stream_json_lines(query.stream())
+
+            limit = query.limit
+            if limit is not None:
+                # Read one more record to tell whether this is the last page
+                query.limit += 1
+            records = query.get_records()
+            if limit is not None:
+                if isinstance(records, QuerySet):
+                    records = list(records.values_list('id', flat=True))
+                is_last = len(records) <= limit
+                records = records[:limit]
+
+            sources = query.sources
+            data = CustomRecord.get_api_list_format(records, query.fields,
+                                                    sources)
 
             # Pulling results out of the return Response line makes it easier
             # to profile for performance.
@@ -285,17 +328,24 @@ class CustomRecordView(APIView):
                         'key': source.name,
                         'display': source.display,
                         'icon': source.icon,
-                        'data': [
-                            custom_record.get_api_format(source=source,
-                                                         fields=fields)
-                            for custom_record in custom_records
-                        ]
-                    } for source in DataSource.objects.all()
+                        'data': data[source.name]
+                    } for source in sources
                 }
             }
+            if limit is not None:
+                if query.sort:
+                    results['_next_offset'] = (
+                        None if is_last else (query.offset or 0) + limit
+                    )
+                else:
+                    results['_next'] = None if is_last else records[-1]
             return Response(results, status=status.HTTP_200_OK)
 
-        except (Account.DoesNotExist, CustomTable.DoesNotExist) as e:
+        except ValueError as e:
+            return Response({ 'error': str(e) },
+                            status=status.HTTP_400_BAD_REQUEST)
+        except (Account.DoesNotExist, CustomTable.DoesNotExist,
+                DataSource.DoesNotExist) as e:
             return Response({ 'error': str(e) },
                             status=status.HTTP_400_BAD_REQUEST)
 
@@ -410,18 +460,45 @@ class CustomTableSyncView(APIView):
 
     authentication_classes = (TokenAuthentication,)
 
+    # GET /tables/:id/sync
+    def get(self, request, id=None, format=None):
+        """
+        Returns the table's most recent sync job, or null if it has never
+        been synced.
+        """
+        try:
+            user = check_authentication(request)
+            account = user.account
+            custom_table = CustomTable.objects.get(account=account, id=int(id))
+            job = (SyncJob.objects.filter(account=account, table=custom_table)
+                                  .order_by('-created_at').first())
+            return Response(job.get_api_format() if job else None,
+                            status=status.HTTP_200_OK)
+
+        except (TypeError, ValueError) as e:
+            return Response({ 'error': str(e) },
+                            status=status.HTTP_400_BAD_REQUEST)
+        except (Account.DoesNotExist, CustomTable.DoesNotExist) as e:
+            return Response({ 'error': str(e) },
+                            status=status.HTTP_400_BAD_REQUEST)
+
     # POST /tables/:id/sync
     def post(self, request, id=None, format=None):
+        """
+        Queues a sync of the table (run by the run_jobs command) and returns
+        the job. If a sync of the table is already queued or running, that
+        job is returned instead.
+        """
         try:
             user = check_authentication(request)
             account = user.account
             table_id = int(id)
             custom_table = CustomTable.objects.get(account=account, id=table_id)
-            default_source = DataSource.get_default()
-            sync_table(custom_table, user)
+            job, created = SyncJob.enqueue(user, custom_table)
 
-            return Response(custom_table.get_api_format(),
-                            status=status.HTTP_200_OK)
+            return Response(job.get_api_format(),
+                            status=(status.HTTP_202_ACCEPTED if created
+                                    else status.HTTP_200_OK))
 
         except (TypeError, ValueError) as e:
             return Response({ 'error': str(e) },
@@ -430,6 +507,25 @@ class CustomTableSyncView(APIView):
             return Response({ 'error': str(e) },
                             status=status.HTTP_400_BAD_REQUEST)
 
+class SyncJobView(APIView):
+
+    authentication_classes = (TokenAuthentication,)
+
+    # GET /jobs/:id
+    def get(self, request, id=None, format=None):
+        try:
+            user = check_authentication(request)
+            account = user.account
+            job = SyncJob.objects.get(account=account, id=int(id))
+            return Response(job.get_api_format(), status=status.HTTP_200_OK)
+
+        except (TypeError, ValueError) as e:
+            return Response({ 'error': str(e) },
+                            status=status.HTTP_400_BAD_REQUEST)
+        except (Account.DoesNotExist, SyncJob.DoesNotExist) as e:
+            return Response({ 'error': str(e) },
+                            status=status.HTTP_400_BAD_REQUEST)
+
 class CustomCompanySchemaView(APIView):
 
     authentication_classes = (TokenAuthentication,)
@@ -1,21 +1,67 @@
+import hashlib
 import json
 
+from django.core.cache import cache
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 
-from data.entity import match_person, match_company
+from data.entity import (match_person, match_company, match_people_bulk,
+                         match_companies_bulk, normalize)
+from data.portfolio import get_latest_employments
 from shared.auth import check_authentication
+from shared.coalesce import Coalescer, Superseded
+from shared.utils import stream_json_lines
 
+# Seconds to cache match results for identical (normalized) queries
+MATCH_CACHE_TTL = 30
+
+_coalescer = Coalescer()
+
+# Matched records whose people are formatted together in bulk matches
+API_FORMAT_CHUNK_SIZE = 500
+
+def get_matches(request, account, match_type, match_fn, data, count):
+    """
+    Cached and coalesced call to @match_fn (data.entity.match_person or
+    data.entity.match_company):
+
+    * Results are cached per account for MATCH_CACHE_TTL seconds, keyed by the
+      normalized input.
+    * Identical concurrent queries share one computation.
+    * With ?cancellable=true, a newer query from the same token supersedes an
+      older in-flight one, which raises Superseded.
+    """
+    data = { k: normalize(v) for k, v in data.iteritems() }
+    key = 'match:%s:%s:%s:%s' % (
+        match_type, account.id, count,
+        hashlib.md5(json.dumps(data, sort_keys=True)).hexdigest()
+    )
+
+    def compute(is_cancelled):
+        results = cache.get(key)
+        if results is None:
+            results = [
+                obj.get_api_format()
+                for obj in match_fn(data, account, count=count,
+                                    is_cancelled=is_cancelled)
+            ]
+            cache.set(key, results, MATCH_CACHE_TTL)
+        return results
+
+    owner = (request.META['HTTP_AUTHORIZATION']
+             if request.query_params.get('cancellable') == 'true' else None)
+    return _coalescer.run(key, compute, owner=owner)
 
 class MatchPerson(APIView):
     """
     WARNING: Matching is a slow process (O(MN^2), where M is the number of
-             results and N is the average length of the result). This could
-             block server threads, especially if the frontend makes repeated
-             calls as the user updates input data.
+             results and N is the average length of the result). While the
+             user updates input data, the frontend should pass
+             ?cancellable=true so that stale queries are dropped instead of
+             blocking server threads.
     """
 
     authentication_classes = (TokenAuthentication,)
@@ -39,12 +85,14 @@ class MatchPerson(APIView):
                 if k in request.query_params else ''
                 for k in self._VALID_FIELD_MAP
             }
-            return Response([
-                person.get_api_format()
-                for person in match_person(person_data, account,
-                                           count=self._NUM_RESULTS)
-            ], status=status.HTTP_200_OK)
-        except ValueError:
+            return Response(get_matches(request, account, 'person',
+                                        match_person, person_data,
+                                        self._NUM_RESULTS),
+                            status=status.HTTP_200_OK)
+        except Superseded as e:
+            return Response({ 'error': str(e) },
+                            status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
             return Response({ 'error': str(e) },
                             status=status.HTTP_400_BAD_REQUEST)
 
@@ -69,12 +117,136 @@ class MatchCompany(APIView):
                 if k in request.query_params else ''
                 for k in self._VALID_FIELD_MAP
             }
-            return Response([
-                company.get_api_format()
-                for company in match_company(company_data, account,
-                                             count=self._NUM_RESULTS)
-            ], status=status.HTTP_200_OK)
-        except ValueError:
+            return Response(get_matches(request, account, 'company',
+                                        match_company, company_data,
+                                        self._NUM_RESULTS),
+                            status=status.HTTP_200_OK)
+        except Superseded as e:
+            return Response({ 'error': str(e) },
+                            status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
             return Response({ 'error': str(e) },
                             status=status.HTTP_400_BAD_REQUEST)
 
+def get_records_data(records, field_map):
+    """
+    Maps each of the bulk request @records with @field_map.
+
+    Raises:
+        ValueError: If @records isn't a list of objects.
+    """
+    if not isinstance(records, list):
+        raise ValueError('Invalid records: expected a list')
+    records_data = []
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            raise ValueError('Invalid record %d: expected an object' % i)
+        records_data.append({ field_map[k]: record.get(k) or ''
+                              for k in field_map })
+    return records_data
+
+def get_api_people_matches(matches, chunk_size=API_FORMAT_CHUNK_SIZE):
+    """
+    Yields the API format of the people of each of @matches (as yielded by
+    match_people_bulk). The latest employments are loaded with one query per
+    @chunk_size records.
+    """
+    def format_chunk(chunk):
+        latest_employments = get_latest_employments(
+            set(person.id for people in chunk for person in people)
+        )
+        return [[person.get_api_format_with(latest_employments.get(person.id))
+                 for person in people]
+                for people in chunk]
+
+    chunk = []
+    for people in matches:
+        chunk.append(people)
+        if len(chunk) >= chunk_size:
+            for api_people in format_chunk(chunk):
+                yield api_people
+            chunk = []
+    for api_people in format_chunk(chunk):
+        yield api_people
+
+class MatchPersonBulk(APIView):
+    """
+    Matches many people in one request (e.g. for CSV imports). The account's
+    candidate set is loaded once for all records.
+    """
+
+    authentication_classes = (TokenAuthentication,)
+
+    _MAX_RESULTS = 10
+
+    # POST /match/person/bulk
+    def post(self, request, format=None):
+        """
+        Expected request body:
+        {
+            'records': [required] [{ 'firstName': [str], ... }, ...],
+            'count': [int]
+        }
+
+        Response (newline-delimited JSON, one line per record, in order):
+            { 'index': [int], 'matches': [<Person API format>, ...] }
+        """
+        try:
+            user = check_authentication(request)
+            account = user.account
+            request_json = json.loads(request.body)
+            count = min(int(request_json.get('count',
+                                             MatchPerson._NUM_RESULTS)),
+                        self._MAX_RESULTS)
+            people_data = get_records_data(request_json['records'],
+                                           MatchPerson._VALID_FIELD_MAP)
+            matches = match_people_bulk(people_data, account, count=count)
+            return stream_json_lines(
+                { 'index': i, 'matches': api_people }
+                for i, api_people in enumerate(get_api_people_matches(matches))
+            )
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return Response({ 'error': str(e) },
+                            status=status.HTTP_400_BAD_REQUEST)
+
+class MatchCompanyBulk(APIView):
+    """
+    Matches many companies in one request (e.g. for CSV imports). The
+    account's companies are loaded and indexed once for all records.
+    """
+
+    authentication_classes = (TokenAuthentication,)
+
+    _MAX_RESULTS = 10
+
+    # POST /match/company/bulk
+    def post(self, request, format=None):
+        """
+        Expected request body:
+        {
+            'records': [required] [{ 'name': [str], ... }, ...],
+            'count': [int]
+        }
+
+        Response (newline-delimited JSON, one line per record, in order):
+            { 'index': [int], 'matches': [<Company API format>, ...] }
+        """
+        try:
+            user = check_authentication(request)
+            account = user.account
+            request_json = json.loads(request.body)
+            count = min(int(request_json.get('count',
+                                             MatchCompany._NUM_RESULTS)),
+                        self._MAX_RESULTS)
+            companies_data = get_records_data(request_json['records'],
+                                              MatchCompany._VALID_FIELD_MAP)
+            matches = match_companies_bulk(companies_data, account,
+                                           count=count)
+            return stream_json_lines(
+                { 'index': i,
+                  'matches': [c.get_api_format() for c in companies] }
+                for i, companies in enumerate(matches)
+            )
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return Response({ 'error': str(e) },
+                            status=status.HTTP_400_BAD_REQUEST)
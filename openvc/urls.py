@@ -147,8 +147,12 @@ urlpatterns = [
     url(r'^api/v1/sources$', custom_views.DataSourceView.as_view()),
     url(r'^api/v1/tables/(?P<id>[0-9]+)/sync$',
         custom_views.CustomTableSyncView.as_view()),
+    url(r'^api/v1/jobs/(?P<id>[0-9]+)$', custom_views.SyncJobView.as_view()),
 
     # Entity resolution API
     url(r'^api/v1/match/person$', match_views.MatchPerson.as_view()),
     url(r'^api/v1/match/company$', match_views.MatchCompany.as_view()),
+    url(r'^api/v1/match/person/bulk$', match_views.MatchPersonBulk.as_view()),
+    url(r'^api/v1/match/company/bulk$',
+        match_views.MatchCompanyBulk.as_view()),
 ]
@@ -0,0 +1,98 @@
+import itertools
+import threading
+
+class Superseded(Exception):
+    pass
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = []         # [(owner, ticket), ...]
+        self.superseded = set([]) # Tickets superseded when the call finished
+
+class Coalescer(object):
+    """
+    Request coalescing for expensive, idempotent computations:
+
+    * Identical concurrent calls (same @key) share one computation.
+    * A newer call from the same @owner (e.g. an auth token) supersedes that
+      owner's older in-flight calls, which raise Superseded instead of
+      returning a stale result. A computation is cancelled once every caller
+      waiting on it has been superseded.
+
+    State is per-process, so only calls handled by the same server process are
+    coalesced.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tickets = itertools.count(1)
+        self.inflight = {} # key => _Call
+        self.latest = {}   # owner => ticket of the owner's latest call
+        self.waiting = {}  # owner => number of the owner's calls in flight
+
+    def __is_superseded(self, owner, ticket):
+        return owner is not None and self.latest.get(owner, ticket) != ticket
+
+    def __is_cancelled(self, call):
+        with self.lock:
+            return all(self.__is_superseded(owner, ticket)
+                       for owner, ticket in call.waiters)
+
+    def run(self, key, fn, owner=None):
+        """
+        Args:
+            key [hashable]: Identifies identical computations.
+            fn [function]: fn(is_cancelled) computes the result. It should
+                           check is_cancelled() periodically and raise
+                           Superseded when it returns True.
+            owner [hashable]: Caller identity for superseding, or None to
+                              never be superseded.
+        """
+        while True:
+            with self.lock:
+                ticket = next(self.tickets)
+                if owner is not None:
+                    self.latest[owner] = ticket
+                call = self.inflight.get(key)
+                leader = call is None
+                if leader:
+                    call = self.inflight[key] = _Call()
+                call.waiters.append((owner, ticket))
+                if owner is not None:
+                    self.waiting[owner] = self.waiting.get(owner, 0) + 1
+
+            if leader:
+                try:
+                    call.result = fn(lambda: self.__is_cancelled(call))
+                except Exception as e:
+                    call.error = e
+                finally:
+                    with self.lock:
+                        del self.inflight[key]
+                        for waiter_owner, waiter_ticket in call.waiters:
+                            if self.__is_superseded(waiter_owner,
+                                                    waiter_ticket):
+                                call.superseded.add(waiter_ticket)
+                            if waiter_owner is None:
+                                continue
+                            # The latest ticket is kept while older calls of
+                            # the owner are still in flight
+                            self.waiting[waiter_owner] -= 1
+                            if not self.waiting[waiter_owner]:
+                                del self.waiting[waiter_owner]
+                                self.latest.pop(waiter_owner, None)
+                    call.done.set()
+            else:
+                call.done.wait()
+
+            if ticket in call.superseded:
+                raise Superseded('Superseded by a newer request')
+            if isinstance(call.error, Superseded):
+                # Joined a computation just as it was cancelled; start over
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
@@ -0,0 +1,136 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from shared.coalesce import Coalescer, Superseded
+
+#############
+# Coalescer #
+#############
+
+class CoalescerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.coalescer = Coalescer()
+        self.calls = []
+        self.release = threading.Event()
+        self.results = {}
+
+    def compute(self, result):
+        """
+        Returns a fn for Coalescer.run that blocks until self.release is set,
+        then returns @result, or raises Superseded if cancelled by then.
+        """
+        def fn(is_cancelled):
+            self.calls.append(result)
+            while not self.release.wait(0.01):
+                pass
+            if is_cancelled():
+                raise Superseded('Cancelled')
+            return result
+        return fn
+
+    def start(self, name, key, result, owner=None):
+        def run():
+            try:
+                self.results[name] = self.coalescer.run(
+                    key, self.compute(result), owner=owner
+                )
+            except Superseded as e:
+                self.results[name] = e
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def wait_for_waiters(self, key, count):
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            with self.coalescer.lock:
+                call = self.coalescer.inflight.get(key)
+                if call and len(call.waiters) >= count:
+                    return
+            time.sleep(0.01)
+        self.fail('%d callers never waited on %s' % (count, key))
+
+    def join(self, threads):
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_identical_calls_run_once(self):
+        threads = [self.start(i, 'acme', 'result') for i in range(5)]
+        self.wait_for_waiters('acme', 5)
+        self.join(threads)
+        self.assertEqual(self.calls, ['result'])
+        self.assertEqual(self.results, { i: 'result' for i in range(5) })
+        self.assertEqual(self.coalescer.inflight, {})
+
+    def test_newer_call_cancels_superseded_computation(self):
+        threads = [self.start('old', 'acm', 'old result', owner='token')]
+        self.wait_for_waiters('acm', 1)
+        threads.append(self.start('new', 'acme', 'new result', owner='token'))
+        self.wait_for_waiters('acme', 1)
+        self.join(threads)
+        self.assertIsInstance(self.results['old'], Superseded)
+        self.assertEqual(self.results['new'], 'new result')
+        self.assertEqual((self.coalescer.latest, self.coalescer.waiting),
+                         ({}, {}))
+
+    def test_superseded_caller_of_identical_call(self):
+        # The newer call joins the computation and gets its result
+        threads = [self.start('old', 'acme', 'result', owner='token')]
+        self.wait_for_waiters('acme', 1)
+        threads.append(self.start('new', 'acme', 'result', owner='token'))
+        self.wait_for_waiters('acme', 2)
+        self.join(threads)
+        self.assertEqual(self.calls, ['result'])
+        self.assertIsInstance(self.results['old'], Superseded)
+        self.assertEqual(self.results['new'], 'result')
+
+    def test_shared_computation_isnt_cancelled(self):
+        # Another owner still waits on the superseded owner's computation
+        threads = [self.start('old', 'acm', 'result', owner='token'),
+                   self.start('other', 'acm', 'result', owner='other')]
+        self.wait_for_waiters('acm', 2)
+        threads.append(self.start('new', 'acme', 'new result',
+                                  owner='token'))
+        self.wait_for_waiters('acme', 1)
+        self.join(threads)
+        self.assertIsInstance(self.results['old'], Superseded)
+        self.assertEqual(self.results['other'], 'result')
+        self.assertEqual(self.results['new'], 'new result')
+        self.assertEqual(sorted(self.calls), ['new result', 'result'])
+        self.assertEqual((self.coalescer.latest, self.coalescer.waiting),
+                         ({}, {}))
+
+    def test_calls_without_owner_arent_superseded(self):
+        threads = [self.start('first', 'acm', 'result')]
+        self.wait_for_waiters('acm', 1)
+        threads.append(self.start('second', 'acme', 'new result'))
+        self.wait_for_waiters('acme', 1)
+        self.join(threads)
+        self.assertEqual(self.results, { 'first': 'result',
+                                         'second': 'new result' })
+
+    def test_errors_are_raised_in_every_caller(self):
+        def fail(is_cancelled):
+            self.calls.append(1)
+            self.release.wait(5)
+            raise ValueError('failed')
+
+        errors = []
+        def run():
+            try:
+                self.coalescer.run('acme', fail)
+            except ValueError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        self.wait_for_waiters('acme', 3)
+        self.join(threads)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(errors), 3)
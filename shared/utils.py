@@ -2,6 +2,8 @@ import datetime
 import re
 from dateutil import parser as dateparser
 from dateutil.relativedelta import relativedelta
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
 
 def parse_date(datestr):
     if datestr:
@@ -52,3 +54,13 @@ def camel_to_snake(s):
     s2 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', s)
     return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s2).lower()
 
+def stream_json_lines(rows, status=200):
+    """
+    Streams @rows (an iterable of JSON-serializable objects) as newline-
+    delimited JSON, serializing each row as it is produced.
+    """
+    encoder = JSONEncoder()
+    return StreamingHttpResponse(
+        (encoder.encode(row) + '\n' for row in rows),
+        content_type='application/x-ndjson', status=status
+    )
@@ -2,6 +2,7 @@ from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from data.models import Person, Company, Deal
+from data.portfolio import get_api_portfolio
 from contacts.models import Interaction
 
 class CusomUserManager(BaseUserManager):
@@ -69,10 +70,9 @@ class Account(models.Model):
 
     def get_api_portfolio(self):
         if self.company.is_investor():
-            return [
-                company.get_api_portco_format(self.company.investor)
-                for company in self.get_portfolio()
-            ]
+            return get_api_portfolio(
+                self, self.account_portfolio.order_by('company__name')
+            )
         else:
             return []
 